@@ -17,13 +17,22 @@
 # You should have received a copy of the GNU General Public License
 # along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
 import os
 import subprocess
+import threading
+import time
 
 
 DEFAULT_PATH = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
 CHROOT_ARGS = ['chroot']
 SUDO_ARGS = ['sudo', '-E']
+# How often run_many() checks whether its commands have exited, in seconds.
+RUN_MANY_POLL_INTERVAL = 0.05
+
+# If set, called with a record (a dict) of every command once it has
+# finished; see command_trace.
+trace_hook = None
 
 
 def sanitize_path(env):
@@ -63,16 +72,131 @@ def run(args, as_root=False, chroot=None, stdin=None, stdout=None,
     return Popen(args, stdin=stdin, stdout=stdout, stderr=stderr, cwd=cwd)
 
 
+class Command(object):
+    """A command to be run by run_many(), with the arguments of run()."""
+
+    def __init__(self, args, as_root=False, chroot=None, stdin=None,
+                 stdout=None, stderr=None, cwd=None):
+        self.args = args
+        self.as_root = as_root
+        self.chroot = chroot
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.cwd = cwd
+
+    def start(self):
+        """Start the command and return its Popen instance."""
+        return run(self.args, as_root=self.as_root, chroot=self.chroot,
+                   stdin=self.stdin, stdout=self.stdout, stderr=self.stderr,
+                   cwd=self.cwd)
+
+
+def run_many(commands, max_workers=None, fail_fast=True):
+    """Run the given commands, several at a time.
+
+    Commands are started in the given order, with at most max_workers of
+    them running at any time.  The running commands are polled, so a
+    failure is noticed as soon as the failed command exits, whatever its
+    place in the list.
+
+    :param commands: A list of Command instances, or of lists of arguments
+        to be run as they are.
+    :param max_workers: The maximum number of commands to run at once; all
+        of them if None.
+    :param fail_fast: If True, as soon as a command is found to have failed
+        no more commands are started and the ones still running are
+        terminated.  Otherwise all commands are run.
+    :return: The return codes of the commands, in order.
+    :raises SubcommandNonZeroReturnValue: if a command failed, or
+        SubcommandsNonZeroReturnValue if more than one did.
+    """
+    commands = [
+        command if isinstance(command, Command) else Command(command)
+        for command in commands]
+    if max_workers is None:
+        max_workers = max(len(commands), 1)
+    pending = list(reversed(list(enumerate(commands))))
+    # (index, Popen) of the commands started but not waited for yet.
+    running = []
+    returncodes = [None] * len(commands)
+    errors = []
+    try:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                index, command = pending.pop()
+                running.append((index, command.start()))
+            finished = [item for item in running if item[1].poll() is not None]
+            if not finished:
+                time.sleep(RUN_MANY_POLL_INTERVAL)
+                continue
+            for index, proc in finished:
+                running.remove((index, proc))
+                try:
+                    returncodes[index] = proc.wait()
+                except SubcommandNonZeroReturnValue, e:
+                    returncodes[index] = e.retval
+                    errors.append((index, e))
+            if errors and fail_fast:
+                del pending[:]
+                break
+    finally:
+        # Either a command failed and we're failing fast or something went
+        # wrong while waiting; don't leave children behind.
+        for _, proc in running:
+            try:
+                proc.terminate()
+            except OSError:
+                pass
+            try:
+                proc.wait()
+            except SubcommandNonZeroReturnValue:
+                pass
+    errors = [error for _, error in sorted(errors, key=lambda item: item[0])]
+    if len(errors) == 1:
+        raise errors[0]
+    elif errors:
+        raise SubcommandsNonZeroReturnValue(errors)
+    return returncodes
+
+
+def _split_command(args):
+    """Return whether args run under sudo, the chroot and the command."""
+    if isinstance(args, basestring):
+        return False, None, [args]
+    args = list(args)
+    sudo = args[:len(SUDO_ARGS)] == SUDO_ARGS
+    if sudo:
+        args = args[len(SUDO_ARGS):]
+    chroot = None
+    if (args[:len(CHROOT_ARGS)] == CHROOT_ARGS and
+            len(args) > len(CHROOT_ARGS)):
+        chroot = args[len(CHROOT_ARGS)]
+        args = args[len(CHROOT_ARGS) + 1:]
+    return sudo, chroot, args
+
+
 class Popen(subprocess.Popen):
     """A version of Popen which raises an error on non-zero returncode.
 
     Once the subprocess completes we check its returncode and raise
     SubcommandNonZeroReturnValue if it's non-zero.
+
+    If trace_hook is set, a record of the command is passed to it once the
+    subprocess completes.
     """
 
     def __init__(self, args, env=None, **kwargs):
         self._my_args = args
         self.except_on_cmd_fail = True
+        self._trace = None
+        if trace_hook is not None:
+            sudo, chroot, command = _split_command(args)
+            self._trace = dict(
+                argv=list(command), sudo=sudo, chroot=chroot,
+                thread=threading.current_thread().name, start=time.time(),
+                end=None, returncode=None, user=None, system=None,
+                stdin_bytes=None, stdout_bytes=None, stderr_bytes=None)
         if env is None:
             env = os.environ.copy()
         env['LC_ALL'] = 'C'
@@ -82,10 +206,62 @@ class Popen(subprocess.Popen):
         sanitize_path(env)
         super(Popen, self).__init__(args, env=env, **kwargs)
 
+    def _wait4(self):
+        """Wait for the subprocess like wait(), also getting its rusage."""
+        while True:
+            try:
+                _, status, rusage = os.wait4(self.pid, 0)
+                break
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    # Reaped elsewhere; the rusage is lost.
+                    return super(Popen, self).wait()
+                raise
+        self._handle_exitstatus(status)
+        self._trace['user'] = rusage.ru_utime
+        self._trace['system'] = rusage.ru_stime
+        return self.returncode
+
+    def poll(self):
+        if self._trace is None or self.returncode is not None:
+            return super(Popen, self).poll()
+        # Reap the subprocess ourselves, so that its rusage isn't lost.
+        try:
+            pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+        except OSError, e:
+            if e.errno in (errno.EINTR, errno.ECHILD):
+                return super(Popen, self).poll()
+            raise
+        if pid == 0:
+            return None
+        self._handle_exitstatus(status)
+        self._trace['user'] = rusage.ru_utime
+        self._trace['system'] = rusage.ru_stime
+        return self.returncode
+
+    def _end_trace(self):
+        if self._trace is None or self._trace['end'] is not None:
+            return
+        self._trace['end'] = time.time()
+        self._trace['returncode'] = self.returncode
+        hook = trace_hook
+        if hook is not None:
+            hook(self._trace)
+
     def communicate(self, input=None):
         self.except_on_cmd_fail = False
         stdout, stderr = super(Popen, self).communicate(input)
         self.except_on_cmd_fail = True
+        if self._trace is not None:
+            if input is not None:
+                self._trace['stdin_bytes'] = len(input)
+            if stdout is not None:
+                self._trace['stdout_bytes'] = len(stdout)
+            if stderr is not None:
+                self._trace['stderr_bytes'] = len(stderr)
+            self._end_trace()
 
         if self.returncode != 0:
             raise SubcommandNonZeroReturnValue(self._my_args,
@@ -95,7 +271,14 @@ class Popen(subprocess.Popen):
         return stdout, stderr
 
     def wait(self):
-        returncode = super(Popen, self).wait()
+        if self._trace is not None and self.returncode is None:
+            returncode = self._wait4()
+        else:
+            returncode = super(Popen, self).wait()
+        # communicate() ends the trace itself, once it knows how much went
+        # through the pipes.
+        if self.except_on_cmd_fail:
+            self._end_trace()
         if returncode != 0 and self.except_on_cmd_fail:
             raise SubcommandNonZeroReturnValue(self._my_args, returncode)
         return returncode
@@ -119,3 +302,20 @@ class SubcommandNonZeroReturnValue(Exception):
             message += '\nstderr was\n{0}'.format(self.stderr)
 
         return message
+
+
+class SubcommandsNonZeroReturnValue(SubcommandNonZeroReturnValue):
+    """More than one of the commands given to run_many() failed.
+
+    The command and return value are those of the first of them; all the
+    failures are in errors.
+    """
+
+    def __init__(self, errors):
+        first = errors[0]
+        super(SubcommandsNonZeroReturnValue, self).__init__(
+            first.command, first.retval, first.stdout, first.stderr)
+        self.errors = errors
+
+    def __str__(self):
+        return '\n'.join(str(error) for error in self.errors)
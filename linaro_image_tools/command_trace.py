@@ -0,0 +1,183 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record every command run through cmd_runner, for finding slow steps.
+
+Once enable() has been called, each command run by cmd_runner.Popen is
+recorded when it finishes: its argv, whether it ran under sudo or in a
+chroot, when it started and ended, its exit status, the user and system CPU
+time it (and the children it waited for) used and the bytes that went
+through its pipes when communicate() was used.
+
+The records can be written as a Chrome trace-event file, to be loaded in
+chrome://tracing or Perfetto, and summarized per command.  trace_at_exit()
+does both when the process exits.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+
+from linaro_image_tools import cmd_runner
+from linaro_image_tools.timings import format_bytes
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+_lock = threading.Lock()
+_records = []
+
+
+def _record(record):
+    with _lock:
+        _records.append(record)
+
+
+def enable():
+    """Start recording the commands run through cmd_runner."""
+    cmd_runner.trace_hook = _record
+
+
+def disable():
+    """Stop recording commands."""
+    cmd_runner.trace_hook = None
+
+
+def get_records():
+    """Return the commands recorded so far, in the order they finished."""
+    with _lock:
+        return list(_records)
+
+
+def reset():
+    """Forget all the commands recorded so far."""
+    with _lock:
+        del _records[:]
+
+
+def command_name(record):
+    """Return the name commands are grouped by: the program's base name."""
+    if not record['argv']:
+        return '?'
+    return os.path.basename(record['argv'][0])
+
+
+def to_chrome_trace(records=None):
+    """Return the given (or recorded) commands as Chrome trace events.
+
+    Each command is a complete ('X') event on the track of the thread that
+    ran it, with its details in the event's args.
+    """
+    if records is None:
+        records = get_records()
+    pid = os.getpid()
+    tids = {}
+    events = []
+    for record in sorted(records, key=lambda record: record['start']):
+        thread = record['thread']
+        if thread not in tids:
+            tids[thread] = len(tids) + 1
+            events.append(dict(
+                name='thread_name', ph='M', pid=pid, tid=tids[thread],
+                args=dict(name=thread)))
+        args = dict(
+            (key, record[key]) for key in (
+                'argv', 'sudo', 'chroot', 'returncode', 'user', 'system',
+                'stdin_bytes', 'stdout_bytes', 'stderr_bytes'))
+        events.append(dict(
+            name=command_name(record), cat='command', ph='X', pid=pid,
+            tid=tids[thread],
+            ts=int(record['start'] * 1000000),
+            dur=int((record['end'] - record['start']) * 1000000),
+            args=args))
+    return dict(traceEvents=events, displayTimeUnit='ms')
+
+
+def write_chrome_trace(path, records=None):
+    """Write the given (or recorded) commands to path as a Chrome trace."""
+    with open(path, 'w') as fd:
+        json.dump(to_chrome_trace(records), fd)
+
+
+def summarize(records=None):
+    """Group the given (or recorded) commands by command_name().
+
+    Return a list of dicts with the name, count, failures, wall, user and
+    system times and pipe bytes of each group, the slowest first.
+    """
+    if records is None:
+        records = get_records()
+    groups = {}
+    for record in records:
+        name = command_name(record)
+        group = groups.setdefault(name, dict(
+            name=name, count=0, failures=0, wall=0.0, user=0.0, system=0.0,
+            pipe_bytes=0))
+        group['count'] += 1
+        if record['returncode'] != 0:
+            group['failures'] += 1
+        group['wall'] += record['end'] - record['start']
+        group['user'] += record['user'] or 0.0
+        group['system'] += record['system'] or 0.0
+        for key in ('stdin_bytes', 'stdout_bytes', 'stderr_bytes'):
+            group['pipe_bytes'] += record[key] or 0
+    return sorted(
+        groups.values(), key=lambda group: (-group['wall'], group['name']))
+
+
+def format_summary(records=None):
+    """Return the summary of the commands as a human-readable table."""
+    header = ('Command', 'Runs', 'Failed', 'Wall', 'User', 'System', 'Piped')
+    rows = [header]
+    for group in summarize(records):
+        rows.append((
+            group['name'],
+            '%d' % group['count'],
+            '%d' % group['failures'],
+            '%.1fs' % group['wall'],
+            '%.1fs' % group['user'],
+            '%.1fs' % group['system'],
+            format_bytes(group['pipe_bytes'])))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells.extend(
+            cell.rjust(width) for cell, width in zip(row[1:], widths[1:]))
+        lines.append('  '.join(cells))
+    return '\n'.join(lines)
+
+
+def trace_at_exit(path):
+    """Record commands from now on, and report them when we exit.
+
+    The trace is written to path and the summary is logged.  Should be
+    called before registering any other atexit handler whose commands are
+    to be included, as atexit handlers run in reverse order.
+    """
+    enable()
+
+    def report():
+        try:
+            write_chrome_trace(path)
+        except IOError, e:
+            logger.error(
+                "Could not write command trace to %s: %s" % (path, e))
+        logger.info("Commands:\n%s" % format_summary())
+    atexit.register(report)
@@ -0,0 +1,239 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Check files against sha1sum/sha256sum style hash files, in process.
+
+Files are hashed with hashlib, a chunk at a time, several files at once
+(hashlib releases the GIL while hashing big chunks, so threads are enough).
+Digests can be kept in a HashCache, keyed on the path, size, mtime and inode
+of the file they were computed from, so checking a file that hasn't changed
+since the last run doesn't read it again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+# Hash files don't say which algorithm they use, but the length of the
+# hexadecimal digests does.
+ALGORITHMS_BY_DIGEST_LENGTH = {
+    40: 'sha1',
+    64: 'sha256',
+}
+
+READ_CHUNK_SIZE = 1024 * 1024
+DEFAULT_WORKERS = 4
+
+
+class InvalidHashFile(Exception):
+    """A line of a hash file is not a digest followed by a file name."""
+
+
+class DigestMismatch(Exception):
+    """The digest of a file doesn't match the one in its hash file."""
+
+
+def parse_hash_file(hash_file):
+    """Return the (file name, algorithm, digest) entries of a hash file.
+
+    The file names are relative to the directory of the hash file, as with
+    sha1sum -c.
+
+    :raises InvalidHashFile: if a line can't be parsed.
+    """
+    entries = []
+    with open(hash_file) as fd:
+        for line in fd:
+            line = line.rstrip('\n')
+            if line.strip() == '':
+                continue
+            fields = line.split(None, 1)
+            if len(fields) != 2:
+                raise InvalidHashFile(
+                    "%s: invalid line %r" % (hash_file, line))
+            digest, name = fields
+            algorithm = ALGORITHMS_BY_DIGEST_LENGTH.get(len(digest))
+            if algorithm is None:
+                raise InvalidHashFile(
+                    "%s: unknown digest length in %r" % (hash_file, line))
+            # A leading '*' marks files hashed in binary mode, which makes
+            # no difference here.
+            if name.startswith('*'):
+                name = name[1:]
+            entries.append((name, algorithm, digest.lower()))
+    return entries
+
+
+def get_expected_digest(hash_files, path):
+    """Return the (algorithm, digest) given for path in the hash files.
+
+    Files are matched on their base name.  Return None if the file is not
+    listed or the hash files can't be read, and leave it to
+    check_hash_files() to report that.
+    """
+    name = os.path.basename(path)
+    for hash_file in hash_files:
+        try:
+            entries = parse_hash_file(hash_file)
+        except (IOError, InvalidHashFile):
+            continue
+        for entry_name, algorithm, digest in entries:
+            if entry_name == name:
+                return algorithm, digest
+    return None
+
+
+def hash_file(path, algorithm):
+    """Return the hexadecimal digest of the given file."""
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as fd:
+        while True:
+            data = fd.read(READ_CHUNK_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+class HashCache(object):
+    """Digests of files, valid as long as the files don't change.
+
+    Entries are keyed on the real path of the file and are only used if its
+    size, mtime and inode are still the ones it had when it was hashed.  The
+    cache is kept in a JSON file, which is only rewritten by save().
+    """
+
+    def __init__(self, cache_file=None):
+        """Create a HashCache.
+
+        :param cache_file: The file to load the cache from and save it to.
+            If None, the cache only lasts as long as this object.
+        """
+        self.cache_file = cache_file
+        self._entries = {}
+        self._lock = threading.Lock()
+        if cache_file is not None:
+            try:
+                with open(cache_file) as fd:
+                    self._entries = json.load(fd)
+            except (IOError, ValueError):
+                pass
+
+    @staticmethod
+    def _file_id(st):
+        return [st.st_size, st.st_mtime, st.st_ino]
+
+    def get_digest(self, path, algorithm):
+        """Return the digest of the given file, hashing it only if needed."""
+        real_path = os.path.realpath(path)
+        file_id = self._file_id(os.stat(real_path))
+        with self._lock:
+            entry = self._entries.get(real_path)
+            if entry is not None and entry['id'] == file_id:
+                digest = entry['digests'].get(algorithm)
+                if digest is not None:
+                    return digest
+        digest = hash_file(real_path, algorithm)
+        # Only cache the digest if the file didn't change while being
+        # hashed.
+        if self._file_id(os.stat(real_path)) == file_id:
+            with self._lock:
+                entry = self._entries.get(real_path)
+                if entry is None or entry['id'] != file_id:
+                    entry = self._entries[real_path] = dict(
+                        id=file_id, digests={})
+                entry['digests'][algorithm] = digest
+        return digest
+
+    def save(self):
+        """Write the cache to its file, dropping the stale entries."""
+        if self.cache_file is None:
+            return
+        with self._lock:
+            entries = {}
+            for path, entry in self._entries.items():
+                try:
+                    file_id = self._file_id(os.stat(path))
+                except OSError:
+                    continue
+                if file_id == entry['id']:
+                    entries[path] = entry
+            self._entries = entries
+            cache_dir = os.path.dirname(self.cache_file)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = '%s.tmp.%d' % (self.cache_file, os.getpid())
+            with open(tmp_file, 'w') as fd:
+                json.dump(entries, fd)
+            os.rename(tmp_file, self.cache_file)
+
+
+def check_hash_files(hash_files, hash_cache=None, workers=DEFAULT_WORKERS,
+                     skip=()):
+    """Check the files listed in the given hash files.
+
+    :param hash_cache: A HashCache to get the digests from, if any.
+    :param workers: The number of files to hash at the same time.
+    :param skip: The names of files not to check here, e.g. because their
+        digests are checked while they are unpacked.
+    :return: A list with the names, as given in the hash files, of the files
+        whose digests match.  Files that are missing or whose digests don't
+        match are left out.
+    """
+    if hash_cache is None:
+        hash_cache = HashCache()
+    checks = []
+    for hash_file in hash_files:
+        hash_dir = os.path.dirname(hash_file)
+        for name, algorithm, digest in parse_hash_file(hash_file):
+            if name in skip:
+                continue
+            checks.append(
+                (name, os.path.join(hash_dir, name), algorithm, digest))
+
+    def check(args):
+        name, path, algorithm, digest = args
+        try:
+            return hash_cache.get_digest(path, algorithm) == digest
+        except (IOError, OSError):
+            return False
+
+    if not checks:
+        return []
+    pool = ThreadPool(min(workers, len(checks)))
+    try:
+        results = pool.map(check, checks)
+    finally:
+        pool.close()
+        pool.join()
+    try:
+        hash_cache.save()
+    except (IOError, OSError), e:
+        # The cache only saves time; the checks are done.
+        logging.getLogger(__name__).debug(
+            "Could not save hash cache %s: %s" % (hash_cache.cache_file, e))
+    return [name for (name, _, _, _), ok in zip(checks, results) if ok]
+
+
+def default_hash_cache_file():
+    """Return the default location of the hash cache."""
+    cache_home = os.environ.get(
+        'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'linaro-image-tools', 'hashes.json')
@@ -0,0 +1,535 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Random access to the members of .tar.gz files.
+
+A gzip stream can normally only be read from its start.  Like zlib's zran
+example, a GzipIndex records checkpoints while the stream is decompressed
+once: every SPAN bytes of output, at the next deflate block boundary, it
+keeps the offset in the compressed stream, the bit offset within that byte
+and the last 32K of output (the most a deflate block can refer back to).
+Decompression can then be resumed from any checkpoint, so reading any part
+of the uncompressed stream means decompressing at most SPAN bytes plus the
+part itself.
+
+The index also records the tar members, so open_tarfile() returns a TarFile
+that knows its members without reading the archive and reads each of them
+from the nearest checkpoint.  Indexes are saved next to the tarballs (or in
+the user's cache directory) and reused until the tarballs change.
+
+zlib's Python module doesn't expose what is needed to stop at block
+boundaries or resume from one, so libz is used through ctypes.  If it can't
+be loaded, open_tarfile() falls back to a plain TarFile.
+"""
+
+import base64
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import zlib
+
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+SPAN = 4 * 1024 * 1024
+WINDOW_SIZE = 32 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+# The suffix added to the tarball's file name to get its index.
+INDEX_SUFFIX = '.gzindex'
+# Bump whenever the on-disk layout changes, so that old indexes are ignored.
+INDEX_FORMAT = 2
+
+# From zlib.h.
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+# Raw deflate, and gzip or zlib with header auto-detection.
+RAW_WBITS = -15
+AUTO_WBITS = 32 + 15
+
+# The TarInfo attributes kept in the index for each member.
+MEMBER_ATTRIBUTES = (
+    'name', 'mode', 'uid', 'gid', 'size', 'mtime', 'type', 'linkname',
+    'uname', 'gname', 'devmajor', 'devminor', 'offset', 'offset_data')
+
+
+class GzipIndexError(Exception):
+    """A gzip file could not be indexed or read through its index."""
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ('next_in', ctypes.c_void_p),
+        ('avail_in', ctypes.c_uint),
+        ('total_in', ctypes.c_ulong),
+        ('next_out', ctypes.c_void_p),
+        ('avail_out', ctypes.c_uint),
+        ('total_out', ctypes.c_ulong),
+        ('msg', ctypes.c_char_p),
+        ('state', ctypes.c_void_p),
+        ('zalloc', ctypes.c_void_p),
+        ('zfree', ctypes.c_void_p),
+        ('opaque', ctypes.c_void_p),
+        ('data_type', ctypes.c_int),
+        ('adler', ctypes.c_ulong),
+        ('reserved', ctypes.c_ulong),
+    ]
+
+
+_libz = None
+
+
+def _get_libz():
+    """Return libz loaded with ctypes, or None if it can't be."""
+    global _libz
+    if _libz is None:
+        name = ctypes.util.find_library('z')
+        try:
+            libz = ctypes.CDLL(name or 'libz.so.1')
+        except OSError:
+            libz = False
+        else:
+            libz.zlibVersion.restype = ctypes.c_char_p
+            for func in (libz.inflateInit2_, libz.inflate, libz.inflateEnd,
+                         libz.inflatePrime, libz.inflateSetDictionary):
+                func.restype = ctypes.c_int
+        _libz = libz
+    return _libz or None
+
+
+def available():
+    """Can gzip files be indexed here?"""
+    return _get_libz() is not None
+
+
+class _Inflater(object):
+    """A zlib inflate stream, stopping at the end of each deflate block."""
+
+    def __init__(self, wbits):
+        self._libz = _get_libz()
+        if self._libz is None:
+            raise GzipIndexError("libz is not available")
+        self._strm = _ZStream()
+        self._input = None
+        self._out = ctypes.create_string_buffer(READ_CHUNK_SIZE)
+        ret = self._libz.inflateInit2_(
+            ctypes.byref(self._strm), wbits, self._libz.zlibVersion(),
+            ctypes.sizeof(self._strm))
+        if ret != Z_OK:
+            raise GzipIndexError("inflateInit2 failed: %d" % ret)
+
+    def close(self):
+        if self._strm is not None:
+            self._libz.inflateEnd(ctypes.byref(self._strm))
+            self._strm = None
+
+    def prime(self, bits, value):
+        """Feed the bits of a byte split by a block boundary."""
+        self._libz.inflatePrime(ctypes.byref(self._strm), bits, value)
+
+    def set_dictionary(self, window):
+        self._libz.inflateSetDictionary(
+            ctypes.byref(self._strm), window, len(window))
+
+    @property
+    def needs_input(self):
+        return self._strm.avail_in == 0
+
+    @property
+    def total_in(self):
+        return self._strm.total_in
+
+    @property
+    def total_out(self):
+        return self._strm.total_out
+
+    @property
+    def at_block_boundary(self):
+        # Set after a block ends, unless it was the last one.
+        data_type = self._strm.data_type
+        return bool(data_type & 128) and not data_type & 64
+
+    @property
+    def pending_bits(self):
+        return self._strm.data_type & 7
+
+    def feed(self, data):
+        # Keep a reference to data, as the stream points into it.
+        self._input = data
+        self._strm.next_in = ctypes.cast(
+            ctypes.c_char_p(data), ctypes.c_void_p)
+        self._strm.avail_in = len(data)
+
+    def inflate(self, flush=Z_NO_FLUSH):
+        """Decompress some of the input.
+
+        :return: A tuple with the output and whether the end of the deflate
+            stream was reached.
+        """
+        self._strm.next_out = ctypes.cast(self._out, ctypes.c_void_p)
+        self._strm.avail_out = len(self._out)
+        ret = self._libz.inflate(ctypes.byref(self._strm), flush)
+        if ret not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+            raise GzipIndexError(
+                "inflate failed: %s" % (self._strm.msg or ret))
+        produced = len(self._out) - self._strm.avail_out
+        return ctypes.string_at(self._out, produced), ret == Z_STREAM_END
+
+
+class _IndexingReader(object):
+    """Read a gzip file from its start, recording checkpoints on the way."""
+
+    def __init__(self, fd, span):
+        self.fd = fd
+        self.span = span
+        self.checkpoints = []
+        self._inflater = _Inflater(AUTO_WBITS)
+        self._window = ''
+        self._buffer = ''
+        self._eof = False
+
+    def close(self):
+        self._inflater.close()
+
+    def _fill(self):
+        inflater = self._inflater
+        if inflater.needs_input:
+            data = self.fd.read(READ_CHUNK_SIZE)
+            if not data:
+                raise GzipIndexError("Truncated gzip file")
+            inflater.feed(data)
+        output, end = inflater.inflate(Z_BLOCK)
+        if output:
+            self._buffer += output
+            self._window = (self._window + output)[-WINDOW_SIZE:]
+        if end:
+            self._eof = True
+            # Resuming from a checkpoint only works within a single gzip
+            # member.
+            if not inflater.needs_input or self.fd.read(1):
+                raise GzipIndexError("Multi-member gzip files are not "
+                                     "supported")
+        elif inflater.at_block_boundary:
+            total_out = inflater.total_out
+            if (not self.checkpoints or
+                    total_out - self.checkpoints[-1][0] >= self.span):
+                self.checkpoints.append((
+                    total_out, inflater.total_in, inflater.pending_bits,
+                    self._window))
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class GzipIndex(object):
+    """Checkpoints into a gzip file, and the tar members it contains.
+
+    Each checkpoint is a tuple with the offset in the uncompressed stream,
+    the offset in the gzip file, the number of bits of the previous byte
+    that belong to the next block and the 32K of output before it.
+    """
+
+    def __init__(self, checkpoints, members, gzip_size=None,
+                 gzip_mtime=None):
+        self.checkpoints = list(checkpoints)
+        self.members = list(members)
+        self.gzip_size = gzip_size
+        self.gzip_mtime = gzip_mtime
+
+    @classmethod
+    def from_tarball(cls, tarball, span=SPAN):
+        """Index the given .tar.gz, decompressing it once."""
+        logger.debug("Building a gzip index of %s" % tarball)
+        stat = os.stat(tarball)
+        members = []
+        with open(tarball, 'rb') as fd:
+            reader = _IndexingReader(fd, span)
+            try:
+                tar = tarfile.open(mode='r|', fileobj=reader)
+                for tarinfo in tar:
+                    members.append(
+                        [getattr(tarinfo, name)
+                         for name in MEMBER_ATTRIBUTES])
+            except tarfile.TarError, e:
+                raise GzipIndexError(str(e))
+            finally:
+                reader.close()
+        return cls(reader.checkpoints, members, stat.st_size, stat.st_mtime)
+
+    @classmethod
+    def load(cls, index_file):
+        """Load an index previously written with save().
+
+        :raises ValueError: if the file is not an index we understand.
+        """
+        with open(index_file) as fd:
+            data = json.load(fd)
+        if not isinstance(data, dict) or data.get('format') != INDEX_FORMAT:
+            raise ValueError("Unsupported gzip index: %s" % index_file)
+        checkpoints = [
+            (out, in_, bits, zlib.decompress(base64.b64decode(window)))
+            for out, in_, bits, window in data['checkpoints']]
+        return cls(checkpoints, data['members'], data['gzip_size'],
+                   data['gzip_mtime'])
+
+    def save(self, index_file):
+        """Save this index to the given file, atomically."""
+        data = {
+            'format': INDEX_FORMAT,
+            'gzip_size': self.gzip_size,
+            'gzip_mtime': self.gzip_mtime,
+            'checkpoints': [
+                (out, in_, bits, base64.b64encode(zlib.compress(window)))
+                for out, in_, bits, window in self.checkpoints],
+            # Member names are byte strings in no particular encoding;
+            # latin-1 maps every byte to a character, so they survive the
+            # trip through JSON.
+            'members': [
+                [value.decode('latin-1') if isinstance(value, str) else value
+                 for value in values]
+                for values in self.members],
+        }
+        index_dir = os.path.dirname(index_file)
+        if index_dir and not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        tmp_file = '%s.tmp.%d' % (index_file, os.getpid())
+        try:
+            with open(tmp_file, 'w') as fd:
+                json.dump(data, fd)
+            os.rename(tmp_file, index_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+
+    def is_valid_for(self, tarball):
+        """Is this index up to date with the given file?"""
+        try:
+            stat = os.stat(tarball)
+        except OSError:
+            return False
+        return (stat.st_size == self.gzip_size and
+                stat.st_mtime == self.gzip_mtime)
+
+    @classmethod
+    def for_tarball(cls, tarball, index_file=None, save=True):
+        """Return an index for the given .tar.gz, reusing a saved one.
+
+        :param index_file: where the index is stored.  Defaults to
+            default_index_file().
+        :param save: whether to save a newly built index.  Failing to do so
+            is not an error.
+        """
+        if index_file is None:
+            index_file = default_index_file(tarball)
+        if os.path.exists(index_file):
+            try:
+                index = cls.load(index_file)
+            except (IOError, ValueError, KeyError, TypeError,
+                    zlib.error), e:
+                logger.debug("Ignoring unreadable gzip index %s: %s" % (
+                    index_file, e))
+            else:
+                if index.is_valid_for(tarball):
+                    return index
+                logger.debug("Ignoring stale gzip index %s" % index_file)
+        index = cls.from_tarball(tarball)
+        if save:
+            try:
+                index.save(index_file)
+            except (IOError, OSError, ValueError), e:
+                logger.debug("Could not save gzip index %s: %s" % (
+                    index_file, e))
+        return index
+
+    def get_checkpoint(self, offset):
+        """Return the last checkpoint at or before offset."""
+        best = None
+        for checkpoint in self.checkpoints:
+            if checkpoint[0] > offset:
+                break
+            best = checkpoint
+        return best
+
+    def get_tarinfos(self):
+        """Return a TarInfo for each member, in archive order."""
+        tarinfos = []
+        for values in self.members:
+            tarinfo = tarfile.TarInfo()
+            for name, value in zip(MEMBER_ATTRIBUTES, values):
+                if isinstance(value, unicode):
+                    value = value.encode('latin-1')
+                setattr(tarinfo, name, value)
+            tarinfos.append(tarinfo)
+        return tarinfos
+
+
+class IndexedGzipFile(object):
+    """A read-only, seekable file with the uncompressed contents of a gzip
+    file, read through its GzipIndex.
+    """
+
+    def __init__(self, path, index):
+        self.name = path
+        self.index = index
+        self._fd = open(path, 'rb')
+        self._inflater = None
+        # The position of the inflater's next output, and what's been
+        # decompressed past it but not read yet.
+        self._inflater_pos = None
+        self._buffer = ''
+        self._eof = False
+        self._pos = 0
+
+    def close(self):
+        if self._inflater is not None:
+            self._inflater.close()
+            self._inflater = None
+        self._fd.close()
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence != os.SEEK_SET:
+            raise IOError("Can't seek from the end of an indexed gzip file")
+        self._pos = offset
+
+    def _restart(self):
+        """Resume decompressing from the checkpoint before the position."""
+        if self._inflater is not None:
+            self._inflater.close()
+        checkpoint = self.index.get_checkpoint(self._pos)
+        if checkpoint is None:
+            raise GzipIndexError("No checkpoint before %d" % self._pos)
+        out, in_, bits, window = checkpoint
+        self._inflater = _Inflater(RAW_WBITS)
+        if bits:
+            self._fd.seek(in_ - 1)
+            value = ord(self._fd.read(1))
+            self._inflater.prime(bits, value >> (8 - bits))
+        else:
+            self._fd.seek(in_)
+        if window:
+            self._inflater.set_dictionary(window)
+        self._inflater_pos = out
+        self._buffer = ''
+        self._eof = False
+
+    def _inflate(self):
+        inflater = self._inflater
+        if inflater.needs_input:
+            data = self._fd.read(READ_CHUNK_SIZE)
+            if not data:
+                raise GzipIndexError("Truncated gzip file")
+            inflater.feed(data)
+        output, self._eof = inflater.inflate()
+        return output
+
+    def read(self, size=-1):
+        # Going on from where the inflater is is cheaper than restarting
+        # from a checkpoint when the position is less than a span ahead.
+        if (self._inflater is None or self._pos < self._inflater_pos or
+                self._pos > self._inflater_pos + len(self._buffer) + SPAN):
+            self._restart()
+        # Skip what's before the position.
+        while self._inflater_pos + len(self._buffer) < self._pos:
+            self._inflater_pos += len(self._buffer)
+            self._buffer = ''
+            if self._eof:
+                return ''
+            self._buffer = self._inflate()
+        skip = self._pos - self._inflater_pos
+        chunks = [self._buffer[skip:]]
+        available = len(chunks[0])
+        while not self._eof and (size < 0 or available < size):
+            output = self._inflate()
+            chunks.append(output)
+            available += len(output)
+        data = ''.join(chunks)
+        if size >= 0:
+            data, self._buffer = data[:size], data[size:]
+        else:
+            self._buffer = ''
+        self._pos += len(data)
+        self._inflater_pos = self._pos
+        return data
+
+
+def default_index_file(tarball):
+    """Return where the index of the given tarball is kept by default.
+
+    That's next to the tarball, or in the user's cache directory if the
+    tarball is somewhere we can't write to.
+    """
+    tarball_dir = os.path.dirname(os.path.abspath(tarball))
+    if os.access(tarball_dir, os.W_OK):
+        return tarball + INDEX_SUFFIX
+    cache_home = os.environ.get(
+        'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    key = hashlib.sha1(os.path.realpath(tarball)).hexdigest()
+    return os.path.join(
+        cache_home, 'linaro-image-tools', 'gzip-index', key + INDEX_SUFFIX)
+
+
+def open_tarfile(tarball, index_file=None):
+    """Open a .tar.gz for random access to its members.
+
+    The tarball is indexed the first time it's opened.  If it can't be
+    (e.g. libz can't be loaded or it's not a single gzip member), a plain
+    TarFile is returned instead.
+    """
+    if available():
+        try:
+            return _open_indexed_tarfile(tarball, index_file)
+        except Exception, e:
+            # The index is only an optimization, so whatever went wrong,
+            # read the tarball the plain way.
+            logger.debug("Not using a gzip index for %s: %s" % (tarball, e))
+    return tarfile.open(tarball, mode='r:gz')
+
+
+def _open_indexed_tarfile(tarball, index_file):
+    index = GzipIndex.for_tarball(tarball, index_file)
+    fileobj = IndexedGzipFile(tarball, index)
+    try:
+        tar = tarfile.open(tarball, mode='r:', fileobj=fileobj)
+        # The index already has the members, so the TarFile doesn't need to
+        # read the archive to find them.
+        tar.members = index.get_tarinfos()
+        tar._loaded = True
+        tar.offset = fileobj.tell()
+    except:
+        fileobj.close()
+        raise
+    # TarFile doesn't close the file objects it's given.
+    tar._extfileobj = False
+    return tar
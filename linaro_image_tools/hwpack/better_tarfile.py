@@ -20,6 +20,7 @@
 # USA.
 
 from contextlib import contextmanager
+import os
 from StringIO import StringIO
 from tarfile import DIRTYPE, TarFile as StandardTarFile, TarInfo
 
@@ -101,12 +102,40 @@ class TarFile(StandardTarFile):
             tarfile.
         :param content: the content to put in the created file.
         """
+        self.create_file_from_fileobj(
+            filename, StringIO(content), len(content))
+
+    def create_file_from_fileobj(self, filename, fileobj, size):
+        """Create a file with the contents read from a file object.
+
+        The contents are copied over in chunks, so they are never all in
+        memory at once.
+
+        :param filename: the path to put the file at inside the
+            tarfile.
+        :param fileobj: the file object to read the content from, from its
+            current position.
+        :param size: the number of bytes to read from fileobj.
+        """
         tarinfo = TarInfo(name=filename)
-        tarinfo.size = len(content)
+        tarinfo.size = size
         self._set_defaults(tarinfo)
-        fileobj = StringIO(content)
         self.addfile(tarinfo, fileobj=fileobj)
 
+    def create_file_from_path(self, filename, path):
+        """Create a file with the contents of a file on the filesystem.
+
+        Unlike add(), the created file gets the default attributes rather
+        than those of path.
+
+        :param filename: the path to put the file at inside the
+            tarfile.
+        :param path: the path of the file to copy the content of.
+        """
+        with open(path, 'rb') as fileobj:
+            self.create_file_from_fileobj(
+                filename, fileobj, os.fstat(fileobj.fileno()).st_size)
+
     def create_dir(self, path):
         """Create a directory within the tarfile.
 
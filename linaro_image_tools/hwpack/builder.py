@@ -21,18 +21,17 @@
 
 import logging
 import errno
-import subprocess
+import multiprocessing
 import tempfile
 import os
 import shutil
+import tarfile
+import traceback
 from glob import iglob
-
-from debian.debfile import DebFile
-from debian.arfile import ArError
-
-from linaro_image_tools import cmd_runner
+from StringIO import StringIO
 
 from linaro_image_tools.hwpack.config import Config
+from linaro_image_tools.hwpack.deb_reader import DebError, DebReader
 from linaro_image_tools.hwpack.hardwarepack import HardwarePack, Metadata
 from linaro_image_tools.hwpack.packages import (
     FetchedPackage,
@@ -44,6 +43,7 @@ from linaro_image_tools.hwpack.hwpack_fields import (
     PACKAGE_FIELD,
     SPL_PACKAGE_FIELD,
 )
+from linaro_image_tools.timings import phase
 
 # The fields that hold packages to be installed.
 PACKAGE_FIELDS = [PACKAGE_FIELD, SPL_PACKAGE_FIELD]
@@ -74,22 +74,32 @@ class PackageUnpacker(object):
         return os.path.join(self.tempdir, package_dir, file_name)
 
     def unpack_package(self, package_file_name):
-        # We could extract only a single file, but since dpkg will pipe
-        # the entire package through tar anyway we might as well extract all.
         unpack_dir = self.get_path(package_file_name)
         if not os.path.isdir(unpack_dir):
             os.mkdir(unpack_dir)
-        p = cmd_runner.run(["tar", "-C", unpack_dir, "-xf", "-"],
-                           stdin=subprocess.PIPE)
-        cmd_runner.run(["dpkg", "--fsys-tarfile", package_file_name],
-                       stdout=p.stdin).communicate()
-        p.communicate()
+        DebReader(package_file_name).extract_all(unpack_dir)
+
+    def unpack_file(self, package_file_name, file_name):
+        """Extract a single file of the package, if it's a regular file.
+
+        Files that are links, or are found through one, need the rest of the
+        package to be unpacked, so the whole package is unpacked for them.
+        """
+        temp_file = self.get_path(package_file_name, file_name)
+        if os.path.exists(temp_file):
+            return
+        temp_dir = os.path.dirname(temp_file)
+        if not os.path.isdir(temp_dir):
+            os.makedirs(temp_dir)
+        if not DebReader(package_file_name).extract_file(
+                file_name, temp_file):
+            self.unpack_package(package_file_name)
 
     def get_file(self, package, file):
         # File path passed here must not be absolute, or file from
         # real filesystem will be referenced.
         assert file and file[0] != '/'
-        self.unpack_package(package)
+        self.unpack_file(package, file)
         logger.debug("Unpacked package %s." % package)
         temp_file = self.get_path(package, file)
         assert os.path.exists(temp_file), "The file '%s' was " \
@@ -97,9 +107,49 @@ class PackageUnpacker(object):
         return temp_file
 
 
+class ArchitectureBuildError(Exception):
+    """Building the hardware pack for an architecture failed in a worker."""
+
+    def __init__(self, architecture, error):
+        super(ArchitectureBuildError, self).__init__(architecture, error)
+        self.architecture = architecture
+        self.error = error
+
+    def __str__(self):
+        return "Building for %s failed:\n%s" % (self.architecture, self.error)
+
+
+# The builder used by the worker processes of HardwarePackBuilder.build(),
+# inherited when they are forked.
+_worker_builder = None
+
+
+def _build_architecture_in_worker(architecture):
+    try:
+        return _worker_builder.build_architecture(architecture)
+    except Exception:
+        # Not every exception survives the trip back to the parent.
+        raise ArchitectureBuildError(architecture, traceback.format_exc())
+
+
 class HardwarePackBuilder(object):
 
-    def __init__(self, config_path, version, local_debs, out_name=None):
+    def __init__(self, config_path, version, local_debs, out_name=None,
+                 jobs=1, apt_lists_dir=None, update_apt_lists=True,
+                 deb_cache_dir=None, deb_cache_size=None):
+        """Create a HardwarePackBuilder.
+
+        :param jobs: The number of architectures to build at the same time,
+            each in its own process.
+        :param apt_lists_dir: A directory to keep the apt package lists in
+            between builds.
+        :param update_apt_lists: Whether to update the apt package lists.  If
+            False, the lists kept in apt_lists_dir are used.
+        :param deb_cache_dir: A directory to keep the downloaded packages in,
+            shared between builds and architectures.
+        :param deb_cache_size: The number of bytes to keep in deb_cache_dir
+            at most.
+        """
         try:
             with open(config_path) as fp:
                 self.config = Config(fp, allow_unset_bootloader=True)
@@ -114,8 +164,14 @@ class HardwarePackBuilder(object):
         self.package_unpacker = None
         self.hwpack = None
         self.packages = None
-        self.packages_added_to_hwpack = []
+        self.packages_added_to_hwpack = {}
         self.out_name = out_name
+        self.jobs = jobs
+        self.apt_lists_dir = apt_lists_dir
+        self.update_apt_lists = update_apt_lists
+        self.deb_cache_dir = deb_cache_dir
+        self.deb_cache_size = deb_cache_size
+        self.local_packages = None
 
     def find_fetched_package(self, packages, wanted_package_name):
         wanted_package = None
@@ -129,14 +185,16 @@ class HardwarePackBuilder(object):
         return wanted_package
 
     def add_file_to_hwpack(self, package, wanted_file, target_path):
-        if (package.name, wanted_file) in self.packages_added_to_hwpack:
-            # Don't bother adding the same package more than once.
-            return
+        key = (package.name, wanted_file, target_path)
+        if key in self.packages_added_to_hwpack:
+            # Don't bother adding the same file more than once.
+            return self.packages_added_to_hwpack[key]
 
         tempfile_name = self.package_unpacker.get_file(
             package.filepath, wanted_file)
-        self.packages_added_to_hwpack.append((package.name, target_path))
-        return self.hwpack.add_file(target_path, tempfile_name)
+        added = self.hwpack.add_file(target_path, tempfile_name)
+        self.packages_added_to_hwpack[key] = added
+        return added
 
     def find_bootloader_packages(self, bootloaders_config):
         """Loop through the bootloaders dictionary searching for packages
@@ -221,77 +279,146 @@ class HardwarePackBuilder(object):
         del self.copy_files_packages
         return packages
 
+    def _get_local_packages(self):
+        """Return the FetchedPackages of the local debs, reading them once.
+
+        They are the same for every architecture.
+        """
+        if self.local_packages is None:
+            self.local_packages = [
+                FetchedPackage.from_deb(deb) for deb in self.local_debs]
+        return self.local_packages
+
     def build(self):
-        for architecture in self.config.architectures:
-            logger.info("Building for %s" % architecture)
-            metadata = Metadata.from_config(
-                self.config, self.version, architecture)
-            self.hwpack = HardwarePack(metadata)
-            sources = self.config.sources
-            with LocalArchiveMaker() as local_archive_maker:
-                self.hwpack.add_apt_sources(sources)
-                if sources:
-                    sources = sources.values()
-                else:
-                    sources = []
-                self.packages = self.config.packages[:]
-                # Loop through multiple bootloaders.
-                # In V3 of hwpack configuration, all the bootloaders info and
-                # packages are in the bootloaders section.
-                if self.format.format_as_string == '3.0':
-                    if self.config.bootloaders is not None:
-                        self.packages.extend(self.find_bootloader_packages(
-                            self.config.bootloaders))
-                    if self.config.boards is not None:
-                        self.packages.extend(self.find_bootloader_packages(
-                            self.config.boards))
-
-                    self.packages.extend(self.find_copy_files_packages())
-                else:
-                    if self.config.bootloader_package is not None:
-                        self.packages.append(self.config.bootloader_package)
-                    if self.config.spl_package is not None:
-                        self.packages.append(self.config.spl_package)
-                local_packages = [
-                    FetchedPackage.from_deb(deb)
-                    for deb in self.local_debs]
-                sources.append(
-                    local_archive_maker.sources_entry_for_debs(
-                        local_packages, LOCAL_ARCHIVE_LABEL))
-                self.packages.extend([lp.name for lp in local_packages])
-                logger.info("Fetching packages")
-                fetcher = PackageFetcher(
-                    sources, architecture=architecture,
-                    prefer_label=LOCAL_ARCHIVE_LABEL)
-                with fetcher:
-                    with PackageUnpacker() as self.package_unpacker:
-                        fetcher.ignore_packages(self.config.assume_installed)
+        # Read the local debs before any worker is forked, so they all
+        # share them.
+        self._get_local_packages()
+        architectures = self.config.architectures
+        jobs = min(self.jobs, len(architectures))
+        # With out_name, every architecture is written to the same file, so
+        # they must be built in order for the last one to win.
+        if jobs <= 1 or self.out_name:
+            build_infos = [
+                self.build_architecture(architecture)
+                for architecture in architectures]
+        else:
+            build_infos = self._build_architectures_in_parallel(
+                architectures, jobs)
+        # Like the hardware pack, BUILD-INFO.txt is per build, so the one of
+        # the last architecture is kept.
+        if build_infos:
+            with open('BUILD-INFO.txt', 'wb') as dst_file:
+                dst_file.write(build_infos[-1])
+
+    def _build_architectures_in_parallel(self, architectures, jobs):
+        """Run build_architecture() for each architecture in a process pool.
+
+        :return: The results of build_architecture(), in the order of the
+            architectures.
+        """
+        global _worker_builder
+        _worker_builder = self
+        try:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(_build_architecture_in_worker,
+                                   architectures)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        finally:
+            _worker_builder = None
+        return results
+
+    def build_architecture(self, architecture):
+        """Build the hardware pack for the given architecture.
+
+        :return: The BUILD-INFO.txt text for it.
+        """
+        logger.info("Building for %s" % architecture)
+        # Nothing may carry over from a previous architecture: the parallel
+        # workers are reused, and each architecture must be built the same
+        # way whatever was built before it.
+        self.hwpack = None
+        self.packages = None
+        self.packages_added_to_hwpack = {}
+        metadata = Metadata.from_config(
+            self.config, self.version, architecture)
+        self.hwpack = HardwarePack(metadata)
+        sources = self.config.sources
+        with LocalArchiveMaker() as local_archive_maker:
+            self.hwpack.add_apt_sources(sources)
+            if sources:
+                sources = sources.values()
+            else:
+                sources = []
+            self.packages = self.config.packages[:]
+            # Loop through multiple bootloaders.
+            # In V3 of hwpack configuration, all the bootloaders info and
+            # packages are in the bootloaders section.
+            if self.format.format_as_string == '3.0':
+                if self.config.bootloaders is not None:
+                    self.packages.extend(self.find_bootloader_packages(
+                        self.config.bootloaders))
+                if self.config.boards is not None:
+                    self.packages.extend(self.find_bootloader_packages(
+                        self.config.boards))
+
+                self.packages.extend(self.find_copy_files_packages())
+            else:
+                if self.config.bootloader_package is not None:
+                    self.packages.append(self.config.bootloader_package)
+                if self.config.spl_package is not None:
+                    self.packages.append(self.config.spl_package)
+            local_packages = self._get_local_packages()
+            sources.append(
+                local_archive_maker.sources_entry_for_debs(
+                    local_packages, LOCAL_ARCHIVE_LABEL))
+            self.packages.extend([lp.name for lp in local_packages])
+            logger.info("Fetching packages")
+            fetcher = PackageFetcher(
+                sources, architecture=architecture,
+                prefer_label=LOCAL_ARCHIVE_LABEL,
+                lists_cache_dir=self.apt_lists_dir,
+                update_lists=self.update_apt_lists,
+                deb_cache_dir=self.deb_cache_dir,
+                deb_cache_size=self.deb_cache_size)
+            with fetcher:
+                with PackageUnpacker() as self.package_unpacker:
+                    fetcher.ignore_packages(self.config.assume_installed)
+                    with phase('fetch packages (%s)' % architecture):
                         self.packages = fetcher.fetch_packages(
                             self.packages,
                             download_content=self.config.include_debs)
 
+                    with phase('extract files (%s)' % architecture):
                         if self.format.format_as_string == '3.0':
                             self.extract_files()
                         else:
                             self._old_format_extract_files()
 
-                        self._add_packages_to_hwpack(local_packages)
+                    self._add_packages_to_hwpack(local_packages)
 
-                        out_name = self.out_name
-                        if not out_name:
-                            out_name = self.hwpack.filename()
+                    out_name = self.out_name
+                    if not out_name:
+                        out_name = self.hwpack.filename()
 
-                        manifest_name = os.path.splitext(out_name)[0]
-                        if manifest_name.endswith('.tar'):
-                            manifest_name = os.path.splitext(manifest_name)[0]
-                        manifest_name += '.manifest.txt'
+                    manifest_name = os.path.splitext(out_name)[0]
+                    if manifest_name.endswith('.tar'):
+                        manifest_name = os.path.splitext(manifest_name)[0]
+                    manifest_name += '.manifest.txt'
 
+                    with phase('write hwpack (%s)' % architecture):
                         self._write_hwpack_and_manifest(out_name,
                                                         manifest_name)
 
-                        cache_dir = fetcher.cache.tempdir
-                        self._extract_build_info(cache_dir, out_name,
-                                                 manifest_name)
+                    cache_dir = fetcher.cache.tempdir
+                    with phase('build info (%s)' % architecture):
+                        return self._extract_build_info(
+                            cache_dir, out_name, manifest_name)
 
     def _write_hwpack_and_manifest(self, out_name, manifest_name):
         """Write the real hwpack file and its manifest file.
@@ -364,6 +491,7 @@ class HardwarePackBuilder(object):
         :type out_name: str
         :param manifest_name: The name of the manifest file.
         :type manifest_name: str
+        :return: The BUILD-INFO.txt text.
         """
         logger.debug("Extracting build-info")
         build_info_dir = os.path.join(cache_dir, 'build-info')
@@ -381,33 +509,23 @@ class HardwarePackBuilder(object):
                 continue
             try:
                 # Extract Build-Info attribute from debian control
-                deb_control = DebFile(deb_pkg_file_path).control.debcontrol()
+                deb_control = DebReader(deb_pkg_file_path).control()
                 build_info = deb_control.get('Build-Info')
-            except ArError:
+            except DebError:
                 # Skip invalid debian package file
                 # e.g. fetched package with dummy information
                 continue
             if build_info is not None:
                 build_info_available += 1
                 # Extract debian packages with build information
-                env = os.environ
-                env['LC_ALL'] = 'C'
-                env['NO_PKG_MANGLE'] = '1'
-                proc = cmd_runner.Popen(['dpkg-deb', '-x',
-                                        deb_pkg_file_path, build_info_dir],
-                                        env=env, stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE)
-
-                (stdoutdata, stderrdata) = proc.communicate()
-                if proc.returncode:
-                    raise ValueError('dpkg-deb extract failed!\n%s' %
-                                     stderrdata)
-                if stderrdata:
-                    raise ValueError('dpkg-deb extract had warnings:\n%s' %
-                                     stderrdata)
-
-        self._concatenate_build_info(build_info_available, build_info_dir,
-                                     out_name, manifest_name)
+                try:
+                    DebReader(deb_pkg_file_path).extract_all(build_info_dir)
+                except (DebError, EnvironmentError, tarfile.TarError), e:
+                    raise ValueError('deb extract failed!\n%s' % e)
+
+        return self._concatenate_build_info(build_info_available,
+                                            build_info_dir,
+                                            out_name, manifest_name)
 
     def _concatenate_build_info(self, build_info_available, build_info_dir,
                                 out_name, manifest_name):
@@ -421,9 +539,10 @@ class HardwarePackBuilder(object):
         :type out_name: str
         :param manifest_name: The name of the manifest file.
         :type manifest_name: str
+        :return: The concatenated text.
         """
         logger.debug("Concatenating build-info files")
-        dst_file = open('BUILD-INFO.txt', 'wb')
+        dst_file = StringIO()
         if build_info_available > 0:
             build_info_path = (r'%s/usr/share/doc/*/BUILD-INFO.txt' %
                                build_info_dir)
@@ -437,4 +556,4 @@ class HardwarePackBuilder(object):
             dst_file.write('Format-Version: 0.1\n'
                            'Files-Pattern: %s, %s\n'
                            'License-Type: open\n' % (out_name, manifest_name))
-        dst_file.close()
+        return dst_file.getvalue()
@@ -0,0 +1,439 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A catalog of the hardware packs in a directory, kept in SQLite.
+
+Finding the hardware packs that support a board means reading the metadata
+of each of them.  HwpackCatalog.update() reads every hardware pack in a
+directory once, in a single pass that also hashes it, and records its name,
+version, architecture, format, boards and bootloaders, packages and members
+in a database.  Later updates only read the files whose size or mtime
+changed, and files whose contents were already indexed under another path
+aren't indexed again, as the indexed data is keyed on the SHA-256 of the
+contents.  Queries are answered from the database alone.
+"""
+
+import ConfigParser
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tarfile
+
+from linaro_image_tools.hwpack.config import HwpackConfigError
+from linaro_image_tools.hwpack.handler import (
+    HardwarepackHandler,
+    config_from_metadata,
+    split_package_file_name,
+)
+from linaro_image_tools.hwpack.hwpack_fields import (
+    ARCHITECTURE_FIELD,
+    BOARDS_FIELD,
+    BOOTLOADERS_FIELD,
+    FORMAT_FIELD,
+    NAME_FIELD,
+    VERSION_FIELD,
+)
+from linaro_image_tools.tar_index import normalize_member_name
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+# Bump whenever the schema changes; catalogs in an older format are rebuilt.
+CATALOG_FORMAT = 1
+HWPACK_SUFFIX = '.tar.gz'
+READ_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX files_sha256 ON files (sha256);
+CREATE TABLE hwpacks (
+    sha256 TEXT PRIMARY KEY,
+    name TEXT,
+    version TEXT,
+    architecture TEXT,
+    format TEXT
+);
+CREATE TABLE boards (
+    sha256 TEXT NOT NULL,
+    board TEXT,
+    bootloader TEXT
+);
+CREATE INDEX boards_board ON boards (board, bootloader);
+CREATE INDEX boards_sha256 ON boards (sha256);
+CREATE TABLE packages (
+    sha256 TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT,
+    revision TEXT,
+    architecture TEXT,
+    member TEXT NOT NULL
+);
+CREATE INDEX packages_name ON packages (name);
+CREATE INDEX packages_sha256 ON packages (sha256);
+CREATE TABLE members (
+    sha256 TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    offset_data INTEGER NOT NULL
+);
+CREATE INDEX members_sha256 ON members (sha256);
+"""
+
+
+class HwpackCatalogError(Exception):
+    """A hardware pack could not be indexed."""
+
+
+class _HashingReader(object):
+    """Read a file, hashing what is read."""
+
+    def __init__(self, fileobj, hasher):
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+
+def _get_option(config, field):
+    try:
+        return config.get_option(field)
+    except ConfigParser.NoOptionError:
+        return None
+
+
+def _board_bootloaders(name, boards, bootloaders):
+    """Return the (board, bootloader) pairs a hardware pack supports.
+
+    Like Hwpack.__str__(), boards without their own bootloaders support the
+    global ones, and hardware packs without boards are for a single board
+    named after the hardware pack.  The bootloader is None for boards that
+    have none.
+    """
+    if not boards:
+        boards = {name: None}
+    pairs = []
+    for board, value in boards.iteritems():
+        board_bootloaders = None
+        if isinstance(value, dict):
+            board_bootloaders = value.get(BOOTLOADERS_FIELD)
+        if board_bootloaders is None:
+            board_bootloaders = bootloaders
+        if board_bootloaders:
+            pairs.extend(
+                (board, bootloader) for bootloader in board_bootloaders)
+        else:
+            pairs.append((board, None))
+    return sorted(pairs)
+
+
+def scan_hwpack(path):
+    """Read everything the catalog records about a hardware pack.
+
+    The hardware pack is read once, hashing it on the way.
+
+    :return: The SHA-256 of the file and a dict with its metadata fields
+        (name, version, architecture, format), its (board, bootloader)
+        pairs, its packages and its members.
+    :raises HwpackCatalogError: if the file can't be read as a hardware
+        pack.
+    """
+    hasher = hashlib.sha256()
+    config = None
+    format_string = None
+    members = []
+    packages = []
+    try:
+        with open(path, 'rb') as fd:
+            reader = _HashingReader(fd, hasher)
+            tar = tarfile.open(mode='r|gz', fileobj=reader)
+            for tarinfo in tar:
+                name = normalize_member_name(tarinfo.name)
+                members.append(
+                    (name, tarinfo.type, tarinfo.size, tarinfo.offset_data))
+                if name == HardwarepackHandler.metadata_filename:
+                    config = config_from_metadata(tar.extractfile(tarinfo))
+                elif name == HardwarepackHandler.format_filename:
+                    format_string = tar.extractfile(tarinfo).read().strip()
+                elif name.startswith('pkgs/') and name.endswith('.deb'):
+                    try:
+                        packages.append(
+                            split_package_file_name(name) + (name,))
+                    except AssertionError:
+                        logger.warning(
+                            "Skipping badly named package %s in %s" % (
+                                name, path))
+            tar.close()
+            # Hash whatever follows the end of the tar stream too.
+            while reader.read(READ_CHUNK_SIZE):
+                pass
+    except (EnvironmentError, tarfile.TarError, ConfigParser.Error,
+            HwpackConfigError), e:
+        raise HwpackCatalogError("Cannot read %s: %s" % (path, e))
+    if config is None:
+        raise HwpackCatalogError("%s has no metadata" % path)
+    name = _get_option(config, NAME_FIELD)
+    hwpack_format = _get_option(config, FORMAT_FIELD)
+    if hwpack_format is not None:
+        format_string = hwpack_format.format_as_string
+    info = dict(
+        name=name,
+        version=_get_option(config, VERSION_FIELD),
+        architecture=_get_option(config, ARCHITECTURE_FIELD),
+        format=format_string,
+        boards=_board_bootloaders(
+            name, _get_option(config, BOARDS_FIELD),
+            _get_option(config, BOOTLOADERS_FIELD)),
+        packages=packages,
+        members=members)
+    return hasher.hexdigest(), info
+
+
+def _scan_hwpack(path):
+    # The errors are returned, so that one bad file doesn't stop the pool.
+    try:
+        return scan_hwpack(path)
+    except HwpackCatalogError, e:
+        return None, str(e)
+
+
+def find_hwpacks(directory):
+    """Return the paths of the hardware packs under directory, sorted."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(HWPACK_SUFFIX):
+                paths.append(os.path.join(dirpath, filename))
+    return sorted(paths)
+
+
+class HwpackCatalog(object):
+    """A catalog of hardware packs, kept in an SQLite database."""
+
+    def __init__(self, db_file):
+        """Open the catalog, creating it if needed.
+
+        :param db_file: The database file; ':memory:' for a catalog that
+            only lasts as long as this object.
+        """
+        self.db_file = db_file
+        db_dir = os.path.dirname(db_file)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.db = sqlite3.connect(db_file)
+        # Member and package names are byte strings.
+        self.db.text_factory = str
+        self.db.row_factory = sqlite3.Row
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != CATALOG_FORMAT:
+            self._create_schema()
+
+    def _create_schema(self):
+        with self.db:
+            for table in ('files', 'hwpacks', 'boards', 'packages',
+                          'members'):
+                self.db.execute('DROP TABLE IF EXISTS %s' % table)
+            self.db.executescript(SCHEMA)
+            self.db.execute('PRAGMA user_version = %d' % CATALOG_FORMAT)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _is_indexed(self, sha256):
+        return self.db.execute(
+            'SELECT 1 FROM hwpacks WHERE sha256 = ?',
+            (sha256,)).fetchone() is not None
+
+    def _add_hwpack(self, sha256, info):
+        self.db.execute(
+            'INSERT INTO hwpacks (sha256, name, version, architecture, '
+            'format) VALUES (?, ?, ?, ?, ?)',
+            (sha256, info['name'], info['version'], info['architecture'],
+             info['format']))
+        self.db.executemany(
+            'INSERT INTO boards (sha256, board, bootloader) '
+            'VALUES (?, ?, ?)',
+            [(sha256, ) + pair for pair in info['boards']])
+        self.db.executemany(
+            'INSERT INTO packages (sha256, name, version, revision, '
+            'architecture, member) VALUES (?, ?, ?, ?, ?, ?)',
+            [(sha256, ) + tuple(package) for package in info['packages']])
+        self.db.executemany(
+            'INSERT INTO members (sha256, name, type, size, offset_data) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(sha256, ) + tuple(member) for member in info['members']])
+
+    def _remove_unreferenced(self):
+        """Drop the indexed data of contents no file has any more."""
+        for table in ('hwpacks', 'boards', 'packages', 'members'):
+            self.db.execute(
+                'DELETE FROM %s WHERE sha256 NOT IN '
+                '(SELECT sha256 FROM files)' % table)
+
+    def update(self, directory, workers=None):
+        """Bring the catalog up to date with the hardware packs in directory.
+
+        Only new files, and files whose size or mtime changed, are read, in
+        a pool of processes.  Files that are gone are dropped.
+
+        :param workers: The number of hardware packs to read at the same
+            time; defaults to the number of CPUs.
+        :return: The paths that were read, and a list with an error message
+            for each file that could not be indexed.
+        """
+        directory = os.path.abspath(directory)
+        known = dict(
+            (row['path'], (row['size'], row['mtime']))
+            for row in self.db.execute('SELECT path, size, mtime FROM files'))
+        present = {}
+        changed = []
+        for path in find_hwpacks(directory):
+            st = os.stat(path)
+            present[path] = (st.st_size, st.st_mtime)
+            if known.get(path) != present[path]:
+                changed.append(path)
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(changed))
+        if workers <= 1:
+            results = map(_scan_hwpack, changed)
+        else:
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(_scan_hwpack, changed)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+        errors = []
+        with self.db:
+            for path in known:
+                if (path.startswith(directory + os.sep) and
+                        path not in present):
+                    self.db.execute('DELETE FROM files WHERE path = ?',
+                                    (path,))
+            for path, (sha256, info) in zip(changed, results):
+                if sha256 is None:
+                    errors.append(info)
+                    self.db.execute('DELETE FROM files WHERE path = ?',
+                                    (path,))
+                    continue
+                if not self._is_indexed(sha256):
+                    self._add_hwpack(sha256, info)
+                size, mtime = present[path]
+                self.db.execute(
+                    'INSERT OR REPLACE INTO files (path, size, mtime, sha256) '
+                    'VALUES (?, ?, ?, ?)', (path, size, mtime, sha256))
+            self._remove_unreferenced()
+        return changed, errors
+
+    def find(self, board=None, bootloader=None, name=None,
+             architecture=None, format=None):
+        """Return the paths of the hardware packs matching all the criteria.
+
+        Criteria that are None are ignored.
+        """
+        conditions = []
+        args = []
+        for column, value in (('boards.board', board),
+                              ('boards.bootloader', bootloader),
+                              ('hwpacks.name', name),
+                              ('hwpacks.architecture', architecture),
+                              ('hwpacks.format', format)):
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                args.append(value)
+        query = ('SELECT DISTINCT files.path FROM files '
+                 'JOIN hwpacks ON hwpacks.sha256 = files.sha256 '
+                 'LEFT JOIN boards ON boards.sha256 = files.sha256')
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY files.path'
+        return [row[0] for row in self.db.execute(query, args)]
+
+    def _get_sha256(self, path):
+        row = self.db.execute(
+            'SELECT sha256 FROM files WHERE path = ?',
+            (os.path.abspath(path),)).fetchone()
+        if row is None:
+            raise KeyError(path)
+        return row[0]
+
+    def get_hwpack(self, path):
+        """Return the metadata fields and boards recorded for a file.
+
+        :raises KeyError: if the file is not in the catalog.
+        """
+        sha256 = self._get_sha256(path)
+        row = self.db.execute(
+            'SELECT name, version, architecture, format FROM hwpacks '
+            'WHERE sha256 = ?', (sha256,)).fetchone()
+        info = dict(zip(row.keys(), row))
+        info['sha256'] = sha256
+        info['boards'] = [
+            tuple(board) for board in self.db.execute(
+                'SELECT board, bootloader FROM boards WHERE sha256 = ? '
+                'ORDER BY board, bootloader', (sha256,))]
+        return info
+
+    def get_packages(self, path):
+        """Return the (name, version, revision, architecture, member) of
+        the packages in a hardware pack.
+
+        :raises KeyError: if the file is not in the catalog.
+        """
+        return [tuple(row) for row in self.db.execute(
+            'SELECT name, version, revision, architecture, member '
+            'FROM packages WHERE sha256 = ? ORDER BY rowid',
+            (self._get_sha256(path),))]
+
+    def get_members(self, path):
+        """Return the (name, type, size, offset_data) of the members of a
+        hardware pack, in archive order.
+
+        :raises KeyError: if the file is not in the catalog.
+        """
+        return [tuple(row) for row in self.db.execute(
+            'SELECT name, type, size, offset_data FROM members '
+            'WHERE sha256 = ? ORDER BY rowid', (self._get_sha256(path),))]
+
+
+def default_catalog_file():
+    """Return the default location of the catalog database."""
+    cache_home = os.environ.get(
+        'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'linaro-image-tools', 'hwpacks.db')
@@ -0,0 +1,345 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Read .deb packages in process, without unpacking them.
+
+A .deb is an ar archive with a debian-binary member followed by the
+control.tar and data.tar members, each of them uncompressed or compressed
+with gzip, bzip2, xz or zstd.  DebReader streams those tarballs straight out
+of the package, so members can be listed, single files extracted and control
+fields read without running dpkg or writing the whole package out.
+
+gzip and bzip2 are decompressed with the standard library.  xz and zstd use
+the lzma and zstandard modules when they are installed, and the xz and zstd
+commands otherwise.
+"""
+
+import bz2
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import zlib
+
+from debian import deb822
+
+from linaro_image_tools import cmd_runner
+from linaro_image_tools.tar_index import normalize_member_name
+from linaro_image_tools.utils import try_import
+
+lzma = try_import('lzma', try_import('backports.lzma'))
+zstandard = try_import('zstandard')
+
+AR_MAGIC = '!<arch>\n'
+AR_HEADER_SIZE = 60
+READ_CHUNK_SIZE = 64 * 1024
+
+CONTROL_TAR = 'control.tar'
+DATA_TAR = 'data.tar'
+
+# The commands that decompress the formats the standard library can't, when
+# their Python modules are not installed.
+DECOMPRESS_COMMANDS = {
+    '.xz': ['xz', '-dc'],
+    '.lzma': ['xz', '-dc', '--format=lzma'],
+    '.zst': ['zstd', '-dc'],
+}
+
+
+class DebError(Exception):
+    """The file is not a .deb we can read."""
+
+
+class _LimitedReader(object):
+    """Read at most size bytes from a file."""
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class _DecompressingReader(object):
+    """Read the decompressed contents of a file."""
+
+    def __init__(self, fileobj, decompressor):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self._buffer = ''
+        self._eof = False
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        available = len(self._buffer)
+        while not self._eof and (size < 0 or available < size):
+            data = self.fileobj.read(READ_CHUNK_SIZE)
+            if data:
+                output = self.decompressor.decompress(data)
+            else:
+                self._eof = True
+                flush = getattr(self.decompressor, 'flush', None)
+                output = flush() if flush is not None else ''
+            chunks.append(output)
+            available += len(output)
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        data, self._buffer = data[:size], data[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class _CommandReader(object):
+    """Read the output of a command fed with the contents of a file."""
+
+    def __init__(self, fileobj, args):
+        self.proc = cmd_runner.run(
+            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._feeder = threading.Thread(target=self._feed, args=(fileobj,))
+        self._feeder.daemon = True
+        self._feeder.start()
+
+    def _feed(self, fileobj):
+        try:
+            while True:
+                data = fileobj.read(READ_CHUNK_SIZE)
+                if not data:
+                    break
+                self.proc.stdin.write(data)
+        except IOError:
+            # The command exited without reading everything.
+            pass
+        finally:
+            self.proc.stdin.close()
+
+    def read(self, size=-1):
+        return self.proc.stdout.read(size)
+
+    def close(self):
+        self.proc.stdout.close()
+        self._feeder.join()
+        self.proc.wait()
+
+
+def _open_decompressed(fileobj, suffix):
+    """Return a reader of the decompressed contents of fileobj.
+
+    :param suffix: The compression suffix of the member fileobj reads.
+    """
+    if suffix == '':
+        return fileobj
+    if suffix == '.gz':
+        return _DecompressingReader(
+            fileobj, zlib.decompressobj(16 + zlib.MAX_WBITS))
+    if suffix == '.bz2':
+        return _DecompressingReader(fileobj, bz2.BZ2Decompressor())
+    if suffix in ('.xz', '.lzma') and lzma is not None:
+        return _DecompressingReader(fileobj, lzma.LZMADecompressor())
+    if suffix == '.zst' and zstandard is not None:
+        return _DecompressingReader(
+            fileobj, zstandard.ZstdDecompressor().decompressobj())
+    if suffix in DECOMPRESS_COMMANDS:
+        return _CommandReader(fileobj, DECOMPRESS_COMMANDS[suffix])
+    raise DebError("Unsupported compression: %s" % suffix)
+
+
+def _is_within(root, path):
+    """Whether path, symlinks resolved, is root or under it."""
+    path = os.path.realpath(path)
+    return path == root or path.startswith(root + os.sep)
+
+
+class DebReader(object):
+    """A .deb package, read in process.
+
+    Every method reads the package again, from its start, so the file object
+    given must be seekable if more than one is called.
+    """
+
+    def __init__(self, package):
+        """Create a DebReader.
+
+        :param package: The path to the package, or a file object reading
+            it.
+        """
+        if isinstance(package, basestring):
+            self.name = package
+            self._fileobj = None
+        else:
+            self.name = getattr(package, 'name', repr(package))
+            self._fileobj = package
+
+    def _open(self):
+        if self._fileobj is None:
+            return open(self.name, 'rb')
+        self._fileobj.seek(0)
+        return self._fileobj
+
+    def _close(self, fileobj):
+        if fileobj is not self._fileobj:
+            fileobj.close()
+
+    def _iter_ar_members(self, fileobj):
+        """Yield the name and a reader of each member of the ar archive."""
+        if fileobj.read(len(AR_MAGIC)) != AR_MAGIC:
+            raise DebError("%s is not a .deb" % self.name)
+        while True:
+            header = fileobj.read(AR_HEADER_SIZE)
+            if not header:
+                break
+            if len(header) != AR_HEADER_SIZE or header[58:60] != '`\n':
+                raise DebError("%s has a corrupt member header" % self.name)
+            name = header[:16].rstrip().rstrip('/')
+            try:
+                size = int(header[48:58])
+            except ValueError:
+                raise DebError("%s has a corrupt member header" % self.name)
+            reader = _LimitedReader(fileobj, size)
+            yield name, reader
+            # Skip what's left of the member, and its padding to an even
+            # offset.
+            while reader.read(READ_CHUNK_SIZE):
+                pass
+            if size % 2:
+                fileobj.read(1)
+
+    def member_names(self):
+        """Return the names of the members of the ar archive."""
+        fileobj = self._open()
+        try:
+            return [name for name, _ in self._iter_ar_members(fileobj)]
+        finally:
+            self._close(fileobj)
+
+    def _iter_tar(self, tar_name):
+        """Yield the TarFile of the given tarball and each of its members.
+
+        The TarFile is a stream, so the members must be read as they are
+        yielded.
+
+        :param tar_name: CONTROL_TAR or DATA_TAR.
+        """
+        fileobj = self._open()
+        try:
+            for name, reader in self._iter_ar_members(fileobj):
+                if not name.startswith(tar_name):
+                    continue
+                decompressed = _open_decompressed(
+                    reader, name[len(tar_name):])
+                try:
+                    tar = tarfile.open(mode='r|', fileobj=decompressed)
+                    for tarinfo in tar:
+                        yield tar, tarinfo
+                    tar.close()
+                finally:
+                    if decompressed is not reader:
+                        decompressed.close()
+                return
+        finally:
+            self._close(fileobj)
+        raise DebError("%s has no %s member" % (self.name, tar_name))
+
+    def iter_data(self):
+        """Yield the TarFile of data.tar and each of its members.
+
+        Use the TarFile's extractfile() to read a member before going on to
+        the next one.
+        """
+        return self._iter_tar(DATA_TAR)
+
+    def list_data(self):
+        """Return the TarInfo of every file in the package."""
+        return [tarinfo for _, tarinfo in self.iter_data()]
+
+    def read_file(self, path, tar_name=DATA_TAR):
+        """Return the contents of the given regular file in the package.
+
+        :return: The contents, or None if there is no such file.
+        """
+        path = normalize_member_name(path)
+        for tar, tarinfo in self._iter_tar(tar_name):
+            if normalize_member_name(tarinfo.name) == path:
+                if not tarinfo.isfile():
+                    return None
+                return tar.extractfile(tarinfo).read()
+        return None
+
+    def extract_file(self, path, dest):
+        """Copy the given regular file in the package to dest.
+
+        :return: Whether the file was found.
+        """
+        path = normalize_member_name(path)
+        for tar, tarinfo in self.iter_data():
+            if normalize_member_name(tarinfo.name) == path:
+                if not tarinfo.isfile():
+                    return False
+                with open(dest, 'wb') as fd:
+                    shutil.copyfileobj(tar.extractfile(tarinfo), fd)
+                os.chmod(dest, tarinfo.mode)
+                return True
+        return False
+
+    def extract_all(self, dest):
+        """Unpack the files of the package into dest, like dpkg-deb -x.
+
+        Like tar, leading slashes are stripped from member names and members
+        are extracted in archive order, following the symlinks created by
+        earlier ones (e.g. lib -> usr/lib), but any member that would land
+        outside of dest that way or through '..' is skipped.
+        """
+        root = os.path.realpath(dest)
+        for tar, tarinfo in self.iter_data():
+            tarinfo.name = normalize_member_name(tarinfo.name) or '.'
+            path = os.path.join(dest, tarinfo.name)
+            if tarinfo.issym():
+                # The symlink may point anywhere, but must be created in
+                # dest.
+                parent = os.path.dirname(path)
+                if not _is_within(root, parent):
+                    continue
+                if not os.path.isdir(parent):
+                    os.makedirs(parent)
+                if os.path.islink(path) or os.path.isfile(path):
+                    os.unlink(path)
+                elif os.path.lexists(path):
+                    # Don't replace a directory an earlier member created.
+                    continue
+                os.symlink(tarinfo.linkname, path)
+                continue
+            if tarinfo.islnk():
+                tarinfo.linkname = normalize_member_name(tarinfo.linkname)
+                if not _is_within(root, os.path.join(dest, tarinfo.linkname)):
+                    continue
+            if _is_within(root, path):
+                tar.extract(tarinfo, dest)
+
+    def control(self):
+        """Return the fields of the package's control file."""
+        data = self.read_file('control', tar_name=CONTROL_TAR)
+        if data is None:
+            raise DebError("%s has no control file" % self.name)
+        return deb822.Deb822(data.splitlines())
@@ -25,15 +25,63 @@ import re
 import shutil
 import tarfile
 import tempfile
+import urllib
 
+from debian.debian_support import Version
+
+from linaro_image_tools import gzip_index
 from linaro_image_tools.hwpack.config import Config
-from linaro_image_tools.hwpack.builder import PackageUnpacker
+from linaro_image_tools.hwpack.deb_reader import DebReader
+from linaro_image_tools.tar_index import normalize_member_name
 from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
 
 
 logger = logging.getLogger(DEFAULT_LOGGER_NAME)
 
 
+def config_from_metadata(metadata, board=None, bootloader=None):
+    """Return a Config for the given metadata file object.
+
+    :param board: The board the config is used for, if any.
+    :param bootloader: The bootloader the config is used for, if any.
+    """
+    lines = metadata.readlines()
+    if re.search("=", lines[0]) and not re.search(":", lines[0]):
+        # Probably V2 hardware pack without [hwpack] on the first line
+        lines = ["[hwpack]\n"] + lines
+    config = Config(StringIO("".join(lines)))
+    config.board = board
+    config.bootloader = bootloader
+    return config
+
+
+def split_package_file_name(package):
+    """Return the name, version, revision and architecture of a package.
+
+    Packages are named according to the debian specification:
+    http://www.debian.org/doc/manuals/debian-faq/ch-pkg_basics.en.html
+    <name>_<Version>-<DebianRevisionNumber>_<DebianArchitecture>.deb
+    DebianRevisionNumber seems to be optional, and is None when missing.
+    """
+    file_name = os.path.basename(package)
+    dpkg_chunks = re.search("^(.+)_(.+)_(.+)\.deb$",
+                            file_name)
+    assert dpkg_chunks, "Could not split package file name into"\
+        "<name>_<Version>_<DebianArchitecture>.deb"
+
+    pkg_name = dpkg_chunks.group(1)
+    pkg_version = dpkg_chunks.group(2)
+    pkg_architecture = dpkg_chunks.group(3)
+
+    ver_chunks = re.search("^(.+)-(.+)$", pkg_version)
+    if ver_chunks:
+        pkg_version = ver_chunks.group(1)
+        pkg_revision = ver_chunks.group(2)
+    else:
+        pkg_revision = None
+    return pkg_name, pkg_version, pkg_revision, pkg_architecture
+
+
 class HardwarepackHandler(object):
     FORMAT_1 = '1.0'
     FORMAT_2 = '2.0'
@@ -53,6 +101,20 @@ class HardwarepackHandler(object):
         self.tempdirs = {}
         # Used to store the config created from the metadata.
         self.config = None
+        # The hwpacks don't change, so their metadata and FORMAT are only
+        # read the first time they are needed, and the fields looked up are
+        # kept, per board and bootloader, even after we exit: the handler is
+        # entered again every time files are needed from the hwpacks.
+        self._configs = None
+        self._format = None
+        self._fields = {}
+        # The packages in the hwpacks, keyed on their names; built the first
+        # time a package is looked for.
+        self._package_index = None
+        # The members of each package looked into, and the files extracted
+        # from them, keyed on the package and path.
+        self._package_members = {}
+        self._package_files = {}
 
     class FakeSecHead(object):
         """ Add a fake section header to the metadata file.
@@ -75,7 +137,7 @@ class HardwarepackHandler(object):
     def __enter__(self):
         self.tempdir = tempfile.mkdtemp()
         for hwpack in self.hwpacks:
-            hwpack_tarfile = tarfile.open(hwpack, mode='r:gz')
+            hwpack_tarfile = gzip_index.open_tarfile(hwpack)
             self.hwpack_tarfiles.append(hwpack_tarfile)
         return self
 
@@ -91,6 +153,8 @@ class HardwarepackHandler(object):
             tempdir = self.tempdirs[name]
             if tempdir is not None and os.path.exists(tempdir):
                 shutil.rmtree(tempdir)
+        self.tempdirs = {}
+        self._package_files = {}
 
     def _get_config_from_metadata(self, metadata):
         """
@@ -99,23 +163,33 @@ class HardwarepackHandler(object):
         :param metadata: The metadata to parse.
         :return: A Config instance.
         """
-        if not self.config:
-            lines = metadata.readlines()
-            if re.search("=", lines[0]) and not re.search(":", lines[0]):
-                # Probably V2 hardware pack without [hwpack] on the first line
-                lines = ["[hwpack]\n"] + lines
-            self.config = Config(StringIO("".join(lines)))
-            self.config.board = self.board
-            self.config.bootloader = self.bootloader
-        return self.config
+        return config_from_metadata(metadata, self.board, self.bootloader)
 
-    def get_field(self, field, return_keys=False):
+    def _get_configs(self):
+        """Return the Config of each hwpack, parsing them only once.
+
+        Return None if the hwpacks are not open and haven't been parsed yet.
+        """
+        if self._configs is None and self.hwpack_tarfiles:
+            self._configs = [
+                self._get_config_from_metadata(
+                    hwpack_tarfile.extractfile(self.metadata_filename))
+                for hwpack_tarfile in self.hwpack_tarfiles]
+            self.config = self._configs[0]
+        return self._configs
+
+    def _resolve_field(self, field, configs):
+        """Look the field up in the configs.
+
+        :return: The value of the field, the index of the hwpack it was
+            found in and the keys used to find it.
+        """
         data = None
-        hwpack_with_data = None
+        index = None
         keys = None
-        for hwpack_tarfile in self.hwpack_tarfiles:
-            metadata = hwpack_tarfile.extractfile(self.metadata_filename)
-            parser = self._get_config_from_metadata(metadata)
+        for i, parser in enumerate(configs):
+            parser.board = self.board
+            parser.bootloader = self.bootloader
             try:
                 new_data = parser.get_option(field)
                 if new_data is not None:
@@ -123,17 +197,33 @@ class HardwarepackHandler(object):
                         "'%s' and new value '%s' is found" % (field, data,
                                                               new_data)
                     data = new_data
-                    hwpack_with_data = hwpack_tarfile
-                    if return_keys:
-                        keys = parser.get_last_used_keys()
+                    index = i
+                    keys = parser.get_last_used_keys()
             except ConfigParser.NoOptionError:
                 continue
+        return data, index, keys
+
+    def get_field(self, field, return_keys=False):
+        data = None
+        hwpack_with_data = None
+        keys = None
+        configs = self._get_configs()
+        if configs is not None:
+            fields = self._fields.setdefault((self.board, self.bootloader), {})
+            if field not in fields:
+                fields[field] = self._resolve_field(field, configs)
+            data, index, keys = fields[field]
+            # The hwpack is only there while we're entered.
+            if index is not None and index < len(self.hwpack_tarfiles):
+                hwpack_with_data = self.hwpack_tarfiles[index]
 
         if return_keys:
             return data, hwpack_with_data, keys
         return data, hwpack_with_data
 
     def get_format(self):
+        if self._format is not None:
+            return self._format
         format = None
         supported_formats = [self.FORMAT_1, self.FORMAT_2, self.FORMAT_3]
         for hwpack_tarfile in self.hwpack_tarfiles:
@@ -145,7 +235,9 @@ class HardwarepackHandler(object):
             if format is None:
                 format = format_string
             elif format != format_string:
-                return self.FORMAT_MIXED
+                format = self.FORMAT_MIXED
+                break
+        self._format = format
         return format
 
     def get_file(self, file_alias):
@@ -173,8 +265,8 @@ class HardwarepackHandler(object):
             # If keys is non-empty, we have a V3 config option that was
             # modified by the bootloader and/or boot option...
             for name, key in config_names:
-                if self.get_field(name):
-                    value = self.get_field(name)[0]
+                value = self.get_field(name)[0]
+                if value is not None:
                     if keys[0] == key:
                         base_path = os.path.join(base_path, value)
                         keys = keys[1:]
@@ -202,36 +294,41 @@ class HardwarepackHandler(object):
                     packages.append((tf, name))
         return packages
 
+    def _get_package_index(self):
+        """Return the packages in the hwpacks, indexing them only once.
+
+        The index maps each package name to a list of (version, revision,
+        architecture, hwpack index, member) tuples, in the order the
+        packages are found in the hwpacks.  Return None if the hwpacks are
+        not open and haven't been indexed yet.
+        """
+        if self._package_index is None and self.hwpack_tarfiles:
+            index = {}
+            for hwpack_index, tar_file in enumerate(self.hwpack_tarfiles):
+                for package in tar_file.getnames():
+                    if not (package.startswith("pkgs/") and
+                            package.endswith(".deb")):
+                        continue
+                    name, version, revision, architecture = \
+                        split_package_file_name(package)
+                    index.setdefault(name, []).append(
+                        (version, revision, architecture, hwpack_index,
+                         package))
+            self._package_index = index
+        return self._package_index
+
     def find_package_for(self, name, version=None, revision=None,
-                         architecture=None):
+                         architecture=None, latest=False):
         """Find a package that matches the name, version, rev and arch given.
 
-        Packages are named according to the debian specification:
-        http://www.debian.org/doc/manuals/debian-faq/ch-pkg_basics.en.html
-        <name>_<Version>-<DebianRevisionNumber>_<DebianArchitecture>.deb
-        DebianRevisionNumber seems to be optional.
-        Use this spec to return a package matching the requirements given.
+        See split_package_file_name() for how packages are named.  Return
+        the first matching package, or the one with the highest version if
+        latest is True, as a (TarFile, path inside the tarball) tuple.
         """
-        for tar_file, package in self.list_packages():
-            file_name = os.path.basename(package)
-            dpkg_chunks = re.search("^(.+)_(.+)_(.+)\.deb$",
-                                    file_name)
-            assert dpkg_chunks, "Could not split package file name into"\
-                "<name>_<Version>_<DebianArchitecture>.deb"
-
-            pkg_name = dpkg_chunks.group(1)
-            pkg_version = dpkg_chunks.group(2)
-            pkg_architecture = dpkg_chunks.group(3)
-
-            ver_chunks = re.search("^(.+)-(.+)$", pkg_version)
-            if ver_chunks:
-                pkg_version = ver_chunks.group(1)
-                pkg_revision = ver_chunks.group(2)
-            else:
-                pkg_revision = None
-
-            if name != pkg_name:
-                continue
+        index = self._get_package_index() or {}
+        matches = []
+        for entry in index.get(name, []):
+            pkg_version, pkg_revision, pkg_architecture = entry[:3]
             if version is not None and str(version) != pkg_version:
                 continue
             if revision is not None and str(revision) != pkg_revision:
@@ -239,12 +336,90 @@ class HardwarepackHandler(object):
             if (architecture is not None and
                     str(architecture) != pkg_architecture):
                 continue
+            matches.append(entry)
+            if not latest:
+                break
 
-            # Got a matching package - return its path inside the tarball
-            return tar_file, package
+        if not matches:
+            # Failed to find a matching package - return None
+            return None
+        if latest:
+            entry = max(matches, key=self._package_version)
+        else:
+            entry = matches[0]
+        hwpack_index, package = entry[3:]
+        return self.hwpack_tarfiles[hwpack_index], package
+
+    @staticmethod
+    def _package_version(entry):
+        """Return the Debian version of a package index entry."""
+        version, revision = entry[:2]
+        # Epochs are quoted in package file names.
+        version = urllib.unquote(version)
+        if revision is not None:
+            version = "%s-%s" % (version, revision)
+        return Version(version)
+
+    def _package_tempdir(self, package):
+        """Return the directory files of the given package are copied to."""
+        # Give each package its own tempdir, so packages with the same name
+        # in different hardware packs don't clash.
+        if not package in self.tempdirs:
+            self.tempdirs[package] = tempfile.mkdtemp()
+        return self.tempdirs[package]
 
-        # Failed to find a matching package - return None
-        return None
+    def _scan_package(self, package_file, wanted=None, dest=None):
+        """Read the files in the given package, in a single pass.
+
+        The package is read in process, straight out of the hardware pack.
+
+        :param wanted: The path, in the package, of a regular file to copy
+            to dest on the way.
+        :return: A dict with the type and link target of every member of
+            the package, keyed on its normalized path.
+        """
+        members = {}
+        for tar, tarinfo in DebReader(package_file).iter_data():
+            name = normalize_member_name(tarinfo.name)
+            members[name] = (tarinfo.type, tarinfo.linkname)
+            if name == wanted and tarinfo.isfile():
+                with open(dest, 'wb') as fd:
+                    shutil.copyfileobj(tar.extractfile(tarinfo), fd)
+                os.chmod(dest, tarinfo.mode)
+        return members
+
+    @staticmethod
+    def _resolve_package_path(members, path):
+        """Follow the symlinks and hard links in path within the package.
+
+        :return: The path of the member path refers to, or None if it
+            doesn't exist.
+        """
+        parts = normalize_member_name(path).split('/')
+        resolved = []
+        # Bound the number of links followed, like the kernel does.
+        links = 0
+        while parts:
+            resolved.append(parts.pop(0))
+            name = '/'.join(resolved)
+            if name not in members:
+                return None
+            member_type, linkname = members[name]
+            if member_type == tarfile.SYMTYPE:
+                if linkname.startswith('/'):
+                    target = linkname
+                else:
+                    target = os.path.join(os.path.dirname(name), linkname)
+            elif member_type == tarfile.LNKTYPE:
+                target = linkname
+            else:
+                continue
+            links += 1
+            if links > 40:
+                return None
+            parts = normalize_member_name(target).split('/') + parts
+            resolved = []
+        return '/'.join(resolved)
 
     def get_file_from_package(self, file_path, package_name,
                               package_version=None, package_revision=None,
@@ -254,6 +429,10 @@ class HardwarepackHandler(object):
         File is extracted from the package matching the given specification
         to a temporary directory. The absolute path to the extracted file is
         returned.
+
+        The package is read straight out of the hardware pack, and only the
+        file (following links within the package) is extracted from it.
+        Files are only extracted once.
         """
 
         package_info = self.find_package_for(package_name,
@@ -263,30 +442,32 @@ class HardwarepackHandler(object):
         if package_info is None:
             return None
         tar_file, package = package_info
-
-        # Avoid unpacking hardware pack more than once by assigning each one
-        # its own tempdir to unpack into.
-        # TODO: update logic that uses self.tempdir so we can get rid of this
-        # by sharing nicely.
-        if not package in self.tempdirs:
-            self.tempdirs[package] = tempfile.mkdtemp()
-        tempdir = self.tempdirs[package]
-
-        # We extract everything in the hardware pack so we don't have to worry
-        # about chasing links (extract a link, find where it points to, extract
-        # that...). This is slower, but more reliable.
-        tar_file.extractall(tempdir)
-        package_path = os.path.join(tempdir, package)
-
-        with PackageUnpacker() as self.package_unpacker:
-            extracted_file = self.package_unpacker.get_file(package_path,
-                                                            file_path)
-            after_tmp = re.sub(self.package_unpacker.tempdir, "",
-                               extracted_file).lstrip("/\\")
-            extract_dir = os.path.join(tempdir, "extracted",
-                                       os.path.dirname(after_tmp))
-            os.makedirs(extract_dir)
-            shutil.move(extracted_file, extract_dir)
-            extracted_file = os.path.join(extract_dir,
-                                          os.path.basename(extracted_file))
+        key = (package, file_path)
+        if key in self._package_files:
+            return self._package_files[key]
+
+        # extractfile() follows links within the hardware pack.
+        package_file = tar_file.extractfile(package)
+        extracted_file = os.path.join(
+            self._package_tempdir(package), "extracted",
+            file_path.lstrip("/\\"))
+        if not os.path.isdir(os.path.dirname(extracted_file)):
+            os.makedirs(os.path.dirname(extracted_file))
+
+        members = self._package_members.get(package)
+        if members is None:
+            # Copy the file out while listing the package, which is all
+            # that's needed unless it's reached through a link.
+            members = self._scan_package(
+                package_file, normalize_member_name(file_path),
+                extracted_file)
+            self._package_members[package] = members
+        target = self._resolve_package_path(members, file_path)
+        assert (target is not None and
+                members[target][0] in tarfile.REGULAR_TYPES), \
+            "The file '%s' was not found in the package '%s'." % (
+                file_path, package)
+        if not os.path.exists(extracted_file):
+            self._scan_package(package_file, target, extracted_file)
+        self._package_files[key] = extracted_file
         return extracted_file
@@ -572,9 +572,9 @@ class HardwarePack(object):
             tf.create_dir(self.PACKAGES_DIRNAME)
             for package in self.packages:
                 if package.content is not None:
-                    tf.create_file_from_string(
+                    tf.create_file_from_fileobj(
                         self.PACKAGES_DIRNAME + "/" + package.filename,
-                        package.content.read())
+                        package.content, package.size)
             tf.create_file_from_string(
                 self.MANIFEST_FILENAME, self.manifest_text())
             tf.create_file_from_string(
@@ -17,13 +17,21 @@
 # You should have received a copy of the GNU General Public License
 # along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
 
-from linaro_image_tools.hwpack.handler import HardwarepackHandler
+import ConfigParser
+import multiprocessing
+import tarfile
+
+from linaro_image_tools.hwpack.handler import (
+    HardwarepackHandler,
+    config_from_metadata,
+)
 from linaro_image_tools.hwpack.hwpack_fields import (
     FORMAT_FIELD,
     NAME_FIELD,
     BOARDS_FIELD,
     BOOTLOADERS_FIELD,
 )
+from linaro_image_tools.tar_index import normalize_member_name
 
 from os import linesep as LINE_SEP
 
@@ -142,13 +150,55 @@ class Hwpack(object):
         return string + LINE_SEP
 
 
+def _get_option(config, field):
+    try:
+        return config.get_option(field)
+    except ConfigParser.NoOptionError:
+        return None
+
+
+def read_hwpack(tarball):
+    """Read the metadata of a hardware pack.
+
+    The tarball is read as a stream, and only up to its metadata, which
+    HardwarePack.to_file() writes first, right after FORMAT.
+
+    :return: The format of the hardware pack, as a string, and a Hwpack with
+        its name, boards and bootloaders.  Both are None if the hardware
+        pack has no metadata.
+    """
+    tar = tarfile.open(tarball, mode='r|*')
+    try:
+        for tarinfo in tar:
+            if (normalize_member_name(tarinfo.name) ==
+                    HardwarepackHandler.metadata_filename):
+                config = config_from_metadata(tar.extractfile(tarinfo))
+                break
+        else:
+            return None, None
+    finally:
+        tar.close()
+    hwpack_format = _get_option(config, FORMAT_FIELD)
+    if hwpack_format is not None:
+        hwpack_format = hwpack_format.format_as_string
+    hwpack = Hwpack()
+    hwpack.sethwpack(tarball)
+    hwpack.setname(_get_option(config, NAME_FIELD))
+    hwpack.setboards(_get_option(config, BOARDS_FIELD))
+    hwpack.setbootloaders(_get_option(config, BOOTLOADERS_FIELD))
+    return hwpack_format, hwpack
+
+
 class HwpackReader(object):
     """Reads the information contained in a hwpack """
-    def __init__(self, hwpacks):
+    def __init__(self, hwpacks, workers=None):
         """Create a new instance.
 
-        :param hwpacks: The list of hardware packs to read from."""
+        :param hwpacks: The list of hardware packs to read from.
+        :param workers: The number of hardware packs to read at the same
+            time, in separate processes; defaults to the number of CPUs."""
         self.hwpacks = hwpacks
+        self.workers = workers
         # Where we store all the info from the hwpack.
         self._supported_elements = []
 
@@ -157,24 +207,40 @@ class HwpackReader(object):
         """Gets the supported elements of by all the hardwapare packs."""
         return self._supported_elements
 
+    def _read_hwpacks(self):
+        """Return the result of read_hwpack() for each hardware pack."""
+        workers = self.workers
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(self.hwpacks))
+        if workers <= 1:
+            return map(read_hwpack, self.hwpacks)
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(read_hwpack, self.hwpacks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return results
+
     def _read_hwpacks_metadata(self):
         """Reads the hardware pack metadata file, and prints information about
         the supported boards and bootloaders."""
-        for tarball in self.hwpacks:
-            with HardwarepackHandler([tarball]) as handler:
-                hwpack_format = handler.get_field(FORMAT_FIELD)[0]
-                if hwpack_format.format_as_string == "3.0":
-                    local_hwpack = Hwpack()
-                    local_hwpack.sethwpack(tarball)
-                    local_hwpack.setname(handler.get_field(NAME_FIELD)[0])
-                    local_hwpack.setboards(handler.get_field(BOARDS_FIELD)[0])
-                    local_hwpack.setbootloaders(
-                        handler.get_field(BOOTLOADERS_FIELD)[0])
-                    self.supported_elements.append(local_hwpack)
-                else:
-                    raise HwpackReaderError("Hardwarepack '%s' cannot be "
-                                            "read, unsupported format." %
-                                            (tarball))
+        results = self._read_hwpacks()
+        for tarball, (hwpack_format, hwpack) in zip(self.hwpacks, results):
+            if hwpack is None:
+                raise HwpackReaderError("Hardwarepack '%s' cannot be "
+                                        "read, no metadata found." %
+                                        (tarball))
+            if hwpack_format == "3.0":
+                self.supported_elements.append(hwpack)
+            else:
+                raise HwpackReaderError("Hardwarepack '%s' cannot be "
+                                        "read, unsupported format." %
+                                        (tarball))
 
     def get_supported_boards(self):
         """Prints the necessary information.
@@ -19,7 +19,10 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+from contextlib import contextmanager
+import fcntl
 import hashlib
+import json
 import logging
 import os
 import re
@@ -34,13 +37,15 @@ from apt.cache import FetchFailedException
 from apt.package import FetchError
 import apt_pkg
 
-from debian.debfile import DebFile
-
 from linaro_image_tools import cmd_runner
+from linaro_image_tools.hwpack.deb_reader import DebReader
 
 
 logger = logging.getLogger(__name__)
 
+# The lock serializing the use of a cache directory shared between builds.
+CACHE_LOCK = '.lock'
+
 
 def get_packages_file(packages, extra_text=None, rel_to=None):
     """Get the Packages file contents indexing `packages`.
@@ -393,7 +398,7 @@ class FetchedPackage(object):
     @classmethod
     def from_deb(cls, deb_file_path):
         """Create a FetchedPackage from a binary package on disk."""
-        debcontrol = DebFile(deb_file_path).control.debcontrol()
+        debcontrol = DebReader(deb_file_path).control()
         name = debcontrol['Package']
         version = debcontrol['Version']
         filename = os.path.basename(deb_file_path)
@@ -460,6 +465,72 @@ class FetchedPackage(object):
                 self.replaces, self.breaks, has_content))
 
 
+def apt_lists_cache_key(sources, architecture=None, prefer_label=None):
+    """Return the name of the directory the lists of these sources are kept in.
+
+    file: sources are left out, as their lists are never kept.
+    """
+    remote_sources = [
+        source for source in sources if not source.startswith('file:')]
+    key = json.dumps([remote_sources, architecture, prefer_label])
+    return hashlib.sha1(key).hexdigest()
+
+
+@contextmanager
+def _locked(directory):
+    """Hold an exclusive lock on the directory while in the block."""
+    with open(os.path.join(directory, CACHE_LOCK), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _is_cached_list(name):
+    # Lists of file: sources are named after their path, so start with an
+    # underscore.
+    return name not in ('lock', 'partial', CACHE_LOCK) and \
+        not name.startswith('_')
+
+
+def _link_or_copy(src, dst):
+    """Hard link src to dst, replacing dst; copy it if it can't be linked.
+
+    apt replaces list files rather than writing into them, so a list can
+    be shared by several directories.  The copy is made with
+    cp --reflink=auto, as the rootfs cache does, so that filesystems which
+    support it (e.g. btrfs) share the data rather than duplicating it.
+    """
+    tmp = '%s.tmp.%d' % (dst, os.getpid())
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            cmd_runner.run(
+                ['cp', '--reflink=auto', '--preserve=mode,timestamps', src,
+                 tmp]).wait()
+        except (OSError, cmd_runner.SubcommandNonZeroReturnValue):
+            shutil.copy2(src, tmp)
+    os.rename(tmp, dst)
+
+
+def _sync_lists(src_dir, dst_dir):
+    """Make the kept lists in dst_dir those of src_dir."""
+    names = set(name for name in os.listdir(src_dir) if _is_cached_list(name))
+    for name in os.listdir(dst_dir):
+        if _is_cached_list(name) and name not in names:
+            os.unlink(os.path.join(dst_dir, name))
+    for name in names:
+        src = os.path.join(src_dir, name)
+        dst = os.path.join(dst_dir, name)
+        if not os.path.isfile(src):
+            continue
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            continue
+        _link_or_copy(src, dst)
+
+
 class IsolatedAptCache(object):
     """A apt.cache.Cache wrapper that isolates it from the system it runs on.
 
@@ -467,7 +538,8 @@ class IsolatedAptCache(object):
     :type cache: apt.cache.Cache
     """
 
-    def __init__(self, sources, architecture=None, prefer_label=None):
+    def __init__(self, sources, architecture=None, prefer_label=None,
+                 lists_cache_dir=None, update_lists=True):
         """Create an IsolatedAptCache.
 
         :param sources: a list of sources such that they can be prefixed
@@ -475,11 +547,21 @@ class IsolatedAptCache(object):
         :type sources: an iterable of str
         :param architecture: the architecture to fetch packages for.
         :type architecture: str
+        :param lists_cache_dir: a directory to keep the package lists in
+            between runs, per sources, architecture and prefer_label, so
+            that apt only downloads the lists that changed.
+        :type lists_cache_dir: str
+        :param update_lists: whether to update the lists of the sources
+            other than file: ones.  If False, the lists kept in
+            lists_cache_dir are used as they are, e.g. when offline.
+        :type update_lists: bool
         """
         self.sources = sources
         self.architecture = architecture
         self.tempdir = None
         self.prefer_label = prefer_label
+        self.lists_cache_dir = lists_cache_dir
+        self.update_lists = update_lists
 
     def prepare(self):
         """Prepare the IsolatedAptCache for use.
@@ -548,18 +630,61 @@ class IsolatedAptCache(object):
                     'Package: *\n'
                     'Pin: release l=%s\n'
                     'Pin-Priority: 1001\n' % self.prefer_label)
+        lists_dir = os.path.join(self.tempdir, "var/lib/apt/lists")
+        cached_lists_dir = self._get_cached_lists_dir()
+        if cached_lists_dir is not None:
+            with _locked(cached_lists_dir):
+                _sync_lists(cached_lists_dir, lists_dir)
+            if not self.update_lists and not os.listdir(lists_dir):
+                logger.warning("No package lists kept in %s" %
+                               cached_lists_dir)
         # XXX: This is a temporary workaround for bug 885895.
         apt_pkg.config.set("Dir::bin::dpkg", "/bin/false")
         self.cache = Cache(rootdir=self.tempdir, memonly=True)
         logger.debug("Updating apt cache")
         try:
-            self.cache.update()
+            if self.update_lists:
+                self.cache.update()
+            else:
+                self._update_file_lists()
         except FetchFailedException, e:
             obfuscated_e = re.sub(r"([^ ]https://).+?(@)", r"\1***\2", str(e))
             raise FetchFailedException(obfuscated_e)
+        if cached_lists_dir is not None and self.update_lists:
+            with _locked(cached_lists_dir):
+                _sync_lists(lists_dir, cached_lists_dir)
         self.cache.open()
         return self
 
+    def _get_cached_lists_dir(self):
+        """Return the directory the lists of this cache are kept in, if any.
+        """
+        if self.lists_cache_dir is None:
+            return None
+        cached_lists_dir = os.path.join(
+            self.lists_cache_dir, apt_lists_cache_key(
+                self.sources, self.architecture, self.prefer_label))
+        if not os.path.isdir(cached_lists_dir):
+            os.makedirs(cached_lists_dir)
+        return cached_lists_dir
+
+    def _update_file_lists(self):
+        """Update the lists of the file: sources only.
+
+        The lists of the other sources, kept from an earlier run, are left
+        alone.
+        """
+        file_sources = [
+            source for source in self.sources if source.startswith('file:')]
+        if not file_sources:
+            return
+        sources_list = os.path.join(
+            self.tempdir, "etc", "apt", "sources.list.file")
+        with open(sources_list, 'w') as f:
+            for source in file_sources:
+                f.write("deb %s\n" % source)
+        self.cache.update(sources_list=sources_list)
+
     def set_installed_packages(self, packages, reopen=True):
         """Set a list of packages as those installed on the system.
 
@@ -602,10 +727,99 @@ class DependencyNotSatisfied(Exception):
     pass
 
 
+class DebStore(object):
+    """A store of downloaded packages, shared between builds.
+
+    Packages are kept under their checksum, so a package is only ever
+    downloaded once, whichever source or build asks for it.  Once the store
+    grows over max_size bytes the least recently used packages are dropped.
+    """
+
+    def __init__(self, directory, max_size=None):
+        """Create a DebStore.
+
+        :param directory: the directory to keep the packages in.
+        :type directory: str
+        :param max_size: the number of bytes to keep at most, or None for no
+            limit.
+        :type max_size: int
+        """
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, hash_type, digest):
+        return os.path.join(self.directory, hash_type, digest[:2], digest)
+
+    def link_into(self, hash_type, digest, size, dest):
+        """Put the package with the given checksum at dest, if it's stored.
+
+        :return: whether the package was in the store.
+        """
+        path = self._path(hash_type, digest)
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            _link_or_copy(path, dest)
+            # Mark the package as used.
+            os.utime(path, None)
+        except (IOError, OSError):
+            # Not stored, or dropped by another build meanwhile.
+            return False
+        return True
+
+    def add(self, hash_type, digest, path):
+        """Add the package at path, which has the given checksum."""
+        stored = self._path(hash_type, digest)
+        if not os.path.isdir(os.path.dirname(stored)):
+            try:
+                os.makedirs(os.path.dirname(stored))
+            except OSError:
+                # Created by another build meanwhile.
+                pass
+        _link_or_copy(path, stored)
+        # apt may have dated the file after the server's copy.
+        os.utime(stored, None)
+
+    def prune(self):
+        """Drop the least recently used packages until under max_size."""
+        if self.max_size is None:
+            return
+        with _locked(self.directory):
+            entries = []
+            for dirpath, _, filenames in os.walk(self.directory):
+                for name in filenames:
+                    if name == CACHE_LOCK or '.tmp.' in name:
+                        continue
+                    path = os.path.join(dirpath, name)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                os.unlink(path)
+                total -= size
+
+
+def _package_checksum(candidate):
+    """Return the strongest checksum apt has for the candidate.
+
+    :return: a (hash type, digest) tuple.
+    """
+    sha256 = getattr(candidate, 'sha256', None)
+    if sha256:
+        return 'sha256', sha256
+    return 'md5', candidate.md5
+
+
 class PackageFetcher(object):
     """A class to fetch packages from a defined list of sources."""
 
-    def __init__(self, sources, architecture=None, prefer_label=None):
+    def __init__(self, sources, architecture=None, prefer_label=None,
+                 lists_cache_dir=None, update_lists=True, deb_cache_dir=None,
+                 deb_cache_size=None):
         """Create a PackageFetcher.
 
         Once created a PackageFetcher should have its `prepare` method
@@ -616,9 +830,21 @@ class PackageFetcher(object):
         :type sources: an iterable of str
         :param architecture: the architecture to fetch packages for.
         :type architecture: str
+        :param lists_cache_dir: see IsolatedAptCache.
+        :param update_lists: see IsolatedAptCache.
+        :param deb_cache_dir: a directory to keep the downloaded packages in,
+            shared between builds, so that they are only downloaded once.
+        :type deb_cache_dir: str
+        :param deb_cache_size: the number of bytes to keep in deb_cache_dir
+            at most, or None for no limit.
+        :type deb_cache_size: int
         """
         self.cache = IsolatedAptCache(
-            sources, architecture=architecture, prefer_label=prefer_label)
+            sources, architecture=architecture, prefer_label=prefer_label,
+            lists_cache_dir=lists_cache_dir, update_lists=update_lists)
+        self.deb_store = None
+        if deb_cache_dir is not None:
+            self.deb_store = DebStore(deb_cache_dir, max_size=deb_cache_size)
 
     def prepare(self):
         """Prepare the PackageFetcher for use.
@@ -748,6 +974,7 @@ class PackageFetcher(object):
             return fetched.values()
         acq = apt_pkg.Acquire(DummyProgress())
         acqfiles = []
+        stored = []
         # re to remove the repo private key
         deb_url_auth_re = re.compile(
             r"(?P<transport>.*://)(?P<user>.*):.*@(?P<path>.*$)")
@@ -762,10 +989,16 @@ class PackageFetcher(object):
                 fetched[package.name] = result_package
             result_package = fetched[package.name]
             destfile = os.path.join(self.cache.tempdir, base)
+            checksum = _package_checksum(candidate)
+            if self.deb_store is not None and self.deb_store.link_into(
+                    checksum[0], checksum[1], candidate.size, destfile):
+                logger.debug(" ... from the package store")
+                stored.append((result_package, destfile))
+                continue
             acqfile = apt_pkg.AcquireFile(
                 acq, candidate.uri, candidate.md5, candidate.size,
                 base, destfile=destfile)
-            acqfiles.append((acqfile, result_package, destfile))
+            acqfiles.append((acqfile, result_package, destfile, checksum))
             # check if we have a private key in the pkg url
             deb_url_auth = deb_url_auth_re.match(acqfile.desc_uri)
             if deb_url_auth:
@@ -774,11 +1007,17 @@ class PackageFetcher(object):
                 logger.debug(" ... from %s" % acqfile.desc_uri)
         self.cache.cache.clear()
         acq.run()
-        for acqfile, result_package, destfile in acqfiles:
+        for acqfile, result_package, destfile, checksum in acqfiles:
             if acqfile.status != acqfile.STAT_DONE:
                 raise FetchError(
                     "The item %r could not be fetched: %s" %
                     (acqfile.destfile, acqfile.error_text))
+            if self.deb_store is not None:
+                self.deb_store.add(checksum[0], checksum[1], destfile)
+            stored.append((result_package, destfile))
+        for result_package, destfile in stored:
             result_package.content = open(destfile)
             result_package._file_path = destfile
+        if self.deb_store is not None and acqfiles:
+            self.deb_store.prune()
         return fetched.values()
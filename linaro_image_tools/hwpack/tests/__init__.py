@@ -26,8 +26,10 @@ def test_suite():
     module_names = [
         'linaro_image_tools.hwpack.tests.test_better_tarfile',
         'linaro_image_tools.hwpack.tests.test_builder',
+        'linaro_image_tools.hwpack.tests.test_catalog',
         'linaro_image_tools.hwpack.tests.test_config',
         'linaro_image_tools.hwpack.tests.test_config_v3',
+        'linaro_image_tools.hwpack.tests.test_deb_reader',
         'linaro_image_tools.hwpack.tests.test_hardwarepack',
         'linaro_image_tools.hwpack.tests.test_hwpack_converter',
         'linaro_image_tools.hwpack.tests.test_hwpack_reader',
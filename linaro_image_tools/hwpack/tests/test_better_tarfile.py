@@ -20,8 +20,10 @@
 # USA.
 
 from contextlib import contextmanager
+import os
 from StringIO import StringIO
 import tarfile
+import tempfile
 
 from testtools import TestCase
 
@@ -131,6 +133,40 @@ class TarFileTests(TestCase):
         with standard_tarfile(backing_file) as tf:
             self.assertEqual(gname, tf.getmember("foo").gname)
 
+    def test_create_file_from_fileobj_reads_size_bytes(self):
+        backing_file = StringIO()
+        content = StringIO("barbaz")
+        with writeable_tarfile(backing_file) as tf:
+            tf.create_file_from_fileobj("foo", content, 3)
+        with standard_tarfile(backing_file) as tf:
+            self.assertEqual(3, tf.getmember("foo").size)
+            self.assertEqual("bar", tf.extractfile("foo").read())
+        self.assertEqual("baz", content.read())
+
+    def test_create_file_from_fileobj_uses_defaults(self):
+        backing_file = StringIO()
+        with writeable_tarfile(
+                backing_file, default_mtime=126793, default_uid=1259) as tf:
+            tf.create_file_from_fileobj("foo", StringIO("bar"), 3)
+        with standard_tarfile(backing_file) as tf:
+            self.assertEqual(126793, tf.getmember("foo").mtime)
+            self.assertEqual(1259, tf.getmember("foo").uid)
+            self.assertEqual(0644, tf.getmember("foo").mode)
+
+    def test_create_file_from_path(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.unlink, path)
+        os.write(fd, "bar")
+        os.close(fd)
+        os.chmod(path, 0600)
+        backing_file = StringIO()
+        with writeable_tarfile(backing_file, default_uid=1259) as tf:
+            tf.create_file_from_path("foo", path)
+        with standard_tarfile(backing_file) as tf:
+            self.assertEqual("bar", tf.extractfile("foo").read())
+            self.assertEqual(1259, tf.getmember("foo").uid)
+            self.assertEqual(0644, tf.getmember("foo").mode)
+
     def test_create_dir_adds_path(self):
         backing_file = self.create_simple_tarball([("foo/", "")])
         with standard_tarfile(backing_file) as tf:
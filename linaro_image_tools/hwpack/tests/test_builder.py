@@ -26,6 +26,7 @@ from testtools import TestCase
 from testtools.matchers import Equals
 
 from linaro_image_tools.hwpack.builder import (
+    ArchitectureBuildError,
     ConfigFileMissing,
     PackageUnpacker,
     HardwarePackBuilder,
@@ -53,7 +54,6 @@ from linaro_image_tools.hwpack.testing import (
 from linaro_image_tools.testing import TestCaseWithFixtures
 from linaro_image_tools.tests.fixtures import (
     MockSomethingFixture,
-    MockCmdRunnerPopenFixture,
 )
 
 
@@ -76,24 +76,35 @@ class PackageUnpackerTests(TestCaseWithFixtures):
             tempdir = package_unpacker.tempdir
         self.assertFalse(os.path.exists(tempdir))
 
+    def make_package(self, files):
+        maker = PackageMaker()
+        self.useFixture(ContextManagerFixture(maker))
+        return maker.make_package('foo', '1.0', {}, files=files)
+
     def test_unpack_package(self):
-        fixture = MockCmdRunnerPopenFixture(assert_child_finished=False)
-        self.useFixture(fixture)
-        package_file_name = "package-to-unpack"
+        package_file_name = self.make_package(["usr/lib/u-boot/u-boot.img"])
         with PackageUnpacker() as package_unpacker:
             package_unpacker.unpack_package(package_file_name)
-            package_dir = package_unpacker.get_path(package_file_name)
-        self.assertEquals(
-            ["tar -C %s -xf -" % package_dir,
-             "dpkg --fsys-tarfile %s" % package_file_name],
-            fixture.mock.commands_executed)
+            self.assertTrue(os.path.isfile(package_unpacker.get_path(
+                package_file_name, "usr/lib/u-boot/u-boot.img")))
+
+    def test_unpack_file_extracts_only_the_file(self):
+        package_file_name = self.make_package(
+            ["usr/lib/u-boot/u-boot.img", "usr/share/doc/foo/README"])
+        with PackageUnpacker() as package_unpacker:
+            package_unpacker.unpack_file(
+                package_file_name, "usr/lib/u-boot/u-boot.img")
+            self.assertTrue(os.path.isfile(package_unpacker.get_path(
+                package_file_name, "usr/lib/u-boot/u-boot.img")))
+            self.assertFalse(os.path.exists(package_unpacker.get_path(
+                package_file_name, "usr/share/doc/foo/README")))
 
     def test_get_file_returns_tempfile(self):
         package = 'package'
         file = 'dummyfile'
         with PackageUnpacker() as package_unpacker:
             self.useFixture(MockSomethingFixture(
-                package_unpacker, 'unpack_package', lambda package: None))
+                package_unpacker, 'unpack_file', lambda package, file: None))
             self.useFixture(MockSomethingFixture(
                 os.path, 'exists', lambda file: True))
             tempfile = package_unpacker.get_file(package, file)
@@ -106,7 +117,7 @@ class PackageUnpackerTests(TestCaseWithFixtures):
         file = 'dummyfile'
         with PackageUnpacker() as package_unpacker:
             self.useFixture(MockSomethingFixture(
-                package_unpacker, 'unpack_package', lambda package: None))
+                package_unpacker, 'unpack_file', lambda package, file: None))
             self.assertRaises(AssertionError, package_unpacker.get_file,
                               package, file)
 
@@ -119,7 +130,7 @@ class PackageUnpackerTests(TestCaseWithFixtures):
         file = 'dummyfile'
         with PackageUnpacker() as package_unpacker:
             self.useFixture(MockSomethingFixture(
-                package_unpacker, 'unpack_package', lambda package: None))
+                package_unpacker, 'unpack_file', lambda package, file: None))
             self.useFixture(MockSomethingFixture(
                 os.path, 'exists', lambda file: True))
             tempfile1 = package_unpacker.get_file(package1, file)
@@ -247,6 +258,91 @@ class HardwarePackBuilderTests(TestCaseWithFixtures):
         self.assertTrue(os.path.isfile("hwpack_ahwpack_1.0_i386.tar.gz"))
         self.assertTrue(os.path.isfile("hwpack_ahwpack_1.0_armel.tar.gz"))
 
+    def test_builds_one_pack_per_arch_in_parallel(self):
+        available_package = DummyFetchedPackage("foo", "1.1")
+        sources_dict = self.sourcesDictForPackages([available_package])
+        metadata, config = self.makeMetaDataAndConfigFixture(
+            ["foo"], sources_dict, architecture="i386 armel")
+        builder = HardwarePackBuilder(config.filename, "1.0", [], jobs=2)
+        builder.build()
+        self.assertTrue(os.path.isfile("hwpack_ahwpack_1.0_i386.tar.gz"))
+        self.assertTrue(os.path.isfile("hwpack_ahwpack_1.0_armel.tar.gz"))
+
+    def test_parallel_build_matches_serial_build(self):
+        u_boot_file = "usr/lib/u-boot/omap4_panda/u-boot.img"
+        maker = PackageMaker()
+        self.useFixture(ContextManagerFixture(maker))
+        deb_file_path = maker.make_package(
+            'wanted-package', '1.0', {}, files=[u_boot_file])
+        available_package = DummyFetchedPackage(
+            'wanted-package', '1.0', content=open(deb_file_path).read())
+        sources_dict = self.sourcesDictForPackages([available_package])
+        extra_config = dict(self.extra_config)
+        del extra_config['x_loader_package']
+        del extra_config['x_loader_file']
+        extra_config['u-boot-file'] = u_boot_file
+        _, config = self.makeMetaDataAndConfigFixture(
+            ["wanted-package"], sources_dict, architecture="i386 armel",
+            extra_config=extra_config)
+
+        def build(jobs):
+            HardwarePackBuilder(
+                config.filename, "1.0", [], jobs=jobs).build()
+            contents = {}
+            for architecture in ("i386", "armel"):
+                tf = tarfile.open(
+                    "hwpack_ahwpack_1.0_%s.tar.gz" % architecture,
+                    mode="r:gz")
+                try:
+                    contents[architecture] = sorted(
+                        (member.name,
+                         member.isfile() and tf.extractfile(member).read())
+                        for member in tf.getmembers())
+                finally:
+                    tf.close()
+            return contents
+
+        serial_contents = build(jobs=1)
+        self.assertEqual(serial_contents, build(jobs=2))
+        # Each architecture gets the bootloader, not just the first one.
+        for architecture in ("i386", "armel"):
+            self.assertIn(
+                "u-boot/u-boot.img",
+                [name for name, _ in serial_contents[architecture]])
+
+    def test_parallel_build_keeps_build_info_of_last_arch(self):
+        _, config = self.makeMetaDataAndConfigFixture(
+            ["foo"], {'ubuntu': 'http://example.com/ ./'},
+            architecture="i386 armel armhf")
+        builder = HardwarePackBuilder(config.filename, "1.0", [], jobs=3)
+
+        def build_architecture(architecture):
+            open(architecture, 'w').close()
+            return "build info for %s" % architecture
+        self.useFixture(MockSomethingFixture(
+            builder, 'build_architecture', build_architecture))
+        builder.build()
+        self.assertEqual(
+            "build info for armhf", open('BUILD-INFO.txt').read())
+        for architecture in ("i386", "armel", "armhf"):
+            self.assertTrue(os.path.isfile(architecture))
+
+    def test_parallel_build_reports_failed_arch(self):
+        _, config = self.makeMetaDataAndConfigFixture(
+            ["foo"], {'ubuntu': 'http://example.com/ ./'},
+            architecture="i386 armel")
+        builder = HardwarePackBuilder(config.filename, "1.0", [], jobs=2)
+
+        def build_architecture(architecture):
+            if architecture == "armel":
+                raise ValueError("no armel for you")
+            return ""
+        self.useFixture(MockSomethingFixture(
+            builder, 'build_architecture', build_architecture))
+        e = self.assertRaises(ArchitectureBuildError, builder.build)
+        self.assertEqual("armel", e.architecture)
+        self.assertIn("no armel for you", str(e))
+
     def test_builds_correct_contents(self):
         package_name = "foo"
         available_package = DummyFetchedPackage(package_name, "1.1")
@@ -0,0 +1,186 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tarfile
+from StringIO import StringIO
+
+from linaro_image_tools.hwpack import catalog
+from linaro_image_tools.hwpack.catalog import (
+    HwpackCatalog,
+    HwpackCatalogError,
+    scan_hwpack,
+)
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import (
+    CreateTempDirFixture,
+    MockSomethingFixture,
+)
+
+METADATA = """format: 3.0
+name: %(name)s
+version: '1'
+architecture: armel
+origin: Linaro
+bootloaders:
+ u_boot:
+  file: u-boot.img
+boards:
+ panda:
+  support: supported
+ snowball:
+  support: supported
+  bootloaders:
+   uefi:
+    file: uefi.bin
+"""
+
+
+class HwpackCatalogTests(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(HwpackCatalogTests, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        self.hwpack_dir = os.path.join(self.tempdir, 'hwpacks')
+        os.mkdir(self.hwpack_dir)
+        self.catalog = HwpackCatalog(os.path.join(self.tempdir, 'hwpacks.db'))
+        self.addCleanup(self.catalog.close)
+
+    def make_hwpack(self, filename, name='ahwpack', packages=()):
+        path = os.path.join(self.hwpack_dir, filename)
+        files = [('FORMAT', '3.0\n'), ('metadata', METADATA % dict(name=name))]
+        files.extend(('pkgs/%s' % package, '') for package in packages)
+        tar = tarfile.open(path, mode='w:gz')
+        for member, data in files:
+            tarinfo = tarfile.TarInfo(member)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, StringIO(data))
+        tar.close()
+        return path
+
+    def count_scans(self):
+        scanned = []
+        scan = catalog._scan_hwpack
+
+        def counting_scan(path):
+            scanned.append(path)
+            return scan(path)
+        self.useFixture(MockSomethingFixture(
+            catalog, '_scan_hwpack', counting_scan))
+        return scanned
+
+    def test_scan_hwpack(self):
+        path = self.make_hwpack(
+            'a.tar.gz', packages=['foo_1.0-2_armel.deb'])
+        sha256, info = scan_hwpack(path)
+        self.assertEqual(64, len(sha256))
+        self.assertEqual('ahwpack', info['name'])
+        self.assertEqual('1', info['version'])
+        self.assertEqual('armel', info['architecture'])
+        self.assertEqual('3.0', info['format'])
+        self.assertEqual(
+            [('panda', 'u_boot'), ('snowball', 'uefi')], info['boards'])
+        self.assertEqual(
+            [('foo', '1.0', '2', 'armel', 'pkgs/foo_1.0-2_armel.deb')],
+            info['packages'])
+        self.assertEqual(
+            ['FORMAT', 'metadata', 'pkgs/foo_1.0-2_armel.deb'],
+            [member[0] for member in info['members']])
+
+    def test_scan_hwpack_without_metadata(self):
+        path = os.path.join(self.hwpack_dir, 'bad.tar.gz')
+        tarfile.open(path, mode='w:gz').close()
+        self.assertRaises(HwpackCatalogError, scan_hwpack, path)
+
+    def test_find(self):
+        first = self.make_hwpack('first.tar.gz', name='first')
+        second = self.make_hwpack('second.tar.gz', name='second')
+        self.catalog.update(self.hwpack_dir, workers=1)
+        self.assertEqual([first, second], self.catalog.find(board='panda'))
+        self.assertEqual(
+            [first, second],
+            self.catalog.find(board='snowball', bootloader='uefi'))
+        self.assertEqual(
+            [], self.catalog.find(board='snowball', bootloader='u_boot'))
+        self.assertEqual([second], self.catalog.find(name='second'))
+        self.assertEqual([], self.catalog.find(board='beagle'))
+
+    def test_update_only_reads_changed_files(self):
+        first = self.make_hwpack('first.tar.gz', name='first')
+        self.make_hwpack('second.tar.gz', name='second')
+        self.catalog.update(self.hwpack_dir, workers=1)
+        scanned = self.count_scans()
+        self.catalog.update(self.hwpack_dir, workers=1)
+        self.assertEqual([], scanned)
+        self.make_hwpack('first.tar.gz', name='renamed')
+        os.utime(first, (0, 0))
+        self.catalog.update(self.hwpack_dir, workers=1)
+        self.assertEqual([first], scanned)
+        self.assertEqual([first], self.catalog.find(name='renamed'))
+        self.assertEqual([], self.catalog.find(name='first'))
+
+    def test_update_reuses_known_contents(self):
+        first = self.make_hwpack(
+            'first.tar.gz', packages=['foo_1.0_armel.deb'])
+        self.catalog.update(self.hwpack_dir, workers=1)
+        copy = os.path.join(self.hwpack_dir, 'copy.tar.gz')
+        shutil.copy(first, copy)
+        self.catalog.update(self.hwpack_dir, workers=1)
+        self.assertEqual(
+            self.catalog.get_hwpack(first), self.catalog.get_hwpack(copy))
+        self.assertEqual(
+            self.catalog.get_packages(first), self.catalog.get_packages(copy))
+        self.assertEqual(
+            1, self.catalog.db.execute(
+                'SELECT COUNT(*) FROM packages').fetchone()[0])
+
+    def test_update_drops_removed_files(self):
+        first = self.make_hwpack('first.tar.gz', name='first')
+        self.catalog.update(self.hwpack_dir, workers=1)
+        os.remove(first)
+        self.catalog.update(self.hwpack_dir, workers=1)
+        self.assertEqual([], self.catalog.find())
+        self.assertRaises(KeyError, self.catalog.get_hwpack, first)
+        self.assertEqual(
+            0, self.catalog.db.execute(
+                'SELECT COUNT(*) FROM members').fetchone()[0])
+
+    def test_update_reports_errors(self):
+        good = self.make_hwpack('good.tar.gz')
+        with open(os.path.join(self.hwpack_dir, 'bad.tar.gz'), 'w') as fd:
+            fd.write('not a tarball')
+        changed, errors = self.catalog.update(self.hwpack_dir, workers=1)
+        self.assertEqual(2, len(changed))
+        self.assertEqual(1, len(errors))
+        self.assertEqual([good], self.catalog.find())
+
+    def test_update_in_parallel(self):
+        paths = [self.make_hwpack('%d.tar.gz' % i, name='hwpack%d' % i)
+                 for i in range(4)]
+        self.catalog.update(self.hwpack_dir, workers=2)
+        self.assertEqual(paths, self.catalog.find(board='panda'))
+
+    def test_catalog_persists(self):
+        path = self.make_hwpack('first.tar.gz')
+        self.catalog.update(self.hwpack_dir, workers=1)
+        self.catalog.close()
+        self.catalog = HwpackCatalog(self.catalog.db_file)
+        self.assertEqual([path], self.catalog.find(board='panda'))
+        self.assertEqual(
+            ['FORMAT', 'metadata'],
+            [member[0] for member in self.catalog.get_members(path)])
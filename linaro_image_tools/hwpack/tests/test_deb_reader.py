@@ -0,0 +1,227 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+import bz2
+import gzip
+import os
+import subprocess
+import tarfile
+from distutils.spawn import find_executable
+from StringIO import StringIO
+
+from testtools import skipUnless
+
+from linaro_image_tools.hwpack.deb_reader import (
+    DebError,
+    DebReader,
+)
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import CreateTempDirFixture
+
+
+def make_tar(files, symlinks=()):
+    """Return a tarball with the given (name, contents) members.
+
+    Members whose contents are None are directories.  symlinks are
+    (name, target) pairs added before the files.
+    """
+    buf = StringIO()
+    tar = tarfile.open(mode='w', fileobj=buf)
+    for name, target in symlinks:
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = target
+        tar.addfile(tarinfo)
+    for name, contents in files:
+        tarinfo = tarfile.TarInfo(name)
+        if contents is None:
+            tarinfo.type = tarfile.DIRTYPE
+            tarinfo.mode = 0755
+            tar.addfile(tarinfo)
+            continue
+        tarinfo.size = len(contents)
+        tarinfo.mode = 0644
+        tar.addfile(tarinfo, StringIO(contents))
+    tar.close()
+    return buf.getvalue()
+
+
+def compress(data, suffix):
+    if suffix == '.gz':
+        buf = StringIO()
+        gz = gzip.GzipFile(mode='wb', fileobj=buf)
+        gz.write(data)
+        gz.close()
+        return buf.getvalue()
+    if suffix == '.bz2':
+        return bz2.compress(data)
+    if suffix == '.xz':
+        proc = subprocess.Popen(
+            ['xz', '-c'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return proc.communicate(data)[0]
+    return data
+
+
+def make_ar(members):
+    """Return an ar archive with the given (name, contents) members."""
+    chunks = ['!<arch>\n']
+    for name, contents in members:
+        chunks.append('%-16s%-12d%-6d%-6d%-8s%-10d`\n' % (
+            name, 0, 0, 0, '100644', len(contents)))
+        chunks.append(contents)
+        if len(contents) % 2:
+            chunks.append('\n')
+    return ''.join(chunks)
+
+
+def make_deb(files, control="Package: foo\nVersion: 1.0\n", suffix='.gz',
+             symlinks=()):
+    control_tar = make_tar([('./control', control)])
+    data_tar = make_tar(files, symlinks)
+    return make_ar([
+        ('debian-binary', '2.0\n'),
+        ('control.tar' + suffix, compress(control_tar, suffix)),
+        ('data.tar' + suffix, compress(data_tar, suffix)),
+    ])
+
+
+class DebReaderTests(TestCaseWithFixtures):
+
+    files = [
+        ('.', None),
+        ('./usr/', None),
+        ('./usr/lib/', None),
+        ('./usr/lib/u-boot.img', 'u-boot'),
+        ('./usr/lib/odd', 'odd length'),
+    ]
+
+    def make_deb_file(self, deb):
+        tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        path = os.path.join(tempdir, 'foo_1.0_armel.deb')
+        with open(path, 'wb') as fd:
+            fd.write(deb)
+        return path
+
+    def assertReads(self, suffix):
+        reader = DebReader(StringIO(make_deb(self.files, suffix=suffix)))
+        self.assertEqual(
+            [name.rstrip('/') for name, _ in self.files],
+            [tarinfo.name for tarinfo in reader.list_data()])
+        self.assertEqual('u-boot', reader.read_file('usr/lib/u-boot.img'))
+        self.assertEqual('1.0', reader.control()['Version'])
+
+    def test_member_names(self):
+        reader = DebReader(StringIO(make_deb(self.files)))
+        self.assertEqual(
+            ['debian-binary', 'control.tar.gz', 'data.tar.gz'],
+            reader.member_names())
+
+    def test_uncompressed(self):
+        self.assertReads('')
+
+    def test_gzip(self):
+        self.assertReads('.gz')
+
+    def test_bzip2(self):
+        self.assertReads('.bz2')
+
+    @skipUnless(find_executable('xz'), "xz is not installed")
+    def test_xz(self):
+        self.assertReads('.xz')
+
+    def test_control(self):
+        reader = DebReader(StringIO(make_deb(
+            self.files, control="Package: foo\nBuild-Info: yes\n")))
+        control = reader.control()
+        self.assertEqual('foo', control['Package'])
+        self.assertEqual('yes', control.get('Build-Info'))
+
+    def test_read_file_missing(self):
+        reader = DebReader(StringIO(make_deb(self.files)))
+        self.assertEqual(None, reader.read_file('usr/lib/missing'))
+        self.assertEqual(None, reader.read_file('usr/lib'))
+
+    def test_extract_file(self):
+        path = self.make_deb_file(make_deb(self.files))
+        dest = os.path.join(os.path.dirname(path), 'odd')
+        self.assertTrue(DebReader(path).extract_file('/usr/lib/odd', dest))
+        self.assertEqual('odd length', open(dest).read())
+        self.assertFalse(DebReader(path).extract_file('usr/lib/nope', dest))
+
+    def test_extract_all(self):
+        path = self.make_deb_file(make_deb(
+            self.files + [('../escape', 'nope')]))
+        dest = os.path.join(os.path.dirname(path), 'unpacked')
+        os.mkdir(dest)
+        DebReader(path).extract_all(dest)
+        self.assertEqual(
+            'u-boot', open(os.path.join(dest, 'usr/lib/u-boot.img')).read())
+        self.assertFalse(
+            os.path.exists(os.path.join(os.path.dirname(path), 'escape')))
+
+    def test_extract_all_strips_absolute_names(self):
+        path = self.make_deb_file(make_deb(
+            self.files + [('/escaped/abs', 'nope')]))
+        dest = os.path.join(os.path.dirname(path), 'unpacked')
+        os.mkdir(dest)
+        DebReader(path).extract_all(dest)
+        self.assertEqual(
+            'nope', open(os.path.join(dest, 'escaped/abs')).read())
+        self.assertFalse(os.path.exists('/escaped/abs'))
+
+    def test_extract_all_does_not_write_through_symlinks(self):
+        tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        outside = os.path.join(tempdir, 'outside')
+        os.mkdir(outside)
+        dest = os.path.join(tempdir, 'unpacked')
+        os.mkdir(dest)
+        path = self.make_deb_file(make_deb(
+            self.files + [('./link/escaped', 'nope')],
+            symlinks=[('./link', outside), ('./usr/lib/abs', '/etc')]))
+        DebReader(path).extract_all(dest)
+        self.assertEqual([], os.listdir(outside))
+        self.assertEqual(
+            '/etc', os.readlink(os.path.join(dest, 'usr/lib/abs')))
+        # A symlink already there, as if from an earlier package.
+        os.symlink(outside, os.path.join(dest, 'old-link'))
+        path = self.make_deb_file(make_deb(
+            self.files + [('./old-link/escaped', 'nope')]))
+        DebReader(path).extract_all(dest)
+        self.assertEqual([], os.listdir(outside))
+
+    def test_extract_all_follows_directory_symlinks(self):
+        path = self.make_deb_file(make_deb(
+            self.files + [('./lib/libfoo.so', 'foo')],
+            symlinks=[('./lib', 'usr/lib')]))
+        dest = os.path.join(os.path.dirname(path), 'unpacked')
+        os.mkdir(dest)
+        DebReader(path).extract_all(dest)
+        self.assertEqual('usr/lib', os.readlink(os.path.join(dest, 'lib')))
+        self.assertEqual(
+            'foo', open(os.path.join(dest, 'usr/lib/libfoo.so')).read())
+
+    def test_not_a_deb(self):
+        reader = DebReader(StringIO('not a deb'))
+        self.assertRaises(DebError, reader.list_data)
+
+    def test_missing_data(self):
+        reader = DebReader(StringIO(make_ar([('debian-binary', '2.0\n')])))
+        self.assertRaises(DebError, reader.list_data)
+
+    def test_unsupported_compression(self):
+        reader = DebReader(StringIO(make_ar([('data.tar.foo', 'x')])))
+        self.assertRaises(DebError, reader.list_data)
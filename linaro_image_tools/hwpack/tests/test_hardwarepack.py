@@ -19,6 +19,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+import hashlib
 from StringIO import StringIO
 import re
 import tarfile
@@ -343,6 +344,32 @@ class NewMetadataTests(TestCase):
         self.assertEqual(expected_out, str(metadata))
 
 
+class ChunkedReader(StringIO):
+    """A file object that refuses to be read all at once."""
+
+    def read(self, size=-1):
+        assert 0 <= size <= 64 * 1024, "Read %d bytes at once" % size
+        return StringIO.read(self, size)
+
+
+class StreamedFetchedPackage(DummyFetchedPackage):
+
+    @property
+    def content(self):
+        return ChunkedReader(self._content_str())
+
+    @property
+    def size(self):
+        return len(self._content_str())
+
+    @property
+    def md5(self):
+        return hashlib.md5(self._content_str()).hexdigest()
+
+    def _content_str(self):
+        return "x" * (1024 * 1024)
+
+
 class HardwarePackTests(TestCase):
 
     def setUp(self):
@@ -434,6 +461,16 @@ class HardwarePackTests(TestCase):
             HardwarePackHasFile("pkgs/%s" % package.filename,
                                 content=package.content.read()))
 
+    def test_adds_packages_in_chunks(self):
+        package = StreamedFetchedPackage("foo", "1.1")
+        hwpack = HardwarePack(self.metadata)
+        hwpack.add_packages([package])
+        tf = self.get_tarfile(hwpack)
+        self.assertThat(
+            tf,
+            HardwarePackHasFile("pkgs/%s" % package.filename,
+                                content=package._content_str()))
+
     def test_adds_multiple_packages_at_once(self):
         package1 = DummyFetchedPackage("foo", "1.1")
         package2 = DummyFetchedPackage("bar", "1.1")
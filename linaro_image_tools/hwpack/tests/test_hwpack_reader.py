@@ -17,6 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import tarfile
 from StringIO import StringIO
 from linaro_image_tools.testing import TestCaseWithFixtures
@@ -112,3 +113,37 @@ class HwpackReaderTests(TestCaseWithFixtures):
         self.hwpack.setboards({'panda': {'support': 'supported', 'bootloaders':
                               {'u_boot': {'file': 'a_file'}}}})
         self.assertEqual(self.hwpack, reader.supported_elements[0])
+
+    def test_hwpack_metadata_read_in_parallel(self):
+        tarballs = []
+        for name in ('first', 'second', 'third'):
+            tarball = os.path.join(
+                self.tar_dir_fixture.get_temp_dir(), name + '.tar.gz')
+            metadata = self.metadata.replace('test-hwpack', name)
+            tarballs.append(self.add_to_tarball(
+                [('FORMAT', '3.0\n'), ('metadata', metadata)], tarball))
+        reader = HwpackReader(tarballs, workers=2)
+        reader._read_hwpacks_metadata()
+        self.assertEqual(
+            [('first', tarballs[0]), ('second', tarballs[1]),
+             ('third', tarballs[2])],
+            [(hwpack.name, hwpack.hwpack)
+             for hwpack in reader.supported_elements])
+
+    def test_hwpack_metadata_read_stops_at_metadata(self):
+        # Only the start of the tarball is read, so a truncated tarball is
+        # fine as long as the metadata is there.
+        tarball = self.add_to_tarball(
+            [('FORMAT', '3.0\n'), ('metadata', self.metadata),
+             ('pkgs/foo_1.0_all.deb', os.urandom(1024 * 1024))])
+        with open(tarball, 'r+b') as fd:
+            fd.truncate(os.path.getsize(tarball) / 2)
+        reader = HwpackReader([tarball])
+        reader._read_hwpacks_metadata()
+        self.hwpack.sethwpack(tarball)
+        self.assertEqual(self.hwpack, reader.supported_elements[0])
+
+    def test_raise_exception_without_metadata(self):
+        tarball = self.add_to_tarball([('FORMAT', '3.0\n')])
+        reader = HwpackReader([tarball])
+        self.assertRaises(HwpackReaderError, reader._read_hwpacks_metadata)
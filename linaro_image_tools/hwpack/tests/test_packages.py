@@ -19,6 +19,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+import errno
 import os
 import re
 import shutil
@@ -33,7 +34,10 @@ from debian import deb822
 from testtools import TestCase
 from testtools.matchers import Equals
 
+from linaro_image_tools.hwpack import packages
 from linaro_image_tools.hwpack.packages import (
+    apt_lists_cache_key,
+    DebStore,
     DependencyNotSatisfied,
     DummyProgress,
     FetchedPackage,
@@ -52,6 +56,10 @@ from linaro_image_tools.hwpack.testing import (
     MatchesPackage,
 )
 from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import (
+    CreateTempDirFixture,
+    MockSomethingFixture,
+)
 
 
 class GetPackagesFileTests(TestCase):
@@ -947,6 +955,199 @@ class AptCacheTests(TestCaseWithFixtures):
         self.assertEqual("deb %s\n" % source1.sources_entry, sources_list)
 
 
+class FakeAptCache(object):
+    """An apt Cache whose update writes a list for each source.
+
+    Like apt, a full update removes the lists of sources that are gone.
+    """
+
+    updates = []
+
+    def __init__(self, rootdir=None, memonly=False):
+        self.rootdir = rootdir
+
+    def update(self, sources_list=None):
+        self.updates.append(sources_list)
+        full_update = sources_list is None
+        if full_update:
+            sources_list = os.path.join(self.rootdir, "etc/apt/sources.list")
+        lists_dir = os.path.join(self.rootdir, "var/lib/apt/lists")
+        written = set()
+        for line in open(sources_list):
+            uri = line.split()[1].split('://', 1)[1]
+            name = uri.replace('/', '_') + '_Packages'
+            with open(os.path.join(lists_dir, name), 'w') as f:
+                f.write(line)
+            written.add(name)
+        if full_update:
+            for name in os.listdir(lists_dir):
+                path = os.path.join(lists_dir, name)
+                if name not in written and os.path.isfile(path):
+                    os.unlink(path)
+
+    def open(self):
+        pass
+
+
+class AptListsCacheTests(TestCaseWithFixtures):
+
+    remote = 'http://example.com/ ./'
+
+    def setUp(self):
+        super(AptListsCacheTests, self).setUp()
+        self.lists_cache_dir = self.useFixture(
+            CreateTempDirFixture()).get_temp_dir()
+        FakeAptCache.updates = []
+        self.useFixture(MockSomethingFixture(packages, 'Cache', FakeAptCache))
+
+    def make_cache(self, sources, update_lists=True):
+        cache = IsolatedAptCache(
+            sources, architecture='armel',
+            lists_cache_dir=self.lists_cache_dir, update_lists=update_lists)
+        self.addCleanup(cache.cleanup)
+        cache.prepare()
+        return cache
+
+    def lists(self, cache):
+        return sorted(
+            name for name in os.listdir(
+                os.path.join(cache.tempdir, "var/lib/apt/lists"))
+            if name not in ('lock', 'partial'))
+
+    def kept_lists(self):
+        key = apt_lists_cache_key([self.remote], architecture='armel')
+        return sorted(
+            name for name in os.listdir(
+                os.path.join(self.lists_cache_dir, key))
+            if name != packages.CACHE_LOCK)
+
+    def test_key_ignores_file_sources(self):
+        self.assertEqual(
+            apt_lists_cache_key([self.remote], 'armel'),
+            apt_lists_cache_key(
+                ['file:///tmp/tmpXYZ ./', self.remote], 'armel'))
+        self.assertNotEqual(
+            apt_lists_cache_key([self.remote], 'armel'),
+            apt_lists_cache_key([self.remote], 'armhf'))
+        self.assertNotEqual(
+            apt_lists_cache_key([self.remote], 'armel'),
+            apt_lists_cache_key([self.remote], 'armel', prefer_label='x'))
+
+    def test_prepare_keeps_lists_of_remote_sources(self):
+        self.make_cache([self.remote, 'file:///tmp/tmpXYZ ./'])
+        self.assertEqual(['example.com__Packages'], self.kept_lists())
+
+    def test_prepare_reuses_kept_lists(self):
+        self.make_cache([self.remote])
+        cache = self.make_cache([self.remote])
+        self.assertEqual(['example.com__Packages'], self.lists(cache))
+
+    def test_prepare_drops_stale_lists(self):
+        key = apt_lists_cache_key([self.remote], architecture='armel')
+        os.makedirs(os.path.join(self.lists_cache_dir, key))
+        open(os.path.join(self.lists_cache_dir, key, 'stale'), 'w').close()
+        self.make_cache([self.remote])
+        self.assertEqual(['example.com__Packages'], self.kept_lists())
+
+    def test_prepare_without_update_uses_kept_lists(self):
+        self.make_cache([self.remote])
+        FakeAptCache.updates = []
+        cache = self.make_cache([self.remote], update_lists=False)
+        self.assertEqual([], FakeAptCache.updates)
+        self.assertEqual(['example.com__Packages'], self.lists(cache))
+
+    def test_prepare_without_update_updates_file_sources(self):
+        self.make_cache([self.remote])
+        FakeAptCache.updates = []
+        cache = self.make_cache(
+            [self.remote, 'file:///tmp/tmpXYZ ./'], update_lists=False)
+        self.assertEqual(1, len(FakeAptCache.updates))
+        self.assertEqual(
+            "deb file:///tmp/tmpXYZ ./\n",
+            open(FakeAptCache.updates[0]).read())
+        self.assertEqual(
+            ['_tmp_tmpXYZ_Packages', 'example.com__Packages'],
+            self.lists(cache))
+        self.assertEqual(['example.com__Packages'], self.kept_lists())
+
+
+class DebStoreTests(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(DebStoreTests, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        self.store = DebStore(os.path.join(self.tempdir, 'store'))
+
+    def make_file(self, name, contents):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_link_into_missing(self):
+        dest = os.path.join(self.tempdir, 'foo.deb')
+        self.assertFalse(self.store.link_into('md5', 'abcd', 3, dest))
+        self.assertFalse(os.path.exists(dest))
+
+    def test_add_and_link_into(self):
+        self.store.add('md5', 'abcd', self.make_file('foo.deb', 'foo'))
+        dest = os.path.join(self.tempdir, 'copy.deb')
+        self.assertTrue(self.store.link_into('md5', 'abcd', 3, dest))
+        self.assertEqual('foo', open(dest).read())
+
+    def test_link_into_across_filesystems(self):
+        def link(src, dst):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        self.store.add('md5', 'abcd', self.make_file('foo.deb', 'foo'))
+        self.useFixture(MockSomethingFixture(os, 'link', link))
+        dest = os.path.join(self.tempdir, 'copy.deb')
+        self.assertTrue(self.store.link_into('md5', 'abcd', 3, dest))
+        self.assertEqual('foo', open(dest).read())
+        self.assertFalse(
+            os.path.samefile(self.store._path('md5', 'abcd'), dest))
+
+    def test_link_into_without_cp(self):
+        def fail(*args, **kwargs):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+
+        self.store.add('md5', 'abcd', self.make_file('foo.deb', 'foo'))
+        self.useFixture(MockSomethingFixture(os, 'link', fail))
+        self.useFixture(MockSomethingFixture(packages.cmd_runner, 'run', fail))
+        dest = os.path.join(self.tempdir, 'copy.deb')
+        self.assertTrue(self.store.link_into('md5', 'abcd', 3, dest))
+        self.assertEqual('foo', open(dest).read())
+
+    def test_link_into_checks_size(self):
+        self.store.add('md5', 'abcd', self.make_file('foo.deb', 'foo'))
+        dest = os.path.join(self.tempdir, 'copy.deb')
+        self.assertFalse(self.store.link_into('md5', 'abcd', 4, dest))
+
+    def test_link_into_separates_hash_types(self):
+        self.store.add('md5', 'abcd', self.make_file('foo.deb', 'foo'))
+        dest = os.path.join(self.tempdir, 'copy.deb')
+        self.assertFalse(self.store.link_into('sha256', 'abcd', 3, dest))
+
+    def test_prune_drops_least_recently_used(self):
+        self.store.max_size = 6
+        for digest in ('aa', 'bb', 'cc'):
+            self.store.add(
+                'md5', digest, self.make_file(digest + '.deb', 'foo'))
+        os.utime(self.store._path('md5', 'aa'), (0, 0))
+        os.utime(self.store._path('md5', 'bb'), (1, 1))
+        self.store.link_into(
+            'md5', 'aa', 3, os.path.join(self.tempdir, 'copy.deb'))
+        self.store.prune()
+        self.assertTrue(os.path.exists(self.store._path('md5', 'aa')))
+        self.assertFalse(os.path.exists(self.store._path('md5', 'bb')))
+        self.assertTrue(os.path.exists(self.store._path('md5', 'cc')))
+
+    def test_prune_without_max_size(self):
+        self.store.add('md5', 'aa', self.make_file('aa.deb', 'foo'))
+        self.store.prune()
+        self.assertTrue(os.path.exists(self.store._path('md5', 'aa')))
+
+
 class PackageFetcherTests(TestCaseWithFixtures):
 
     def test_context_manager(self):
@@ -957,10 +1158,11 @@ class PackageFetcherTests(TestCaseWithFixtures):
             self.assertTrue(os.path.isdir(tempdir))
         self.assertFalse(os.path.exists(tempdir))
 
-    def get_fetcher(self, sources, architecture=None, prefer_label=None):
+    def get_fetcher(self, sources, architecture=None, prefer_label=None,
+                    deb_cache_dir=None):
         fetcher = PackageFetcher(
             [s.sources_entry for s in sources], architecture=architecture,
-            prefer_label=prefer_label)
+            prefer_label=prefer_label, deb_cache_dir=deb_cache_dir)
         self.addCleanup(fetcher.cleanup)
         fetcher.prepare()
         return fetcher
@@ -1001,6 +1203,18 @@ class PackageFetcherTests(TestCaseWithFixtures):
         self.assertEqual(
             available_package, fetcher.fetch_packages(["foo"])[0])
 
+    def test_fetch_packages_uses_deb_cache(self):
+        available_package = DummyFetchedPackage("foo", "1.0")
+        source = self.useFixture(AptSourceFixture([available_package]))
+        deb_cache_dir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        fetcher = self.get_fetcher([source], deb_cache_dir=deb_cache_dir)
+        fetcher.fetch_packages(["foo"])
+        # Drop the package from the source: it can only come from the cache.
+        os.unlink(os.path.join(source.rootdir, available_package.filename))
+        fetcher = self.get_fetcher([source], deb_cache_dir=deb_cache_dir)
+        self.assertEqual(
+            available_package, fetcher.fetch_packages(["foo"])[0])
+
     def test_fetch_packages_fetches_preferred_label(self):
         lower_package = DummyFetchedPackage("foo", "1.0")
         higher_package = DummyFetchedPackage("foo", "2.0")
@@ -25,6 +25,12 @@ from linaro_image_tools import cmd_runner
 from linaro_image_tools.media_create.boards import board_configs
 from linaro_image_tools.media_create.android_boards import (
     android_board_configs)
+from linaro_image_tools.media_create.compress import COMPRESS_FORMATS
+from linaro_image_tools.media_create.rootfs_cache import (
+    STORAGE_DIR,
+    STORAGE_MODES,
+    default_cache_dir,
+)
 from linaro_image_tools.__version__ import __version__
 from linaro_image_tools.hwpack.hwpack_fields import (
     DEFAULT_BOOTLOADER
@@ -78,6 +84,21 @@ def add_common_options(parser):
     parser.add_argument(
         '--extra-boot-args-file', dest='extra_boot_args_file',
         required=False, help=('File containing extra boot arguments.'))
+    parser.add_argument(
+        '--timings', dest='timings', metavar='FILE', required=False,
+        help=('Write the time and resources used by each phase to FILE, as '
+              'JSON, and log them as a table at exit.'))
+    parser.add_argument(
+        '--trace-commands', dest='trace_commands', metavar='FILE',
+        required=False,
+        help=('Write every command run, with its timing and resource use, '
+              'to FILE as a Chrome trace, and log a summary per command at '
+              'exit.'))
+    parser.add_argument(
+        '--root-helper', dest='root_helper', action='store_true',
+        help=('Start a single helper process as root for copying, moving, '
+              'writing and removing files that need root, instead of '
+              'running sudo for each of them.'))
     parser.add_argument("--debug", action="store_true")
 
 
@@ -92,6 +113,14 @@ def get_args_parser():
         '--image-file', '--image_file', dest='device', default="sd.img",
         help='File where we should write an image file (defaults to sd.img '
              'if neither --image-file or --mmc are specified.)')
+    group.add_argument(
+        '--batch', dest='batch', metavar='FILE',
+        help=('Create several images from the same binary tarball. FILE has '
+              'one target per line, made of the board, the image file to '
+              'write and the hardware packs to install, separated by '
+              'whitespace. Replaces, and can\'t be used with, --mmc, '
+              '--image-file, --dev and --hwpack; the targets are created at '
+              'the same time up to the limit set with --jobs.'))
     parser.add_argument(
         '--output-directory', dest='directory',
         help='Directory where image and accessories should be written to.')
@@ -129,7 +158,7 @@ def get_args_parser():
         help=('Add a console to kernel boot parameter; this parameter can be '
               'defined multiple times.'))
     parser.add_argument(
-        '--hwpack', action='append', dest='hwpacks', required=True,
+        '--hwpack', action='append', dest='hwpacks', default=[],
         help=('A hardware pack that should be installed in the rootfs; this '
               'parameter can be defined multiple times.'))
     parser.add_argument(
@@ -151,6 +180,60 @@ def get_args_parser():
     parser.add_argument(
         '--binary-sig', dest='binarysig', required=False,
         help=('Signature file used for verifying the binary tarball.'))
+    parser.add_argument(
+        '--no-binary-index', dest='save_binary_index', action='store_false',
+        help=('Do not save the index of the binary tarball next to it for '
+              'reuse by later runs.'))
+    parser.add_argument(
+        '--direct-rootfs', dest='direct_rootfs', action='store_true',
+        help=('Unpack the rootfs straight onto the mounted root partition '
+              'instead of staging it in a temporary directory first. Saves '
+              'writing the whole rootfs twice.'))
+    parser.add_argument(
+        '--rootfs-cache', dest='rootfs_cache', metavar='DIR', nargs='?',
+        const=default_cache_dir(),
+        help=('Reuse the rootfs, with the hwpacks installed, from an earlier '
+              'run with the same binary tarball and hwpacks, and store it '
+              'there for later runs otherwise. Defaults to %s.' %
+              default_cache_dir()))
+    parser.add_argument(
+        '--rootfs-cache-size', dest='rootfs_cache_size', default='20G',
+        help=('The maximum size of the rootfs cache, specified in mega/giga '
+              'bytes (e.g. 3000M or 3G). The least recently used entries are '
+              'evicted when it grows bigger than that.'))
+    parser.add_argument(
+        '--rootfs-cache-storage', dest='rootfs_cache_storage',
+        default=STORAGE_DIR, choices=STORAGE_MODES,
+        help=('How to store the rootfs in the cache: as a tarball, as a '
+              'directory, or as a reflink copy (which needs the cache and '
+              'the temporary directory to be on the same btrfs or XFS '
+              'filesystem). Defaults to %s.' % STORAGE_DIR))
+    parser.add_argument(
+        '--offline-fs', dest='offline_fs', action='store_true',
+        help=('Build the boot and root filesystems of an image file as '
+              'standalone files, populated from staging directories, and '
+              'copy them into the image, instead of formatting and mounting '
+              'loop devices. Needs mtools and a mkfs.ext* that supports -d. '
+              'Only for --image-file.'))
+    parser.add_argument(
+        '--bmap', dest='bmap', action='store_true',
+        help=('Make the image file sparse and write a block map of the '
+              'blocks it uses next to it (as IMAGE_FILE.bmap), for use with '
+              'flashing tools such as bmaptool. Only for --image-file.'))
+    parser.add_argument(
+        '--compress', dest='compress', choices=COMPRESS_FORMATS,
+        help=('Also write the finished image file compressed, as '
+              'IMAGE_FILE.gz or IMAGE_FILE.xz, using all the available '
+              'cores. Only for --image-file.'))
+    parser.add_argument(
+        '--compress-checksum', dest='compress_checksum', action='store_true',
+        help=('Write the sha256 of the compressed image file next to it, '
+              'computed while compressing.'))
+    parser.add_argument(
+        '--jobs', '-j', dest='jobs', type=int, default=1,
+        help=('The number of independent steps (e.g. unpacking the binary '
+              'tarball and partitioning the media) to run at the same time. '
+              'Defaults to 1.'))
     parser.add_argument(
         '--no-rootfs', dest='should_format_rootfs', action='store_false',
         help='Do not deploy the root filesystem.')
@@ -214,6 +297,12 @@ def get_android_args_parser():
     parser.add_argument(
         '--boot', default='boot.tar.bz2', required=True,
         help=('The tarball containing the Android root partition'))
+    parser.add_argument(
+        '--sig', action='append', dest='sigs', default=[],
+        help=('Signature file of a hash file listing the boot, system and '
+              'userdata tarballs, which are then checked against it while '
+              'being unpacked; this parameter can be defined multiple '
+              'times.'))
     parser.add_argument(
         '--no-part', dest='should_create_partitions', action='store_false',
         help='Reuse existing partitions on the given media.')
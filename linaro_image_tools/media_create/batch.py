@@ -0,0 +1,98 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Targets for creating several images from one binary tarball.
+
+A batch file has one target per line, made of the board, the image file to
+write and the hwpacks to install, separated by whitespace:
+
+    # board     image file      hwpacks
+    panda       panda.img       hwpack_panda.tar.gz
+    origen      origen.img      hwpack_origen.tar.gz hwpack_extra.tar.gz
+
+Blank lines and lines starting with '#' are ignored.
+"""
+
+from collections import (
+    namedtuple,
+    OrderedDict,
+)
+
+
+BatchTarget = namedtuple('BatchTarget', ['dev', 'image_file', 'hwpacks'])
+
+
+class InvalidBatchFile(Exception):
+    """The batch file is not valid."""
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def parse_batch_file(lines, known_boards):
+    """Parse the lines of a batch file into a list of BatchTargets.
+
+    :param lines: An iterable with the lines of the batch file.
+    :param known_boards: The names of the boards that can be targeted.
+    :raises InvalidBatchFile: if a line is not a valid target, or more than
+        one target writes to the same image file.
+    """
+    targets = []
+    image_files = set()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        fields = line.split()
+        if len(fields) < 3:
+            raise InvalidBatchFile(
+                "Line %d: expected a board, an image file and at least one "
+                "hwpack" % number)
+        dev, image_file, hwpacks = fields[0], fields[1], tuple(fields[2:])
+        if dev not in known_boards:
+            raise InvalidBatchFile(
+                "Line %d: unknown board '%s'" % (number, dev))
+        if image_file in image_files:
+            raise InvalidBatchFile(
+                "Line %d: image file '%s' is already used by another "
+                "target" % (number, image_file))
+        image_files.add(image_file)
+        targets.append(BatchTarget(dev, image_file, hwpacks))
+    if not targets:
+        raise InvalidBatchFile("No targets found")
+    return targets
+
+
+def read_batch_file(path, known_boards):
+    """Read the batch file at the given path; see parse_batch_file()."""
+    with open(path) as fd:
+        return parse_batch_file(fd, known_boards)
+
+
+def group_targets_by_hwpacks(targets):
+    """Group the targets that install the same hwpacks, in the same order.
+
+    Each group needs the hwpacks installed only once.  Return an OrderedDict
+    mapping each tuple of hwpacks to the list of its targets, in the order
+    they were first seen.
+    """
+    groups = OrderedDict()
+    for target in targets:
+        groups.setdefault(tuple(target.hwpacks), []).append(target)
+    return groups
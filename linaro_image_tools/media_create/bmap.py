@@ -0,0 +1,174 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keep image files sparse and describe the blocks they use in a bmap file.
+
+A bmap (block map) file lists the ranges of blocks of an image that hold
+data, together with their checksums, so that flashing tools such as
+bmaptool only need to write those instead of the whole image.  The format
+written here is version 2.0 of the one used by bmap-tools.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+
+from linaro_image_tools import cmd_runner
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+BMAP_VERSION = '2.0'
+DEFAULT_BLOCK_SIZE = 4096
+BMAP_SUFFIX = '.bmap'
+
+# Not available in the os module before Python 3.3.
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
+READ_CHUNK_SIZE = 1024 * 1024
+# The checksum of the bmap file itself is calculated with this in its place.
+ZERO_CHECKSUM = '0' * 64
+
+
+def make_sparse(image_file):
+    """Turn the blocks of image_file that contain only zeros into holes.
+
+    Later stages (mkfs, copying boot files around, etc) may write zeros to
+    regions of the image that were holes when it was created, and this
+    makes them holes again.
+    """
+    cmd_runner.run(['fallocate', '--dig-holes', image_file]).wait()
+
+
+def get_data_extents(fd, size):
+    """Return a list of the (start, end) byte ranges of fd that hold data.
+
+    If the filesystem doesn't support SEEK_DATA/SEEK_HOLE the whole file is
+    assumed to hold data.
+    """
+    extents = []
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, SEEK_DATA)
+        except OSError, e:
+            if e.errno == errno.ENXIO:
+                # No data after offset.
+                break
+            if e.errno == errno.EINVAL and offset == 0:
+                return [(0, size)]
+            raise
+        end = os.lseek(fd, start, SEEK_HOLE)
+        extents.append((start, min(end, size)))
+        offset = end
+    return extents
+
+
+def get_mapped_ranges(image_file, block_size=DEFAULT_BLOCK_SIZE):
+    """Return the (first, last) block ranges of image_file that hold data.
+
+    Both ends of a range are inclusive, and ranges that touch are merged.
+    """
+    size = os.path.getsize(image_file)
+    fd = os.open(image_file, os.O_RDONLY)
+    try:
+        extents = get_data_extents(fd, size)
+    finally:
+        os.close(fd)
+    ranges = []
+    for start, end in extents:
+        first = start // block_size
+        last = (end - 1) // block_size
+        if ranges and first <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(last, ranges[-1][1]))
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+def _range_checksum(fd, first, last, block_size):
+    checksum = hashlib.sha256()
+    fd.seek(first * block_size)
+    left = (last - first + 1) * block_size
+    while left > 0:
+        data = fd.read(min(left, READ_CHUNK_SIZE))
+        if not data:
+            # The last block of the image may be a partial one.
+            break
+        checksum.update(data)
+        left -= len(data)
+    return checksum.hexdigest()
+
+
+def generate_bmap(image_file, block_size=DEFAULT_BLOCK_SIZE):
+    """Return the contents of the bmap file for the given image file."""
+    image_size = os.path.getsize(image_file)
+    blocks_count = (image_size + block_size - 1) // block_size
+    ranges = get_mapped_ranges(image_file, block_size)
+    mapped_blocks = sum(last - first + 1 for first, last in ranges)
+
+    range_lines = []
+    with open(image_file, 'rb') as fd:
+        for first, last in ranges:
+            if first == last:
+                blocks = '%d' % first
+            else:
+                blocks = '%d-%d' % (first, last)
+            range_lines.append(
+                '        <Range chksum="%s"> %s </Range>' % (
+                    _range_checksum(fd, first, last, block_size), blocks))
+
+    lines = [
+        '<?xml version="1.0" ?>',
+        '<bmap version="%s">' % BMAP_VERSION,
+        '    <ImageSize> %d </ImageSize>' % image_size,
+        '    <BlockSize> %d </BlockSize>' % block_size,
+        '    <BlocksCount> %d </BlocksCount>' % blocks_count,
+        '    <MappedBlocksCount> %d </MappedBlocksCount>' % mapped_blocks,
+        '    <ChecksumType> sha256 </ChecksumType>',
+        '    <BmapFileChecksum> %s </BmapFileChecksum>' % ZERO_CHECKSUM,
+        '    <BlockMap>',
+    ]
+    lines.extend(range_lines)
+    lines.extend([
+        '    </BlockMap>',
+        '</bmap>',
+        '',
+    ])
+    bmap = '\n'.join(lines)
+    # The checksum of the bmap file is that of its contents with the
+    # checksum itself replaced by zeros.
+    checksum = hashlib.sha256(bmap).hexdigest()
+    return bmap.replace(ZERO_CHECKSUM, checksum, 1)
+
+
+def write_bmap(image_file, bmap_file=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Make image_file sparse and write its bmap file.
+
+    :param bmap_file: Where to write the bmap; defaults to the image file's
+        path plus BMAP_SUFFIX.
+    :return: The path of the bmap file.
+    """
+    if bmap_file is None:
+        bmap_file = image_file + BMAP_SUFFIX
+    make_sparse(image_file)
+    logger.info("Writing block map of %s to %s" % (image_file, bmap_file))
+    with open(bmap_file, 'w') as fd:
+        fd.write(generate_bmap(image_file, block_size))
+    return bmap_file
@@ -35,12 +35,12 @@ import string
 import struct
 import tempfile
 
-from linaro_image_tools import cmd_runner
+from linaro_image_tools import cmd_runner, root_helper
 
 from linaro_image_tools.hwpack.handler import HardwarepackHandler
 from linaro_image_tools.media_create.partitions import (
     SECTOR_SIZE,
-    partition_mounted,
+    partition_mounted_or_staged,
     register_loopback,
 )
 
@@ -765,7 +765,9 @@ class BoardConfig(object):
             parts_dir = 'casper'
         bootloader_parts_dir = os.path.join(chroot_dir, parts_dir)
         cmd_runner.run(['mkdir', '-p', boot_disk]).wait()
-        with partition_mounted(boot_partition, boot_disk):
+        # boot_partition is None when the boot filesystem is built offline,
+        # from the files we put in boot_disk.
+        with partition_mounted_or_staged(boot_partition, boot_disk):
             with self.hardwarepack_handler:
                 if self.bootloader_file_in_boot_part:
                     # <legacy v1 support>
@@ -785,9 +787,7 @@ class BoardConfig(object):
                     assert bootloader_bin is not None, (
                         "bootloader binary could not be found")
 
-                    proc = cmd_runner.run(
-                        ['cp', '-v', bootloader_bin, boot_disk], as_root=True)
-                    proc.wait()
+                    root_helper.copy(bootloader_bin, boot_disk, verbose=True)
 
                 # Handle copy_files field.
                 self.copy_files(boot_disk)
@@ -823,12 +823,10 @@ class BoardConfig(object):
                     dirname = os.path.dirname(dest_path)
                     dirname = os.path.join(boot_disk, dirname)
                     if not os.path.exists(dirname):
-                        cmd_runner.run(["mkdir", "-p", dirname],
-                                       as_root=True).wait()
-                    proc = cmd_runner.run(
-                        ['cp', '-v', source,
-                         os.path.join(boot_disk, dest_path)], as_root=True)
-                    proc.wait()
+                        root_helper.mkdir(dirname)
+                    root_helper.copy(
+                        source, os.path.join(boot_disk, dest_path),
+                        verbose=True)
 
     def _get_kflavor_files(self, path):
         """Search for kernel, initrd and optional dtb in path."""
@@ -1896,6 +1894,14 @@ def get_board_config(board):
 def _dd(input_file, output_file, block_size=SECTOR_SIZE, count=None, seek=None,
         skip=None):
     """Wrapper around the dd command"""
+    if root_helper.get_helper() is not None:
+        length = None
+        if count is not None:
+            length = int(count) * int(block_size)
+        root_helper.pwrite(
+            output_file, int(seek or 0) * int(block_size), input_file,
+            source_offset=int(skip or 0) * int(block_size), length=length)
+        return
     cmd = [
         "dd", "if=%s" % input_file, "of=%s" % output_file,
         "bs=%s" % block_size, "conv=notrunc"]
@@ -20,7 +20,7 @@
 import os
 import sys
 
-from linaro_image_tools import cmd_runner
+from linaro_image_tools import cmd_runner, root_helper
 from linaro_image_tools.utils import (
     is_arm_host,
     find_command,
@@ -171,16 +171,17 @@ def mount_chroot_proc(chroot_dir):
 def copy_file(filepath, directory):
     """Copy the given file to the given directory.
 
-    The copying of the file is done in a subprocess and run using sudo.
+    The copying of the file is done as root, by the root helper or in a
+    subprocess run using sudo.
 
     We also register a function in local_atexit to remove the file from the
     given directory.
     """
-    cmd_runner.run(['cp', filepath, directory], as_root=True).wait()
+    root_helper.copy(filepath, directory)
 
     def undo():
         new_path = os.path.join(directory, os.path.basename(filepath))
-        cmd_runner.run(['rm', '-f', new_path], as_root=True).wait()
+        root_helper.unlink(new_path)
     local_atexit.append(undo)
 
 
@@ -196,18 +197,15 @@ def temporarily_overwrite_file_on_dir(filepath, directory, tmp_dir):
     # Move the existing file from the given directory to the temp dir.
     oldpath = os.path.join(directory, basename)
     if os.path.exists(oldpath):
-        cmd_runner.run(
-            ['mv', '-f', oldpath, path_to_orig], as_root=True).wait()
+        root_helper.rename(oldpath, path_to_orig)
     # Now copy the given file onto the given directory.
-    cmd_runner.run(['cp', filepath, directory], as_root=True).wait()
+    root_helper.copy(filepath, directory)
 
     def undo():
         if os.path.exists(path_to_orig):
-            cmd_runner.run(
-                ['mv', '-f', path_to_orig, directory], as_root=True).wait()
+            root_helper.rename(path_to_orig, directory)
         else:
-            cmd_runner.run(
-                ['rm', '-f', oldpath], as_root=True).wait()
+            root_helper.unlink(oldpath)
     local_atexit.append(undo)
 
 
@@ -0,0 +1,163 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compress finished image files using all the available cores.
+
+gzip output is made of independently compressed blocks, each one a complete
+gzip member; members are compressed in parallel by a pool of processes and
+written out in order.  A file made of concatenated gzip members is a valid
+gzip file, so gunzip, zcat and bmaptool read it as usual.  xz output is
+produced by xz itself, whose multi-threaded mode splits its input into
+independent blocks in the same way.
+
+The sha256 of the compressed file can be computed while it is written, so
+no second pass over it is needed.
+"""
+
+from collections import deque
+import hashlib
+import logging
+import multiprocessing
+import os
+import subprocess
+import zlib
+
+from linaro_image_tools import cmd_runner
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+COMPRESS_GZIP = 'gz'
+COMPRESS_XZ = 'xz'
+COMPRESS_FORMATS = (COMPRESS_GZIP, COMPRESS_XZ)
+
+BLOCK_SIZE = 8 * 1024 * 1024
+GZIP_LEVEL = 6
+# Adding 16 to the window bits makes zlib write a gzip header and trailer.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+CHECKSUM_SUFFIX = '.sha256'
+
+
+def compress_gzip_block(data, level=GZIP_LEVEL):
+    """Return data compressed as a complete gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _read_blocks(fd, block_size):
+    while True:
+        data = fd.read(block_size)
+        if not data:
+            break
+        yield data
+
+
+class _HashingWriter(object):
+    """Write to a file, feeding what is written to a hasher if there's one."""
+
+    def __init__(self, fd, hasher=None):
+        self.fd = fd
+        self.hasher = hasher
+
+    def write(self, data):
+        self.fd.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+
+
+def compress_gzip(image_file, output_file, workers=None, hasher=None,
+                  block_size=BLOCK_SIZE):
+    """Compress image_file into output_file as a multi-member gzip file.
+
+    :param workers: The number of processes compressing blocks; defaults to
+        the number of CPUs.  With a single worker no processes are started.
+    :param hasher: If given, it is fed the compressed data.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    with open(image_file, 'rb') as in_fd:
+        with open(output_file, 'wb') as out_fd:
+            writer = _HashingWriter(out_fd, hasher)
+            blocks = _read_blocks(in_fd, block_size)
+            if workers == 1:
+                for data in blocks:
+                    writer.write(compress_gzip_block(data))
+                return
+            pool = multiprocessing.Pool(workers)
+            try:
+                # Pool.imap() would read the whole image ahead, so keep a
+                # bounded number of blocks in flight instead.
+                pending = deque()
+                for data in blocks:
+                    pending.append(
+                        pool.apply_async(compress_gzip_block, (data,)))
+                    if len(pending) >= 2 * workers:
+                        writer.write(pending.popleft().get())
+                while pending:
+                    writer.write(pending.popleft().get())
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+
+def compress_xz(image_file, output_file, workers=None, hasher=None):
+    """Compress image_file into output_file with a multi-threaded xz.
+
+    :param workers: The number of xz threads; defaults to the number of
+        CPUs.
+    :param hasher: If given, it is fed the compressed data.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    with open(output_file, 'wb') as out_fd:
+        writer = _HashingWriter(out_fd, hasher)
+        proc = cmd_runner.run(
+            ['xz', '-T%d' % workers, '-c', image_file],
+            stdout=subprocess.PIPE)
+        for data in _read_blocks(proc.stdout, BLOCK_SIZE):
+            writer.write(data)
+        proc.wait()
+
+
+def compress_image(image_file, compression, checksum=False, workers=None):
+    """Compress the image file next to it, as IMAGE_FILE.gz or .xz.
+
+    :param compression: One of COMPRESS_FORMATS.
+    :param checksum: Whether to also write the sha256 of the compressed
+        file, as IMAGE_FILE.gz.sha256 (or .xz.sha256).
+    :return: The path of the compressed file.
+    """
+    if compression not in COMPRESS_FORMATS:
+        raise ValueError("Unknown compression format: %s" % compression)
+    output_file = '%s.%s' % (image_file, compression)
+    hasher = None
+    if checksum:
+        hasher = hashlib.sha256()
+    logger.info("Compressing %s to %s" % (image_file, output_file))
+    if compression == COMPRESS_GZIP:
+        compress_gzip(image_file, output_file, workers, hasher)
+    else:
+        compress_xz(image_file, output_file, workers, hasher)
+    if hasher is not None:
+        # In the format read by sha256sum -c.
+        with open(output_file + CHECKSUM_SUFFIX, 'w') as fd:
+            fd.write('%s  %s\n' % (
+                hasher.hexdigest(), os.path.basename(output_file)))
+    return output_file
@@ -0,0 +1,128 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Build the filesystems of an image file offline.
+
+Instead of formatting loop devices over the partitions of the image file and
+mounting them to copy files in, the boot and root filesystems are built as
+standalone files, populated straight from a staging directory (with mtools
+for FAT and mkfs's populate-from-directory modes for the rest), and then
+copied into the image at the offsets of their partitions.  Neither loop
+devices nor mounts are needed, so several images can be built at the same
+time.
+"""
+
+from collections import namedtuple
+import os
+
+from linaro_image_tools import cmd_runner
+from linaro_image_tools.media_create.partitions import (
+    CYLINDER_SIZE,
+    HEADS,
+    SECTORS,
+    calculate_partition_size_and_offset,
+    get_partition_size_in_bytes,
+    run_sfdisk_commands,
+)
+
+
+# Offsets and sizes are in bytes.
+PartitionLayout = namedtuple(
+    'PartitionLayout', ['boot_offset', 'boot_size', 'root_offset',
+                        'root_size'])
+
+
+def setup_image_partitions(board_config, image_file, image_size,
+                           should_align_boot_part=False):
+    """Create image_file and its partition table, without root rights.
+
+    :return: The PartitionLayout of the image.
+    """
+    image_size_in_bytes = get_partition_size_in_bytes(image_size)
+    cylinders = image_size_in_bytes / CYLINDER_SIZE
+    # The filesystems are spliced in sparsely, so anything left over from an
+    # earlier image would show through their zeroed blocks.
+    if os.path.exists(image_file):
+        os.remove(image_file)
+    proc = cmd_runner.run(
+        ['dd', 'of=%s' % image_file,
+         'bs=1', 'seek=%s' % image_size_in_bytes, 'count=0'],
+        stderr=open('/dev/null', 'w'))
+    proc.wait()
+
+    sfdisk_cmd = board_config.get_sfdisk_cmd(
+        should_align_boot_part=should_align_boot_part)
+    run_sfdisk_commands(
+        sfdisk_cmd, HEADS, SECTORS, cylinders, image_file, as_root=False)
+
+    boot_size, boot_offset, root_size, root_offset = (
+        calculate_partition_size_and_offset(image_file))
+    return PartitionLayout(boot_offset, boot_size, root_offset, root_size)
+
+
+def make_vfat_filesystem(fs_file, size, fat_size, label, source_dir):
+    """Create a FAT filesystem of the given size in fs_file.
+
+    Its contents are copied from source_dir with mtools.
+    """
+    if os.path.exists(fs_file):
+        os.remove(fs_file)
+    # mkfs.vfat takes the size in 1K blocks.
+    cmd_runner.run(
+        ['mkfs.vfat', '-C', '-F', str(fat_size), '-n', label, fs_file,
+         str(size / 1024)]).wait()
+    names = sorted(os.listdir(source_dir))
+    if names:
+        # The files may only be readable by root, as they were put there
+        # by the board config.
+        cmd_runner.run(
+            ['mcopy', '-s', '-p', '-m', '-i', fs_file] +
+            [os.path.join(source_dir, name) for name in names] + ['::'],
+            as_root=True).wait()
+
+
+def make_rootfs_filesystem(fs_file, size, rootfs_type, label, uuid,
+                           source_dir):
+    """Create a filesystem of the given type and size in fs_file.
+
+    Its contents, ownership and permissions are copied from source_dir.
+    That is done as root because the rootfs has files only root can read.
+    """
+    with open(fs_file, 'wb') as fd:
+        fd.truncate(size)
+    if rootfs_type == 'btrfs':
+        args = ['mkfs.btrfs', '-f', '-r', source_dir, '-U', uuid, '-L', label,
+                '-b', str(size), fs_file]
+    elif rootfs_type in ('ext2', 'ext3', 'ext4'):
+        args = ['mkfs.%s' % rootfs_type, '-F', '-d', source_dir, '-U', uuid,
+                '-L', label, fs_file, '%dk' % (size / 1024)]
+    else:
+        raise ValueError('Unsupported rootfs type %s' % rootfs_type)
+    cmd_runner.run(args, as_root=True).wait()
+
+
+def splice_filesystem(fs_file, image_file, offset):
+    """Copy fs_file into image_file, starting at the given byte offset.
+
+    Blocks of zeros are skipped rather than written, so the image stays
+    sparse; image_file must therefore be zeroed where fs_file goes, as it is
+    when created by setup_image_partitions().
+    """
+    cmd_runner.run(
+        ['dd', 'if=%s' % fs_file, 'of=%s' % image_file, 'bs=1M',
+         'seek=%d' % offset, 'oflag=seek_bytes', 'conv=notrunc,sparse'],
+        stderr=open('/dev/null', 'w')).wait()
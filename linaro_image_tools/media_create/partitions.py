@@ -87,26 +87,24 @@ def setup_android_partitions(board_config, media, image_size, bootfs_label,
         data = partitions[3]
         sdcard = partitions[4]
 
-    print "\nFormating boot partition\n"
-    proc = cmd_runner.run(
-        ['mkfs.vfat', '-F', str(board_config.fat_size), bootfs, '-n',
-         bootfs_label],
-        as_root=True)
-    proc.wait()
-
+    print "\nFormating boot, system, cache, userdata and sdcard partitions\n"
+    commands = [
+        cmd_runner.Command(
+            ['mkfs.vfat', '-F', str(board_config.fat_size), bootfs, '-n',
+             bootfs_label],
+            as_root=True)]
     ext4_partitions = {"system": system, "cache": cache, "userdata": data}
     for label, dev in ext4_partitions.iteritems():
         mkfs = 'mkfs.%s' % "ext4"
-        proc = cmd_runner.run(
+        commands.append(cmd_runner.Command(
             [mkfs, dev, '-L', label],
-            as_root=True)
-        proc.wait()
-
-    proc = cmd_runner.run(
+            as_root=True))
+    commands.append(cmd_runner.Command(
         ['mkfs.vfat', '-F32', sdcard, '-n',
          "sdcard"],
-        as_root=True)
-    proc.wait()
+        as_root=True))
+    # The partitions are independent, so format them all at once.
+    cmd_runner.run_many(commands)
 
     return bootfs, system, cache, data, sdcard
 
@@ -162,26 +160,28 @@ def setup_partitions(board_config, media, image_size, bootfs_label,
     else:
         bootfs, rootfs = get_boot_and_root_loopback_devices(media.path)
 
+    # The boot and root partitions are independent, so format them at the
+    # same time.
+    commands = []
     if should_format_bootfs:
         print "\nFormating boot partition\n"
         mkfs = 'mkfs.%s' % board_config.bootfs_type
         if board_config.bootfs_type == 'vfat':
-            proc = cmd_runner.run(
+            commands.append(cmd_runner.Command(
                 [mkfs, '-F', str(board_config.fat_size), bootfs, '-n',
                  bootfs_label],
-                as_root=True)
+                as_root=True))
         else:
-            proc = cmd_runner.run(
-                [mkfs, bootfs, '-L', bootfs_label], as_root=True)
-        proc.wait()
+            commands.append(cmd_runner.Command(
+                [mkfs, bootfs, '-L', bootfs_label], as_root=True))
 
     if should_format_rootfs:
         print "\nFormating root partition\n"
         mkfs = 'mkfs.%s' % rootfs_type
-        proc = cmd_runner.run(
+        commands.append(cmd_runner.Command(
             [mkfs, rootfs, '-L', rootfs_label],
-            as_root=True)
-        proc.wait()
+            as_root=True))
+    cmd_runner.run_many(commands)
 
     return bootfs, rootfs
 
@@ -218,6 +218,20 @@ def partition_mounted(device, path, *args):
             logger.warn(e)
 
 
+@contextmanager
+def partition_mounted_or_staged(device, path, *args):
+    """Like partition_mounted(), but does nothing if device is None.
+
+    That is the case when the filesystem is built offline from the contents
+    of path, which is then just a staging directory.
+    """
+    if device is None:
+        yield
+    else:
+        with partition_mounted(device, path, *args):
+            yield
+
+
 def get_uuid(partition):
     """Find UUID of the given partition."""
     proc = cmd_runner.run(
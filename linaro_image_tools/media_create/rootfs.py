@@ -19,9 +19,8 @@
 
 import os
 import subprocess
-import tempfile
 
-from linaro_image_tools import cmd_runner
+from linaro_image_tools import cmd_runner, root_helper
 
 from linaro_image_tools.media_create.partitions import partition_mounted
 
@@ -43,14 +42,16 @@ def rootfs_mount_options(rootfs_type):
 
 def populate_rootfs(content_dir, root_disk, partition, rootfs_type,
                     rootfs_id, should_create_swap, swap_size,
-                    mmc_device_id, partition_offset, board_config=None):
+                    mmc_device_id, partition_offset, board_config=None,
+                    copy=False):
     """Populate the rootfs and make the necessary tweaks to make it usable.
 
     This consists of:
       1. Create a directory on the path specified by root_disk
       2. Mount the given partition onto the created directory.
       3. Setup an atexit handler to unmount the partition mounted above.
-      4. Move the contents of content_dir to that directory.
+      4. Move (or copy, if copy is True) the contents of content_dir to that
+         directory.
       5. If should_create_swap, then create it with the given size.
       6. Add fstab entries for the / filesystem and swap (if created).
       7. Create a /etc/flash-kernel.conf containing the target's boot device.
@@ -61,38 +62,53 @@ def populate_rootfs(content_dir, root_disk, partition, rootfs_type,
     os.makedirs(root_disk)
 
     with partition_mounted(partition, root_disk):
-        move_contents(content_dir, root_disk)
-
-        mount_options = rootfs_mount_options(rootfs_type)
-        fstab_additions = ["%s / %s  %s 0 1" % (
-            rootfs_id, rootfs_type, mount_options)]
-        if should_create_swap:
-            print "\nCreating SWAP File\n"
-            if has_space_left_for_swap(root_disk, swap_size):
-                proc = cmd_runner.run([
-                    'dd',
-                    'if=/dev/zero',
-                    'of=%s/SWAP.swap' % root_disk,
-                    'bs=1M',
-                    'count=%s' % swap_size], as_root=True)
-                proc.wait()
-                proc = cmd_runner.run(
-                    ['mkswap', '%s/SWAP.swap' % root_disk], as_root=True)
-                proc.wait()
-                fstab_additions.append("/SWAP.swap  none  swap  sw  0 0")
-            else:
-                print ("Swap file is bigger than space left on partition; "
-                       "continuing without swap.")
-
-        append_to_fstab(root_disk, fstab_additions)
-
-        print "\nCreating /etc/flash-kernel.conf\n"
-        create_flash_kernel_config(
-            root_disk, mmc_device_id, 1 + partition_offset)
-
-        if board_config is not None:
-            print "\nUpdating /etc/network/interfaces\n"
-            update_network_interfaces(root_disk, board_config)
+        if copy:
+            copy_contents(content_dir, root_disk)
+        else:
+            move_contents(content_dir, root_disk)
+        customize_rootfs(
+            root_disk, rootfs_type, rootfs_id, should_create_swap, swap_size,
+            mmc_device_id, partition_offset, board_config)
+
+
+def customize_rootfs(root_disk, rootfs_type, rootfs_id, should_create_swap,
+                     swap_size, mmc_device_id, partition_offset,
+                     board_config=None):
+    """Make the necessary tweaks to the rootfs mounted on root_disk.
+
+    This consists of steps 5 to 7 of populate_rootfs(), and is also used when
+    the rootfs is unpacked straight onto the mounted partition.
+    """
+    mount_options = rootfs_mount_options(rootfs_type)
+    fstab_additions = ["%s / %s  %s 0 1" % (
+        rootfs_id, rootfs_type, mount_options)]
+    if should_create_swap:
+        print "\nCreating SWAP File\n"
+        if has_space_left_for_swap(root_disk, swap_size):
+            proc = cmd_runner.run([
+                'dd',
+                'if=/dev/zero',
+                'of=%s/SWAP.swap' % root_disk,
+                'bs=1M',
+                'count=%s' % swap_size], as_root=True)
+            proc.wait()
+            proc = cmd_runner.run(
+                ['mkswap', '%s/SWAP.swap' % root_disk], as_root=True)
+            proc.wait()
+            fstab_additions.append("/SWAP.swap  none  swap  sw  0 0")
+        else:
+            print ("Swap file is bigger than space left on partition; "
+                   "continuing without swap.")
+
+    append_to_fstab(root_disk, fstab_additions)
+
+    print "\nCreating /etc/flash-kernel.conf\n"
+    create_flash_kernel_config(
+        root_disk, mmc_device_id, 1 + partition_offset)
+
+    if board_config is not None:
+        print "\nUpdating /etc/network/interfaces\n"
+        update_network_interfaces(root_disk, board_config)
 
 
 def update_network_interfaces(root_disk, board_config):
@@ -155,6 +171,17 @@ def move_contents(from_, root_disk):
     cmd_runner.run(mv_cmd, as_root=True).wait()
 
 
+def copy_contents(from_, root_disk):
+    """Copy everything under from_ to the given root disk.
+
+    Uses sudo for copying, and leaves from_ untouched so that it can be used
+    to populate other root disks.
+    """
+    assert os.path.isdir(from_), "%s is not a directory" % from_
+    cmd_runner.run(
+        ['cp', '-a', os.path.join(from_, '.'), root_disk], as_root=True).wait()
+
+
 def has_space_left_for_swap(root_disk, swap_size_in_mega_bytes):
     """Is there enough space for a swap file in the given root disk?"""
     statvfs = os.statvfs(root_disk)
@@ -176,9 +203,7 @@ def write_data_to_protected_file(path, data):
 
     This is meant to be used when the given file is only writable by root, and
     we overcome that by writing the data to a tempfile and then moving the
-    tempfile on top of the given one using sudo.
+    tempfile on top of the given one using sudo, or by having the root helper
+    write it if that's running.
     """
-    _, tmpfile = tempfile.mkstemp()
-    with open(tmpfile, 'w') as fd:
-        fd.write(data)
-    cmd_runner.run(['mv', '-f', tmpfile, path], as_root=True).wait()
+    root_helper.write(path, data)
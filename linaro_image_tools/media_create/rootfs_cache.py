@@ -0,0 +1,237 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A cache of rootfs trees with the hwpacks already installed.
+
+Unpacking the binary tarball and installing the hwpacks under qemu is the
+slowest part of creating an image, and its result only depends on the
+contents of the binary tarball and the hwpacks (plus a few options).  Entries
+are keyed on a hash of all that, so a later run with the same inputs can
+restore the tree and go straight to partitioning.
+
+Each entry lives in its own directory under the cache directory, together
+with an entry.json file holding its size.  The mtime of entry.json is the
+entry's last use, and the least recently used entries are evicted when the
+cache grows bigger than its maximum size.  The trees contain files owned by
+root, so they are stored and restored as root.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+
+from linaro_image_tools import cmd_runner
+from linaro_image_tools.file_hashes import HashCache
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+# Bump whenever the way entries are keyed or stored changes.
+CACHE_FORMAT = 1
+ENTRY_FILE = 'entry.json'
+
+# How an entry is stored: as an uncompressed tarball, as a plain copy of the
+# tree or as a reflink copy (which needs a filesystem that supports it, e.g.
+# btrfs or XFS, and the cache and the target being on the same one).
+STORAGE_TAR = 'tar'
+STORAGE_DIR = 'dir'
+STORAGE_REFLINK = 'reflink'
+STORAGE_MODES = (STORAGE_TAR, STORAGE_DIR, STORAGE_REFLINK)
+
+
+def get_cache_key(binary, hwpacks, hash_cache=None, **extra):
+    """Return the key of the rootfs built from the given inputs.
+
+    :param binary: The path to the binary tarball.
+    :param hwpacks: The paths to the hwpacks, in installation order.
+    :param hash_cache: A file_hashes.HashCache to get the digests of the
+        binary tarball and the hwpacks from, so that they aren't read again
+        if they were already hashed (e.g. to verify them).
+    :param extra: Any other inputs that change the resulting rootfs (e.g.
+        whether btrfs-tools is to be installed).  Their values must be
+        JSON-serializable.
+    """
+    if hash_cache is None:
+        hash_cache = HashCache()
+    key = hashlib.sha256()
+    key.update('format %d\n' % CACHE_FORMAT)
+    for path in [binary] + list(hwpacks):
+        key.update('file %s\n' % hash_cache.get_digest(path, 'sha256'))
+    key.update('extra %s\n' % json.dumps(extra, sort_keys=True))
+    return key.hexdigest()
+
+
+class RootfsCache(object):
+
+    def __init__(self, cache_dir, max_size, storage=STORAGE_DIR):
+        """Create a RootfsCache.
+
+        :param cache_dir: The directory holding the cache entries.
+        :param max_size: The maximum size of the cache, in bytes.
+        :param storage: One of STORAGE_MODES.
+        """
+        if storage not in STORAGE_MODES:
+            raise ValueError("Unknown rootfs cache storage: %s" % storage)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.storage = storage
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read_entry(self, key):
+        """Return the metadata of the given entry, or None."""
+        entry_file = os.path.join(self._entry_dir(key), ENTRY_FILE)
+        try:
+            with open(entry_file) as fd:
+                entry = json.load(fd)
+            entry['last_used'] = os.stat(entry_file).st_mtime
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('format') != CACHE_FORMAT:
+            return None
+        return entry
+
+    def lookup(self, key):
+        """Is there a usable entry for the given key?"""
+        return self._read_entry(key) is not None
+
+    def restore(self, key, target_dir):
+        """Restore the tree stored under key into target_dir.
+
+        target_dir is created if needed; existing files in it are
+        overwritten.
+
+        :return: False, leaving target_dir alone, if there's no entry for
+            key (e.g. because another process evicted it since lookup()),
+            True otherwise.
+        """
+        entry = self._read_entry(key)
+        if entry is None:
+            return False
+        entry_dir = self._entry_dir(key)
+        # Mark the entry as recently used before restoring it, so that it is
+        # the last one to be evicted in the meantime.
+        try:
+            os.utime(os.path.join(entry_dir, ENTRY_FILE), None)
+        except OSError:
+            return False
+        logger.info("Restoring rootfs from cache entry %s" % key)
+        cmd_runner.run(['mkdir', '-p', target_dir], as_root=True).wait()
+        if entry['storage'] == STORAGE_TAR:
+            cmd_runner.run(
+                ['tar', '--numeric-owner', '-C', target_dir, '-xf',
+                 os.path.join(entry_dir, 'rootfs.tar')],
+                as_root=True).wait()
+        else:
+            cp_args = ['cp', '-a']
+            if entry['storage'] == STORAGE_REFLINK:
+                cp_args.append('--reflink=always')
+            cp_args.extend(
+                [os.path.join(entry_dir, 'rootfs') + '/.', target_dir])
+            cmd_runner.run(cp_args, as_root=True).wait()
+        return True
+
+    def store(self, key, source_dir):
+        """Store a copy of source_dir under the given key.
+
+        The copy is made in a temporary directory which is only renamed to
+        its final name once complete, so an interrupted run never leaves a
+        partial entry behind.  Entries are then evicted as needed to keep
+        the cache within its maximum size.
+        """
+        if self.lookup(key):
+            return
+        logger.info("Storing rootfs in cache entry %s" % key)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        entry_dir = self._entry_dir(key)
+        tmp_dir = '%s.tmp.%d' % (entry_dir, os.getpid())
+        os.mkdir(tmp_dir)
+        try:
+            if self.storage == STORAGE_TAR:
+                data = os.path.join(tmp_dir, 'rootfs.tar')
+                cmd_runner.run(
+                    ['tar', '--numeric-owner', '-C', source_dir, '-cf',
+                     data, '.'],
+                    as_root=True).wait()
+            else:
+                data = os.path.join(tmp_dir, 'rootfs')
+                cp_args = ['cp', '-a']
+                if self.storage == STORAGE_REFLINK:
+                    cp_args.append('--reflink=always')
+                cp_args.extend([source_dir, data])
+                cmd_runner.run(cp_args, as_root=True).wait()
+            entry = {
+                'format': CACHE_FORMAT,
+                'storage': self.storage,
+                'size': _disk_usage(data),
+            }
+            with open(os.path.join(tmp_dir, ENTRY_FILE), 'w') as fd:
+                json.dump(entry, fd)
+            os.rename(tmp_dir, entry_dir)
+        finally:
+            if os.path.exists(tmp_dir):
+                cmd_runner.run(['rm', '-rf', tmp_dir], as_root=True).wait()
+        self.evict(keep=key)
+
+    def entries(self):
+        """Return a list of (key, entry) for all the usable entries."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = self._read_entry(key)
+            if entry is not None:
+                entries.append((key, entry))
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits.
+
+        :param keep: The key of an entry that must not be evicted, even if
+            it alone is bigger than the maximum size.
+        """
+        entries = sorted(
+            self.entries(), key=lambda (key, entry): entry['last_used'])
+        total = sum(entry['size'] for key, entry in entries)
+        for key, entry in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            logger.debug("Evicting rootfs cache entry %s" % key)
+            cmd_runner.run(
+                ['rm', '-rf', self._entry_dir(key)], as_root=True).wait()
+            total -= entry['size']
+
+
+def _disk_usage(path):
+    """Return the number of bytes used by the given path."""
+    proc = cmd_runner.run(
+        ['du', '-s', '-B1', path], stdout=subprocess.PIPE, as_root=True)
+    stdout, _ = proc.communicate()
+    return int(stdout.split()[0])
+
+
+def default_cache_dir():
+    """Return the default location of the rootfs cache."""
+    cache_home = os.environ.get(
+        'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'linaro-image-tools', 'rootfs')
@@ -18,9 +18,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import atexit
+import errno
 import glob
+import gzip
+import hashlib
+import json
 import os
 import random
+import re
 import string
 import subprocess
 import sys
@@ -28,25 +33,48 @@ import tempfile
 import textwrap
 import time
 import types
+import zlib
 import struct
 import tarfile
 import dbus
 import shutil
 
+from distutils.spawn import find_executable
 from mock import MagicMock
 from StringIO import StringIO
-from testtools import TestCase
+from testtools import (
+    TestCase,
+    skipUnless,
+)
 
-from linaro_image_tools import cmd_runner
+from linaro_image_tools import (
+    cmd_runner,
+    file_hashes,
+)
+from linaro_image_tools.file_hashes import (
+    DigestMismatch,
+    HashCache,
+)
 from linaro_image_tools.hwpack.handler import HardwarepackHandler
 from linaro_image_tools.hwpack.packages import PackageMaker
 import linaro_image_tools.media_create
 from linaro_image_tools.media_create import (
     android_boards,
+    bmap,
     boards,
     check_device,
+    compress,
+    get_args_parser,
+    offline,
     partitions,
     rootfs,
+    rootfs_cache,
+)
+from linaro_image_tools.media_create.batch import (
+    BatchTarget,
+    InvalidBatchFile,
+    group_targets_by_hwpacks,
+    parse_batch_file,
 )
 from linaro_image_tools.media_create.boards import (
     SECTOR_SIZE,
@@ -97,13 +125,16 @@ from linaro_image_tools.media_create.partitions import (
     get_partition_size_in_bytes,
     get_uuid,
     partition_mounted,
+    partition_mounted_or_staged,
     run_sfdisk_commands,
     setup_partitions,
     wait_partition_to_settle,
 )
 from linaro_image_tools.media_create.rootfs import (
     append_to_fstab,
+    copy_contents,
     create_flash_kernel_config,
+    customize_rootfs,
     has_space_left_for_swap,
     move_contents,
     populate_rootfs,
@@ -111,16 +142,23 @@ from linaro_image_tools.media_create.rootfs import (
     update_network_interfaces,
     write_data_to_protected_file,
 )
+from linaro_image_tools.media_create.rootfs_cache import (
+    RootfsCache,
+    get_cache_key,
+)
 from linaro_image_tools.media_create.tests.fixtures import (
     CreateTarballFixture,
     MockRunSfdiskCommandsFixture,
 )
 from linaro_image_tools.media_create.unpack_binary_tarball import (
+    get_compression_option,
+    unpack_android_binary_tarball,
     unpack_binary_tarball,
 )
 from linaro_image_tools.testing import TestCaseWithFixtures
 from linaro_image_tools.tests.fixtures import (
     CreateTempDirFixture,
+    MockCmdRunnerManyPopenFixture,
     MockCmdRunnerPopenFixture,
     MockSomethingFixture,
 )
@@ -312,6 +350,61 @@ class TestHardwarepackHandler(TestCaseWithFixtures):
             test_file = hp.get_file('bootloader_file')
             self.assertEquals(data, open(test_file, 'r').read())
 
+    def test_metadata_is_parsed_once(self):
+        data = 'test file contents\n'
+        file_in_archive = 'testfile'
+        metadata = self.metadata + "%s=%s\n" % ('U_BOOT', file_in_archive)
+        tarball = self.add_to_tarball(
+            [('metadata', metadata),
+             (file_in_archive, data)])
+        hp = HardwarepackHandler([tarball])
+        parsed = []
+        get_config_from_metadata = hp._get_config_from_metadata
+
+        def counting_get_config_from_metadata(metadata):
+            parsed.append(metadata)
+            return get_config_from_metadata(metadata)
+        hp._get_config_from_metadata = counting_get_config_from_metadata
+        with hp:
+            self.assertEqual('linaro', hp.get_field('origin')[0])
+            self.assertEqual(
+                file_in_archive, hp.get_field('bootloader_file')[0])
+        # The fields are still known after the hwpack is closed and opened
+        # again, and they point to the hwpack that is open now.
+        with hp:
+            self.assertEqual('linaro', hp.get_field('origin')[0])
+            test_file = hp.get_file('bootloader_file')
+            self.assertEquals(data, open(test_file, 'r').read())
+        self.assertEqual(1, len(parsed))
+
+    def test_format_is_read_once(self):
+        tarball = self.add_to_tarball(
+            [('FORMAT', '2.0\n'), ('metadata', self.metadata)])
+        hp = HardwarepackHandler([tarball])
+        with hp:
+            self.assertEqual('2.0', hp.get_format())
+        with hp:
+            self.useFixture(MockSomethingFixture(
+                hp.hwpack_tarfiles[0], 'extractfile', None))
+            self.assertEqual('2.0', hp.get_format())
+
+    def test_get_field_from_second_hwpack(self):
+        tarball1 = self.add_to_tarball(
+            [('metadata', self.metadata)],
+            tarball=self.tarball_fixture.get_tarball())
+        tarball_fixture2 = CreateTarballFixture(
+            self.tar_dir_fixture.get_temp_dir(), reldir='tarfile2',
+            filename='secondtarball.tar.gz')
+        self.useFixture(tarball_fixture2)
+        tarball2 = self.add_to_tarball(
+            [('metadata', "U_BOOT=a_file\n")],
+            tarball=tarball_fixture2.get_tarball())
+        hp = HardwarepackHandler([tarball1, tarball2])
+        with hp:
+            data, hwpack_tarfile = hp.get_field('bootloader_file')
+            self.assertEqual('a_file', data)
+            self.assertIs(hp.hwpack_tarfiles[1], hwpack_tarfile)
+
     def test_list_packages(self):
         metadata = ("format: 3.0\nname: ahwpack\nversion: 4\narchitecture: "
                     "armel\norigin: linaro\n")
@@ -362,6 +455,48 @@ class TestHardwarepackHandler(TestCaseWithFixtures):
             self.assertEqual(hp.find_package_for("foo", architecture="all")[1],
                              "pkgs/foo_1-3_all.deb")
 
+    def test_find_package_for_latest(self):
+        metadata = ("format: 3.0\nname: ahwpack\nversion: 4\narchitecture: "
+                    "armel\norigin: linaro\n")
+        tarball = self.add_to_tarball([
+            ("FORMAT", "3.0\n"),
+            ("metadata", metadata),
+            ("pkgs/foo_1.9-3_all.deb", ''),
+            ("pkgs/foo_1.10-1_all.deb", ''),
+            ("pkgs/foo_1.10~rc1-1_all.deb", ''),
+            ("pkgs/foo_1%3a0.1_arm.deb", ''),
+        ])
+
+        hp = HardwarepackHandler([tarball], board='panda', bootloader='uefi')
+        with hp:
+            self.assertEqual(hp.find_package_for("foo")[1],
+                             "pkgs/foo_1.9-3_all.deb")
+            self.assertEqual(hp.find_package_for("foo", latest=True)[1],
+                             "pkgs/foo_1%3a0.1_arm.deb")
+            self.assertEqual(hp.find_package_for("foo", architecture="all",
+                                                 latest=True)[1],
+                             "pkgs/foo_1.10-1_all.deb")
+            self.assertEqual(hp.find_package_for("bar", latest=True), None)
+
+    def test_find_package_for_indexes_once(self):
+        metadata = ("format: 3.0\nname: ahwpack\nversion: 4\narchitecture: "
+                    "armel\norigin: linaro\n")
+        tarball = self.add_to_tarball([
+            ("FORMAT", "3.0\n"),
+            ("metadata", metadata),
+            ("pkgs/foo_1-3_all.deb", ''),
+        ])
+
+        hp = HardwarepackHandler([tarball], board='panda', bootloader='uefi')
+        with hp:
+            hp.find_package_for("foo")
+        with hp:
+            self.useFixture(MockSomethingFixture(
+                hp.hwpack_tarfiles[0], 'getnames', lambda: []))
+            tar_file, package = hp.find_package_for("foo")
+            self.assertIs(hp.hwpack_tarfiles[0], tar_file)
+            self.assertEqual("pkgs/foo_1-3_all.deb", package)
+
     def test_get_file_from_package(self):
         metadata = ("format: 3.0\nname: ahwpack\nversion: 4\narchitecture: "
                     "armel\norigin: linaro\n")
@@ -403,6 +538,62 @@ class TestHardwarepackHandler(TestCaseWithFixtures):
             path = hp.get_file_from_package("some/path/config", "package2")
             self.assertTrue(path.endswith("some/path/config"))
 
+    def test_get_file_from_package_extracts_once(self):
+        metadata = ("format: 3.0\nname: ahwpack\nversion: 4\narchitecture: "
+                    "armel\norigin: linaro\n")
+        maker = PackageMaker()
+        self.useFixture(ContextManagerFixture(maker))
+        deb_file_path = maker.make_package(
+            'package0', '1.0', {}, files=["usr/lib/u-boot/u-boot.img"])
+        tarball = self.add_to_tarball(
+            [("FORMAT", "3.0\n"), ("metadata", metadata),
+             (os.path.join("pkgs", os.path.basename(deb_file_path)),
+              open(deb_file_path).read())])
+        hp = HardwarepackHandler([tarball], board='panda', bootloader='uefi')
+        scanned = []
+        scan_package = hp._scan_package
+
+        def counting_scan_package(*args):
+            scanned.append(args)
+            return scan_package(*args)
+        hp._scan_package = counting_scan_package
+        with hp:
+            path = hp.get_file_from_package(
+                "usr/lib/u-boot/u-boot.img", "package0")
+            self.assertEqual(
+                path, hp.get_file_from_package(
+                    "usr/lib/u-boot/u-boot.img", "package0"))
+            self.assertTrue(path.endswith("usr/lib/u-boot/u-boot.img"))
+            self.assertTrue(os.path.isfile(path))
+        self.assertEqual(1, len(scanned))
+
+    def test_resolve_package_path(self):
+        members = {
+            'usr': (tarfile.DIRTYPE, ''),
+            'usr/lib': (tarfile.DIRTYPE, ''),
+            'usr/lib/u-boot': (tarfile.DIRTYPE, ''),
+            'usr/lib/u-boot/u-boot.img': (tarfile.REGTYPE, ''),
+            'usr/lib/u-boot/current': (tarfile.SYMTYPE, 'u-boot.img'),
+            'usr/lib/u-boot/absolute': (
+                tarfile.SYMTYPE, '/usr/lib/u-boot/u-boot.img'),
+            'usr/lib/u-boot/hardlink': (
+                tarfile.LNKTYPE, './usr/lib/u-boot/u-boot.img'),
+            'usr/lib/boot': (tarfile.SYMTYPE, 'u-boot'),
+            'usr/lib/loop': (tarfile.SYMTYPE, 'loop'),
+        }
+        resolve = HardwarepackHandler._resolve_package_path
+        expected = 'usr/lib/u-boot/u-boot.img'
+        self.assertEqual(expected, resolve(members, './' + expected))
+        self.assertEqual(
+            expected, resolve(members, 'usr/lib/u-boot/current'))
+        self.assertEqual(
+            expected, resolve(members, 'usr/lib/u-boot/absolute'))
+        self.assertEqual(
+            expected, resolve(members, 'usr/lib/u-boot/hardlink'))
+        self.assertEqual(expected, resolve(members, 'usr/lib/boot/current'))
+        self.assertEqual(None, resolve(members, 'usr/lib/u-boot/missing'))
+        self.assertEqual(None, resolve(members, 'usr/lib/loop'))
+
 
 class TestSetMetadata(TestCaseWithFixtures):
 
@@ -2316,6 +2507,58 @@ class TestExtraBootCmd(TestCaseWithFixtures):
             self.board_conf.extra_boot_args_options)
 
 
+class TestBatchFile(TestCaseWithFixtures):
+
+    def test_parse_batch_file(self):
+        lines = [
+            '# board  image file  hwpacks\n',
+            '\n',
+            'panda  panda.img  hwpack_panda.tar.gz\n',
+            'origen origen.img hwpack_origen.tar.gz hwpack_extra.tar.gz\n',
+        ]
+        self.assertEqual(
+            [BatchTarget('panda', 'panda.img', ('hwpack_panda.tar.gz',)),
+             BatchTarget('origen', 'origen.img',
+                         ('hwpack_origen.tar.gz', 'hwpack_extra.tar.gz'))],
+            parse_batch_file(lines, ['panda', 'origen']))
+
+    def test_parse_batch_file_missing_hwpack(self):
+        self.assertRaises(
+            InvalidBatchFile, parse_batch_file, ['panda panda.img'],
+            ['panda'])
+
+    def test_parse_batch_file_unknown_board(self):
+        self.assertRaises(
+            InvalidBatchFile, parse_batch_file, ['foo foo.img hwpack'],
+            ['panda'])
+
+    def test_parse_batch_file_duplicate_image_file(self):
+        self.assertRaises(
+            InvalidBatchFile, parse_batch_file,
+            ['panda sd.img hwpack1', 'origen sd.img hwpack2'],
+            ['panda', 'origen'])
+
+    def test_parse_batch_file_empty(self):
+        self.assertRaises(
+            InvalidBatchFile, parse_batch_file, ['# nothing here'], [])
+
+    def test_batch_with_image_file(self):
+        self.useFixture(MockSomethingFixture(sys, 'stderr', StringIO()))
+        self.assertRaises(
+            SystemExit, get_args_parser().parse_args,
+            ['--batch', 'targets.txt', '--image-file', 'sd.img'])
+
+    def test_group_targets_by_hwpacks(self):
+        panda = BatchTarget('panda', 'panda.img', ('hwpack1',))
+        panda_es = BatchTarget('panda', 'panda_es.img', ('hwpack1',))
+        origen = BatchTarget('origen', 'origen.img', ('hwpack2', 'hwpack1'))
+        groups = group_targets_by_hwpacks([panda, origen, panda_es])
+        self.assertEqual(
+            [(('hwpack1',), [panda, panda_es]),
+             (('hwpack2', 'hwpack1'), [origen])],
+            groups.items())
+
+
 class TestUnpackBinaryTarball(TestCaseWithFixtures):
 
     def setUp(self):
@@ -2334,6 +2577,73 @@ class TestUnpackBinaryTarball(TestCaseWithFixtures):
             self.tarball_fixture.get_tarball(), tmp_dir, as_root=False)
         self.assertEqual(rc, 0)
 
+    def test_unpack_binary_tarball_member(self):
+        tmp_dir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        rc = unpack_binary_tarball(
+            self.tarball_fixture.get_tarball(), tmp_dir, as_root=False,
+            member='tarball')
+        self.assertEqual(rc, 0)
+        self.assertEqual([], os.listdir(tmp_dir))
+
+    def test_unpack_binary_tarball_member_strips_components(self):
+        fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        unpack_binary_tarball(
+            'binary.tar.gz', '/mnt/root',
+            member='./binary/boot/filesystem.dir')
+        self.assertEqual(
+            ['%s tar --numeric-owner -C /mnt/root --strip-components=4 '
+             '-xf binary.tar.gz ./binary/boot/filesystem.dir' % sudo_args],
+            fixture.mock.commands_executed)
+
+    def get_tarball_digest(self):
+        return 'sha256', hashlib.sha256(
+            open(self.tarball_fixture.get_tarball()).read()).hexdigest()
+
+    def test_unpack_binary_tarball_digest(self):
+        tmp_dir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        rc = unpack_binary_tarball(
+            self.tarball_fixture.get_tarball(), tmp_dir, as_root=False,
+            digest=self.get_tarball_digest())
+        self.assertEqual(rc, 0)
+        self.assertEqual(['tarball'], os.listdir(tmp_dir))
+
+    def test_unpack_binary_tarball_digest_mismatch(self):
+        tmp_dir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        open(os.path.join(tmp_dir, 'existing'), 'w').close()
+        self.assertRaises(
+            DigestMismatch, unpack_binary_tarball,
+            self.tarball_fixture.get_tarball(), tmp_dir, as_root=False,
+            digest=('sha1', '0' * 40))
+        # What was unpacked is removed, and only that.
+        self.assertEqual(['existing'], os.listdir(tmp_dir))
+
+    def test_unpack_binary_tarball_digest_pipes_tarball(self):
+        tmp_dir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        unpack_binary_tarball(
+            self.tarball_fixture.get_tarball(), tmp_dir,
+            member='./binary', digest=self.get_tarball_digest())
+        self.assertEqual(
+            ['%s tar --numeric-owner -C %s -z -xf - '
+             '--strip-components=2 ./binary' % (sudo_args, tmp_dir)],
+            fixture.mock.commands_executed)
+
+    def test_unpack_android_binary_tarball_digest(self):
+        tmp_dir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        rc = unpack_android_binary_tarball(
+            self.tarball_fixture.get_tarball(), tmp_dir, as_root=False,
+            digest=self.get_tarball_digest())
+        self.assertEqual(rc, 0)
+        self.assertEqual(['tarball'], os.listdir(tmp_dir))
+
+    def test_get_compression_option(self):
+        self.assertEqual(
+            '-z', get_compression_option(self.tarball_fixture.get_tarball()))
+        plain = os.path.join(self.tar_dir_fixture.get_temp_dir(), 'plain')
+        with open(plain, 'w') as fd:
+            fd.write('not compressed')
+        self.assertEqual(None, get_compression_option(plain))
+
 
 class TestGetUuid(TestCaseWithFixtures):
 
@@ -3188,7 +3498,7 @@ class TestPartitionSetup(TestCaseWithFixtures):
         # (via dd) inside setup_partitions.  That's why we pass an
         # already setup image file.
         tmpfile = self._create_tmpfile()
-        popen_fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        popen_fixture = self.useFixture(MockCmdRunnerManyPopenFixture())
         self.useFixture(MockSomethingFixture(
             sys, 'stdout', open('/dev/null', 'w')))
 
@@ -3238,7 +3548,7 @@ class TestPartitionSetup(TestCaseWithFixtures):
         media = Media(tmpfile)
         # Pretend our tmpfile is a block device.
         media.is_block_device = True
-        popen_fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        popen_fixture = self.useFixture(MockCmdRunnerManyPopenFixture())
 
         board_conf = get_board_config('beagle')
         board_conf.hwpack_format = HardwarepackHandler.FORMAT_1
@@ -3379,6 +3689,21 @@ class TestMountedPartitionContextManager(TestCaseWithFixtures):
         expected = ['sudo -E mount foo bar', 'sync']
         self.assertEqual(expected, popen_fixture.mock.commands_executed)
 
+    def test_staged(self):
+        popen_fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        with partition_mounted_or_staged(None, 'bar'):
+            pass
+        self.assertEqual(None, popen_fixture.mock.calls)
+
+    def test_mounted_or_staged_with_device(self):
+        popen_fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        with partition_mounted_or_staged('foo', 'bar'):
+            pass
+        expected = ['%s mount foo bar' % sudo_args,
+                    'sync',
+                    '%s umount bar' % sudo_args]
+        self.assertEqual(expected, popen_fixture.mock.commands_executed)
+
 
 class TestPopulateBoot(TestCaseWithFixtures):
 
@@ -3599,6 +3924,31 @@ class TestPopulateRootFS(TestCaseWithFixtures):
             '%s umount %s' % (sudo_args, root_disk)]
         self.assertEqual(expected, popen_fixture.mock.commands_executed)
 
+    def test_customize_rootfs(self):
+        def fake_append_to_fstab(disk, additions):
+            self.lines_added_to_fstab = additions
+
+        self.useFixture(MockSomethingFixture(
+            sys, 'stdout', open('/dev/null', 'w')))
+        self.useFixture(MockSomethingFixture(
+            rootfs, 'append_to_fstab', fake_append_to_fstab))
+        popen_fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        root_disk = self.useFixture(CreateTempDirFixture()).tempdir
+
+        customize_rootfs(
+            root_disk, rootfs_type='ext4', rootfs_id='UUID=uuid',
+            should_create_swap=False, swap_size=None, mmc_device_id=0,
+            partition_offset=0)
+
+        self.assertEqual(
+            ['UUID=uuid / ext4  errors=remount-ro 0 1'],
+            self.lines_added_to_fstab)
+        # Only the move of the flash-kernel.conf file; no mount or umount.
+        self.assertEqual(1, len(popen_fixture.mock.commands_executed))
+        self.assertIn(
+            '%s/etc/flash-kernel.conf' % root_disk,
+            popen_fixture.mock.commands_executed[0])
+
     def test_create_flash_kernel_config(self):
         fixture = self.useFixture(MockCmdRunnerPopenFixture())
         tempdir = self.useFixture(CreateTempDirFixture()).tempdir
@@ -3649,6 +3999,15 @@ class TestPopulateRootFS(TestCaseWithFixtures):
         self.assertEqual(['%s mv %s /tmp/' % (sudo_args, file1)],
                          popen_fixture.mock.commands_executed)
 
+    def test_copy_contents(self):
+        tempdir = self.useFixture(CreateTempDirFixture()).tempdir
+        popen_fixture = self.useFixture(MockCmdRunnerPopenFixture())
+
+        copy_contents(tempdir, '/tmp/')
+
+        self.assertEqual(['%s cp -a %s/. /tmp/' % (sudo_args, tempdir)],
+                         popen_fixture.mock.commands_executed)
+
     def test_has_space_left_for_swap(self):
         statvfs = os.statvfs('/')
         space_left = statvfs.f_bavail * statvfs.f_bsize
@@ -3778,6 +4137,376 @@ class TestPopulateRootFS(TestCaseWithFixtures):
         self.assertEquals("\nfoo\nbar\n", contents)
 
 
+class TestRootfsCache(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestRootfsCache, self).setUp()
+        # We want to run the real commands, but without sudo.
+        self.useFixture(MockSomethingFixture(cmd_runner, 'SUDO_ARGS', []))
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+        self.rootfs = os.path.join(self.tempdir, 'rootfs')
+        os.makedirs(os.path.join(self.rootfs, 'etc'))
+        with open(os.path.join(self.rootfs, 'etc', 'hostname'), 'w') as fd:
+            fd.write('linaro\n')
+
+    def make_file(self, name, content):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as fd:
+            fd.write(content)
+        return path
+
+    def make_entry(self, key, size, last_used):
+        entry_dir = os.path.join(self.cache_dir, key)
+        os.makedirs(entry_dir)
+        entry_file = os.path.join(entry_dir, rootfs_cache.ENTRY_FILE)
+        with open(entry_file, 'w') as fd:
+            json.dump({'format': rootfs_cache.CACHE_FORMAT,
+                       'storage': rootfs_cache.STORAGE_DIR,
+                       'size': size}, fd)
+        os.utime(entry_file, (last_used, last_used))
+
+    def test_cache_key_depends_on_content_only(self):
+        binary1 = self.make_file('binary1', 'binary')
+        binary2 = self.make_file('binary2', 'binary')
+        hwpack = self.make_file('hwpack', 'hwpack')
+        self.assertEqual(
+            get_cache_key(binary1, [hwpack]),
+            get_cache_key(binary2, [hwpack]))
+
+    def test_cache_key_changes_with_content(self):
+        binary = self.make_file('binary', 'binary')
+        hwpack1 = self.make_file('hwpack1', 'hwpack1')
+        hwpack2 = self.make_file('hwpack2', 'hwpack2')
+        self.assertNotEqual(
+            get_cache_key(binary, [hwpack1]),
+            get_cache_key(binary, [hwpack2]))
+        self.assertNotEqual(
+            get_cache_key(binary, [hwpack1, hwpack2]),
+            get_cache_key(binary, [hwpack2, hwpack1]))
+
+    def test_cache_key_changes_with_extra(self):
+        binary = self.make_file('binary', 'binary')
+        self.assertNotEqual(
+            get_cache_key(binary, [], btrfs=True),
+            get_cache_key(binary, [], btrfs=False))
+
+    def test_cache_key_uses_hash_cache(self):
+        binary = self.make_file('binary', 'binary')
+        hwpack = self.make_file('hwpack', 'hwpack')
+        hash_cache = HashCache()
+        key = get_cache_key(binary, [hwpack], hash_cache=hash_cache)
+        hashed = []
+
+        def hash_file(path, algorithm):
+            hashed.append(path)
+        self.useFixture(MockSomethingFixture(
+            file_hashes, 'hash_file', hash_file))
+        self.assertEqual(
+            key, get_cache_key(binary, [hwpack], hash_cache=hash_cache))
+        self.assertEqual([], hashed)
+
+    def test_unknown_storage(self):
+        self.assertRaises(ValueError, RootfsCache, self.cache_dir, 0, 'zip')
+
+    def test_lookup_missing(self):
+        cache = RootfsCache(self.cache_dir, 1024 ** 3)
+        self.assertFalse(cache.lookup('key'))
+
+    def assertStoreAndRestore(self, storage):
+        cache = RootfsCache(self.cache_dir, 1024 ** 3, storage)
+        cache.store('key', self.rootfs)
+        self.assertTrue(cache.lookup('key'))
+        target = os.path.join(self.tempdir, 'target')
+        self.assertTrue(cache.restore('key', target))
+        with open(os.path.join(target, 'etc', 'hostname')) as fd:
+            self.assertEqual('linaro\n', fd.read())
+        # No temporary directories are left behind.
+        self.assertEqual(['key'], os.listdir(self.cache_dir))
+
+    def test_store_and_restore_dir(self):
+        self.assertStoreAndRestore(rootfs_cache.STORAGE_DIR)
+
+    def test_store_and_restore_tar(self):
+        self.assertStoreAndRestore(rootfs_cache.STORAGE_TAR)
+
+    def test_evict_least_recently_used(self):
+        self.make_entry('old', 10, 1000)
+        self.make_entry('new', 10, 3000)
+        self.make_entry('middle', 10, 2000)
+        cache = RootfsCache(self.cache_dir, 20)
+        cache.evict()
+        self.assertEqual(
+            ['middle', 'new'], sorted(key for key, entry in cache.entries()))
+
+    def test_evict_keeps_given_entry(self):
+        self.make_entry('old', 10, 1000)
+        self.make_entry('new', 30, 2000)
+        cache = RootfsCache(self.cache_dir, 20)
+        cache.evict(keep='new')
+        self.assertEqual(['new'], [key for key, entry in cache.entries()])
+
+    def test_restore_marks_entry_as_used(self):
+        cache = RootfsCache(self.cache_dir, 1024 ** 3)
+        cache.store('key', self.rootfs)
+        entry_file = os.path.join(
+            self.cache_dir, 'key', rootfs_cache.ENTRY_FILE)
+        os.utime(entry_file, (1000, 1000))
+        cache.restore('key', os.path.join(self.tempdir, 'target'))
+        self.assertTrue(os.stat(entry_file).st_mtime > 1000)
+
+    def test_restore_evicted_entry(self):
+        # Another process evicted the entry after it was looked up.
+        cache = RootfsCache(self.cache_dir, 1024 ** 3)
+        target = os.path.join(self.tempdir, 'target')
+        self.assertFalse(cache.restore('key', target))
+        self.assertFalse(os.path.exists(target))
+
+
+class TestBmap(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestBmap, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        self.image = os.path.join(self.tempdir, 'sd.img')
+        # A 64K sparse image with data in its first and tenth 4K blocks.
+        with open(self.image, 'wb') as fd:
+            fd.write('a' * 10)
+            fd.seek(10 * 4096)
+            fd.write('b' * 4096)
+            fd.truncate(64 * 1024)
+
+    def test_get_mapped_ranges(self):
+        self.assertEqual(
+            [(0, 0), (10, 10)], bmap.get_mapped_ranges(self.image, 4096))
+
+    def test_get_mapped_ranges_merges_adjacent_blocks(self):
+        with open(self.image, 'r+b') as fd:
+            fd.seek(4096)
+            fd.write('c')
+        self.assertEqual(
+            [(0, 1), (10, 10)], bmap.get_mapped_ranges(self.image, 4096))
+
+    def test_get_data_extents_without_seek_data(self):
+        def lseek(fd, offset, whence):
+            raise OSError(errno.EINVAL, 'Invalid argument')
+        self.useFixture(MockSomethingFixture(os, 'lseek', lseek))
+        self.assertEqual([(0, 100)], bmap.get_data_extents(None, 100))
+
+    def test_generate_bmap(self):
+        content = bmap.generate_bmap(self.image, 4096)
+        self.assertIn('<bmap version="2.0">', content)
+        self.assertIn('<ImageSize> 65536 </ImageSize>', content)
+        self.assertIn('<BlocksCount> 16 </BlocksCount>', content)
+        self.assertIn('<MappedBlocksCount> 2 </MappedBlocksCount>', content)
+        block = 'b' * 4096
+        self.assertIn(
+            '<Range chksum="%s"> 10 </Range>' % (
+                hashlib.sha256(block).hexdigest()),
+            content)
+
+    def test_generate_bmap_file_checksum(self):
+        content = bmap.generate_bmap(self.image, 4096)
+        checksum = re.search(
+            '<BmapFileChecksum> (\w+) </BmapFileChecksum>', content).group(1)
+        self.assertEqual(
+            checksum,
+            hashlib.sha256(
+                content.replace(checksum, bmap.ZERO_CHECKSUM)).hexdigest())
+
+    def test_write_bmap(self):
+        popen_fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        bmap_file = bmap.write_bmap(self.image, block_size=4096)
+        self.assertEqual(self.image + '.bmap', bmap_file)
+        self.assertEqual(
+            ['fallocate --dig-holes %s' % self.image],
+            popen_fixture.mock.commands_executed)
+        self.assertEqual(
+            bmap.generate_bmap(self.image, 4096), open(bmap_file).read())
+
+
+class TestCompress(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestCompress, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        self.image = os.path.join(self.tempdir, 'sd.img')
+        self.contents = ''.join(
+            chr(random.randint(0, 255)) for i in range(3000)) + '\0' * 5000
+        with open(self.image, 'wb') as fd:
+            fd.write(self.contents)
+
+    def test_compress_gzip_block(self):
+        member = compress.compress_gzip_block('foo' * 100)
+        self.assertEqual('\x1f\x8b', member[:2])
+        self.assertEqual(
+            'foo' * 100, zlib.decompress(member, compress.GZIP_WBITS))
+
+    def test_compress_gzip_members(self):
+        output_file = os.path.join(self.tempdir, 'sd.img.gz')
+        compress.compress_gzip(
+            self.image, output_file, workers=2, block_size=1024)
+        self.assertEqual(self.contents, gzip.open(output_file).read())
+
+    def test_compress_gzip_same_output_with_one_worker(self):
+        parallel = os.path.join(self.tempdir, 'parallel.gz')
+        serial = os.path.join(self.tempdir, 'serial.gz')
+        compress.compress_gzip(
+            self.image, parallel, workers=2, block_size=1024)
+        compress.compress_gzip(self.image, serial, workers=1, block_size=1024)
+        self.assertEqual(open(parallel).read(), open(serial).read())
+
+    def test_compress_image_with_checksum(self):
+        output_file = compress.compress_image(
+            self.image, 'gz', checksum=True, workers=1)
+        self.assertEqual(self.image + '.gz', output_file)
+        self.assertEqual(
+            '%s  sd.img.gz\n' % hashlib.sha256(
+                open(output_file).read()).hexdigest(),
+            open(output_file + '.sha256').read())
+
+    def test_compress_image_xz(self):
+        popen_fixture = self.useFixture(
+            MockCmdRunnerPopenFixture(output_string='compressed'))
+        output_file = compress.compress_image(self.image, 'xz', workers=4)
+        self.assertEqual(
+            ['xz -T4 -c %s' % self.image],
+            popen_fixture.mock.commands_executed)
+        self.assertEqual('compressed', open(output_file).read())
+
+    def test_compress_image_unknown_format(self):
+        self.assertRaises(
+            ValueError, compress.compress_image, self.image, 'bz2')
+
+
+class TestOfflineFilesystems(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestOfflineFilesystems, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        self.popen_fixture = self.useFixture(MockCmdRunnerPopenFixture())
+
+    def test_setup_image_partitions(self):
+        sfdisk_calls = []
+
+        def run_sfdisk_commands(commands, heads, sectors, cylinders, device,
+                                as_root=True, stderr=None):
+            sfdisk_calls.append((device, as_root))
+            return '', ''
+        self.useFixture(MockSomethingFixture(
+            offline, 'run_sfdisk_commands', run_sfdisk_commands))
+        self.useFixture(MockSomethingFixture(
+            offline, 'calculate_partition_size_and_offset',
+            lambda image_file: (1024, 2048, 4096, 8192)))
+        image = os.path.join(self.tempdir, 'sd.img')
+        board_conf = boards.BeagleConfig()
+        board_conf.hwpack_format = HardwarepackHandler.FORMAT_1
+        layout = offline.setup_image_partitions(board_conf, image, '1G')
+        self.assertEqual(
+            offline.PartitionLayout(
+                boot_offset=2048, boot_size=1024, root_offset=8192,
+                root_size=4096),
+            layout)
+        self.assertEqual(
+            ['dd of=%s bs=1 seek=1073741824 count=0' % image],
+            self.popen_fixture.mock.commands_executed)
+        # The image file is partitioned without root rights.
+        self.assertEqual([(image, False)], sfdisk_calls)
+
+    def test_make_vfat_filesystem(self):
+        source_dir = os.path.join(self.tempdir, 'boot')
+        os.mkdir(source_dir)
+        for name in ['uImage', 'boot.scr']:
+            open(os.path.join(source_dir, name), 'w').close()
+        fs_file = os.path.join(self.tempdir, 'boot.img')
+        offline.make_vfat_filesystem(
+            fs_file, 64 * 1024 * 1024, 32, 'boot', source_dir)
+        self.assertEqual(
+            ['mkfs.vfat -C -F 32 -n boot %s 65536' % fs_file,
+             '%s mcopy -s -p -m -i %s %s/boot.scr %s/uImage ::' % (
+                 sudo_args, fs_file, source_dir, source_dir)],
+            self.popen_fixture.mock.commands_executed)
+
+    def test_make_rootfs_filesystem_ext4(self):
+        fs_file = os.path.join(self.tempdir, 'root.img')
+        offline.make_rootfs_filesystem(
+            fs_file, 1024 * 1024, 'ext4', 'rootfs', 'the-uuid', '/staging')
+        self.assertEqual(1024 * 1024, os.path.getsize(fs_file))
+        self.assertEqual(
+            ['%s mkfs.ext4 -F -d /staging -U the-uuid -L rootfs %s 1024k' % (
+                sudo_args, fs_file)],
+            self.popen_fixture.mock.commands_executed)
+
+    def test_make_rootfs_filesystem_btrfs(self):
+        fs_file = os.path.join(self.tempdir, 'root.img')
+        offline.make_rootfs_filesystem(
+            fs_file, 1024 * 1024, 'btrfs', 'rootfs', 'the-uuid', '/staging')
+        self.assertEqual(
+            ['%s mkfs.btrfs -f -r /staging -U the-uuid -L rootfs -b 1048576 '
+             '%s' % (sudo_args, fs_file)],
+            self.popen_fixture.mock.commands_executed)
+
+    def test_make_rootfs_filesystem_unsupported(self):
+        self.assertRaises(
+            ValueError, offline.make_rootfs_filesystem,
+            os.path.join(self.tempdir, 'root.img'), 1024, 'xfs', 'rootfs',
+            'the-uuid', '/staging')
+
+    def test_splice_filesystem(self):
+        offline.splice_filesystem('boot.img', 'sd.img', 1048576)
+        self.assertEqual(
+            ['dd if=boot.img of=sd.img bs=1M seek=1048576 oflag=seek_bytes '
+             'conv=notrunc,sparse'],
+            self.popen_fixture.mock.commands_executed)
+
+
+def _have_commands(*names):
+    env = {'PATH': os.environ.get('PATH', '')}
+    cmd_runner.sanitize_path(env)
+    return all(find_executable(name, env['PATH']) for name in names)
+
+
+@skipUnless(_have_commands('mkfs.ext2', 'e2fsck'),
+            "mkfs.ext2 and e2fsck are not installed")
+class TestOfflineImageOverOldImage(TestCaseWithFixtures):
+
+    def test_filesystem_is_not_corrupted_by_old_image(self):
+        tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        size = 16 * 1024 * 1024
+        image = os.path.join(tempdir, 'sd.img')
+        # What an earlier image could have left in the file.
+        with open(image, 'wb') as fd:
+            fd.write('\xff' * size)
+        self.useFixture(MockSomethingFixture(
+            offline, 'run_sfdisk_commands', lambda *args, **kwargs: ('', '')))
+        self.useFixture(MockSomethingFixture(
+            offline, 'calculate_partition_size_and_offset',
+            lambda image_file: (size / 2, 0, size / 2, size / 2)))
+        board_conf = boards.BeagleConfig()
+        board_conf.hwpack_format = HardwarepackHandler.FORMAT_1
+        layout = offline.setup_image_partitions(board_conf, image, '16M')
+
+        fs_file = os.path.join(tempdir, 'root.img')
+        with open(fs_file, 'wb') as fd:
+            fd.truncate(layout.root_size)
+        # Enough inodes for the inode table to span whole 1M blocks of
+        # zeros, which splice_filesystem() skips.
+        cmd_runner.run(
+            ['mkfs.ext2', '-q', '-F', '-N', '8192', fs_file]).wait()
+        offline.splice_filesystem(fs_file, image, layout.root_offset)
+
+        partition = os.path.join(tempdir, 'root.part')
+        cmd_runner.run(
+            ['dd', 'if=%s' % image, 'of=%s' % partition, 'bs=1M',
+             'skip=%d' % layout.root_offset, 'count=%d' % layout.root_size,
+             'iflag=skip_bytes,count_bytes'],
+            stderr=open('/dev/null', 'w')).wait()
+        # e2fsck exits with a non-zero status if it finds any problem.
+        cmd_runner.run(
+            ['e2fsck', '-f', '-n', partition], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT).communicate()
+
+
 class TestCheckDevice(TestCaseWithFixtures):
 
     def _mock_does_device_exist_true(self):
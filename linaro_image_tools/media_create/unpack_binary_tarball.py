@@ -17,10 +17,92 @@
 # You should have received a copy of the GNU General Public License
 # along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
+import hashlib
+import os
+import subprocess
+
 from linaro_image_tools import cmd_runner
+from linaro_image_tools.file_hashes import (
+    READ_CHUNK_SIZE,
+    DigestMismatch,
+)
+
+# The tar option for each kind of compression, by its magic bytes.  tar
+# can't guess the compression of what it reads from a pipe.
+COMPRESSION_MAGIC = [
+    ('\x1f\x8b', '-z'),
+    ('BZh', '-j'),
+    ('\xfd7zXZ\x00', '-J'),
+]
+
+
+def get_compression_option(tarball):
+    """Return the tar option to decompress the tarball, or None."""
+    with open(tarball, 'rb') as fd:
+        head = fd.read(6)
+    for magic, option in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return option
+    return None
 
 
-def unpack_android_binary_tarball(tarball, unpack_dir, as_root=True):
+def unpack_verified_tarball(tarball, unpack_dir, tar_args, digest,
+                            as_root=True):
+    """Unpack the tarball while checking its digest, reading it only once.
+
+    The tarball is piped into tar, and hashed as it is read.  If its digest
+    doesn't match, whatever was unpacked is removed from unpack_dir.
+
+    :param tar_args: Options to tar other than those to set the directory,
+        the compression and the input file (e.g. the members to unpack).
+    :param digest: An (algorithm, hexadecimal digest) pair.
+    :raises DigestMismatch: if the digest doesn't match.
+    """
+    algorithm, expected = digest
+    existing = set(os.listdir(unpack_dir))
+    args = ['tar', '--numeric-owner', '-C', unpack_dir]
+    compression = get_compression_option(tarball)
+    if compression is not None:
+        args.append(compression)
+    args.extend(['-xf', '-'] + tar_args)
+    hasher = hashlib.new(algorithm)
+    proc = cmd_runner.run(args, as_root=as_root, stdin=subprocess.PIPE)
+    try:
+        with open(tarball, 'rb') as fd:
+            while True:
+                data = fd.read(READ_CHUNK_SIZE)
+                if not data:
+                    break
+                hasher.update(data)
+                proc.stdin.write(data)
+        proc.stdin.close()
+    except IOError, e:
+        # tar exiting early closes the pipe; wait() reports why.
+        if e.errno != errno.EPIPE:
+            raise
+    proc.wait()
+    if hasher.hexdigest() != expected:
+        unpacked = [os.path.join(unpack_dir, name)
+                    for name in os.listdir(unpack_dir)
+                    if name not in existing]
+        if unpacked:
+            cmd_runner.run(['rm', '-rf'] + unpacked, as_root=as_root).wait()
+        raise DigestMismatch(
+            "%s digest of %s does not match its hash file" % (
+                algorithm, tarball))
+    return proc.returncode
+
+
+def unpack_android_binary_tarball(tarball, unpack_dir, as_root=True,
+                                  digest=None):
+    """Unpack the given tarball into unpack_dir.
+
+    If digest is given, see unpack_verified_tarball().
+    """
+    if digest is not None:
+        return unpack_verified_tarball(
+            tarball, unpack_dir, [], digest, as_root=as_root)
     proc = cmd_runner.run(
         ['tar', '--numeric-owner', '-C', unpack_dir, '-jxf', tarball],
         as_root=as_root)
@@ -28,9 +110,31 @@ def unpack_android_binary_tarball(tarball, unpack_dir, as_root=True):
     return proc.returncode
 
 
-def unpack_binary_tarball(tarball, unpack_dir, as_root=True):
-    proc = cmd_runner.run(
-        ['tar', '--numeric-owner', '-C', unpack_dir, '-xf', tarball],
-        as_root=as_root)
+def unpack_binary_tarball(tarball, unpack_dir, as_root=True, member=None,
+                          digest=None):
+    """Unpack the given tarball into unpack_dir.
+
+    If member is given, only that directory of the tarball is unpacked, with
+    its contents placed directly under unpack_dir.  It must be the member name
+    exactly as stored in the tarball (e.g. './binary' rather than 'binary').
+
+    If digest is given, the tarball is checked against it while being
+    unpacked; see unpack_verified_tarball().
+    """
+    tar_args = []
+    if member is not None:
+        # tar counts a leading '.' as a path component too.
+        components = [part for part in member.split('/') if part != '']
+        tar_args.append('--strip-components=%d' % len(components))
+    if digest is not None:
+        if member is not None:
+            tar_args.append(member)
+        return unpack_verified_tarball(
+            tarball, unpack_dir, tar_args, digest, as_root=as_root)
+    args = ['tar', '--numeric-owner', '-C', unpack_dir] + tar_args
+    args.extend(['-xf', tarball])
+    if member is not None:
+        args.append(member)
+    proc = cmd_runner.run(args, as_root=as_root)
     proc.wait()
     return proc.returncode
@@ -0,0 +1,319 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A long-lived helper running as root, for file operations.
+
+Creating an image copies, moves, writes and removes a lot of files that only
+root can touch, and running a separate `sudo cp ...` for each of them is
+slow.  Once start() has been called, the functions below (copy(), mkdir(),
+rename(), write(), pwrite() and unlink()) send their operations to a single
+helper process, started with sudo, instead.  Until then, or if the helper
+is never started, they run the same commands as before.
+
+The helper reads a JSON object per line on its stdin, with a list of
+operations to run in order, and answers with a JSON object per line on its
+stdout, with the result of each of them.  It stops at the first one that
+fails.  File contents are base64-encoded.
+"""
+
+import base64
+import errno
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from linaro_image_tools import cmd_runner
+
+READ_CHUNK_SIZE = 1024 * 1024
+HELPER_SCRIPT = (
+    "import sys; sys.path.insert(0, %r); "
+    "from linaro_image_tools.root_helper import serve; "
+    "serve(sys.stdin, sys.stdout)")
+
+
+class RootHelperError(Exception):
+    """An operation run by the root helper failed."""
+
+    def __init__(self, op, errno, message):
+        super(RootHelperError, self).__init__(op, errno, message)
+        self.op = op
+        self.errno = errno
+        self.message = message
+
+    def __str__(self):
+        return "%s failed: %s" % (self.op, self.message)
+
+
+def _target_path(src, dst):
+    # Like cp and mv, put the file inside dst if that's a directory.
+    if os.path.isdir(dst):
+        return os.path.join(dst, os.path.basename(src))
+    return dst
+
+
+def _op_copy(src, dst):
+    dst = _target_path(src, dst)
+    exists = os.path.exists(dst)
+    shutil.copyfile(src, dst)
+    # Like cp, only new files get the mode of the source.
+    if not exists:
+        shutil.copymode(src, dst)
+
+
+def _op_mkdir(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+def _op_rename(src, dst):
+    dst = _target_path(src, dst)
+    try:
+        os.rename(src, dst)
+    except OSError, e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Across filesystems, leave copying files, directories or symlinks
+        # with their ownership and modes to mv itself.
+        proc = subprocess.Popen(
+            ['mv', '-f', src, dst], stderr=subprocess.PIPE)
+        _, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise OSError(e.errno, stderr.strip())
+
+
+def _op_write(path, data):
+    # Like write() without the helper, which moves a mkstemp() file into
+    # place: path is replaced rather than written into, so it ends up with
+    # the mode of a new mkstemp() file whatever it had before.
+    fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(base64.b64decode(data))
+        os.rename(tmpfile, path)
+    except:
+        os.unlink(tmpfile)
+        raise
+
+
+def _op_pwrite(path, offset, data=None, source=None, source_offset=0,
+               length=None):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0644)
+    try:
+        os.lseek(fd, offset, os.SEEK_SET)
+        if data is not None:
+            os.write(fd, base64.b64decode(data))
+            return
+        with open(source, 'rb') as src:
+            if source_offset:
+                src.seek(source_offset)
+            while length is None or length > 0:
+                size = READ_CHUNK_SIZE
+                if length is not None:
+                    size = min(size, length)
+                chunk = src.read(size)
+                if not chunk:
+                    break
+                os.write(fd, chunk)
+                if length is not None:
+                    length -= len(chunk)
+    finally:
+        os.close(fd)
+
+
+def _op_unlink(path):
+    try:
+        os.unlink(path)
+    except OSError, e:
+        # Like rm -f.
+        if e.errno != errno.ENOENT:
+            raise
+
+
+OPERATIONS = {
+    'copy': _op_copy,
+    'mkdir': _op_mkdir,
+    'rename': _op_rename,
+    'write': _op_write,
+    'pwrite': _op_pwrite,
+    'unlink': _op_unlink,
+}
+
+
+def run_operations(ops):
+    """Run the given operations, stopping at the first that fails.
+
+    Each operation is a dict with its name under 'op' and its arguments
+    under the other keys.  Return a list of results, one per operation that
+    was run, each with 'ok' and, on failure, 'errno' and 'error'.
+    """
+    results = []
+    for op in ops:
+        op = dict(op)
+        name = op.pop('op')
+        try:
+            OPERATIONS[name](**dict(
+                (str(key), value) for key, value in op.items()))
+        except (EnvironmentError, KeyError, TypeError), e:
+            results.append(dict(
+                ok=False, errno=getattr(e, 'errno', None), error=str(e)))
+            break
+        results.append(dict(ok=True))
+    return results
+
+
+def serve(stdin, stdout):
+    """Answer the requests read from stdin until it is closed."""
+    while True:
+        line = stdin.readline()
+        if not line:
+            break
+        request = json.loads(line)
+        stdout.write(json.dumps(
+            dict(results=run_operations(request['ops']))) + '\n')
+        stdout.flush()
+
+
+class RootHelper(object):
+    """The client side of a root helper process."""
+
+    def __init__(self):
+        self.proc = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # The helper imports this module from the same tree as its client.
+        tree = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.proc = cmd_runner.run(
+            [sys.executable, '-c', HELPER_SCRIPT % tree], as_root=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def stop(self):
+        if self.proc is None:
+            return
+        self.proc.stdin.close()
+        self.proc.wait()
+        self.proc = None
+
+    def run_batch(self, ops):
+        """Send the operations to the helper and return their results."""
+        request = json.dumps(dict(ops=list(ops))) + '\n'
+        with self._lock:
+            self.proc.stdin.write(request)
+            self.proc.stdin.flush()
+            response = self.proc.stdout.readline()
+        if not response:
+            raise RootHelperError('root helper', None, 'exited unexpectedly')
+        return json.loads(response)['results']
+
+    def run(self, *ops):
+        """Run the operations, raising RootHelperError if any fails."""
+        results = self.run_batch(ops)
+        for op, result in zip(ops, results):
+            if not result['ok']:
+                raise RootHelperError(
+                    op['op'], result['errno'], result['error'])
+
+
+_helper = None
+
+
+def start():
+    """Start the root helper used by the functions below."""
+    global _helper
+    if _helper is None:
+        helper = RootHelper()
+        helper.start()
+        _helper = helper
+
+
+def stop():
+    """Stop the root helper, if it was started."""
+    global _helper
+    if _helper is not None:
+        helper, _helper = _helper, None
+        helper.stop()
+
+
+def get_helper():
+    """Return the running RootHelper, or None."""
+    return _helper
+
+
+def _run_as_root(args):
+    cmd_runner.run(args, as_root=True).wait()
+
+
+def copy(src, dst, verbose=False):
+    """Copy src to dst (or into it, if it's a directory) as root."""
+    if _helper is not None:
+        _helper.run(dict(op='copy', src=src, dst=dst))
+    elif verbose:
+        _run_as_root(['cp', '-v', src, dst])
+    else:
+        _run_as_root(['cp', src, dst])
+
+
+def mkdir(path):
+    """Create the directory and its parents as root, if needed."""
+    if _helper is not None:
+        _helper.run(dict(op='mkdir', path=path))
+    else:
+        _run_as_root(['mkdir', '-p', path])
+
+
+def rename(src, dst):
+    """Move src to dst (or into it, if it's a directory) as root."""
+    if _helper is not None:
+        _helper.run(dict(op='rename', src=src, dst=dst))
+    else:
+        _run_as_root(['mv', '-f', src, dst])
+
+
+def write(path, data):
+    """Replace the contents of the file at path with data, as root."""
+    if _helper is not None:
+        _helper.run(dict(op='write', path=path, data=base64.b64encode(data)))
+        return
+    _, tmpfile = tempfile.mkstemp()
+    with open(tmpfile, 'w') as fd:
+        fd.write(data)
+    _run_as_root(['mv', '-f', tmpfile, path])
+
+
+def pwrite(path, offset, source, source_offset=0, length=None):
+    """Write the contents of source into path at offset, as root.
+
+    :param source_offset: Where to start reading source.
+    :param length: How many bytes to copy; all that's left in source if
+        None.
+    """
+    assert _helper is not None, "The root helper is not running"
+    _helper.run(dict(
+        op='pwrite', path=path, offset=offset, source=source,
+        source_offset=source_offset, length=length))
+
+
+def unlink(path):
+    """Remove the file at path as root, if it exists."""
+    if _helper is not None:
+        _helper.run(dict(op='unlink', path=path))
+    else:
+        _run_as_root(['rm', '-f', path])
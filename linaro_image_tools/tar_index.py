@@ -0,0 +1,252 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""An index of the members of a tarball, built in a single pass.
+
+Looking up a path in a compressed tarball with TarFile.getmember() means
+decompressing the archive until the member is found, which for a missing
+member is the whole archive.  A TarIndex reads the tarball once and answers
+every later query from memory.  It can also be saved next to the tarball so
+that subsequent runs don't have to read the tarball at all.
+"""
+
+from collections import namedtuple
+import json
+import logging
+import os
+import tarfile
+
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+# The suffix added to the tarball's file name to get its sidecar index.
+INDEX_SUFFIX = '.index'
+# Bump whenever the on-disk layout changes, so that old indexes are ignored.
+INDEX_FORMAT = 2
+
+
+TarIndexEntry = namedtuple(
+    'TarIndexEntry',
+    ['name', 'type', 'size', 'offset', 'offset_data', 'mode', 'linkname'])
+
+
+def _entry_to_json(entry):
+    # Member names are byte strings in no particular encoding; latin-1 maps
+    # every byte to a character, so they survive the trip through JSON.
+    return [entry.name.decode('latin-1'), entry.type, entry.size,
+            entry.offset, entry.offset_data, entry.mode,
+            entry.linkname.decode('latin-1')]
+
+
+def _entry_from_json(data):
+    name, type, size, offset, offset_data, mode, linkname = data
+    return TarIndexEntry(
+        name.encode('latin-1'), str(type), size, offset, offset_data, mode,
+        linkname.encode('latin-1'))
+
+
+def normalize_member_name(name):
+    """Return the canonical form of a member name.
+
+    Tarballs may store the same path as 'binary/etc', './binary/etc' or
+    'binary/etc/', so all lookups go through this function.
+    """
+    name = os.path.normpath(name.lstrip('/'))
+    if name == '.':
+        return ''
+    return name
+
+
+class TarIndex(object):
+    """The members of a tarball, with their types, sizes and offsets.
+
+    Offsets are positions in the uncompressed tar stream, as found in
+    TarInfo.offset (the member's header) and TarInfo.offset_data (its
+    content).
+    """
+
+    def __init__(self, entries, tarball_size=None, tarball_mtime=None):
+        """Create a TarIndex.
+
+        :param entries: an iterable of TarIndexEntry, in archive order.
+        :param tarball_size: the size of the tarball that was indexed.
+        :param tarball_mtime: the mtime of the tarball that was indexed.
+        """
+        self.entries = list(entries)
+        self.tarball_size = tarball_size
+        self.tarball_mtime = tarball_mtime
+        self._by_name = {}
+        # The directories that have no member of their own, only members
+        # below them, mapped to the name tar knows them by.
+        self._implied_dirs = {}
+        for entry in self.entries:
+            # Later members override earlier ones, just like when the
+            # tarball is extracted.
+            name = normalize_member_name(entry.name)
+            self._by_name[name] = entry
+            # Keep whatever comes before the name in the tarball (e.g.
+            # './'), as tar only matches members exactly as stored.
+            prefix = entry.name[:entry.name.find(name.split('/')[0])]
+            parent = os.path.dirname(name)
+            while parent and parent not in self._implied_dirs:
+                self._implied_dirs[parent] = prefix + parent
+                parent = os.path.dirname(parent)
+
+    @classmethod
+    def from_tarball(cls, tarball):
+        """Index the given tarball, reading it exactly once.
+
+        :param tarball: the path to a tarball, compressed or not.
+        """
+        logger.debug("Indexing %s" % tarball)
+        stat = os.stat(tarball)
+        entries = []
+        # Stream mode never seeks backwards, so the tarball is decompressed
+        # a single time no matter how many members it has.
+        tar = tarfile.open(tarball, mode='r|*')
+        try:
+            for tarinfo in tar:
+                entries.append(TarIndexEntry(
+                    tarinfo.name, tarinfo.type, tarinfo.size, tarinfo.offset,
+                    tarinfo.offset_data, tarinfo.mode, tarinfo.linkname))
+        finally:
+            tar.close()
+        return cls(entries, stat.st_size, stat.st_mtime)
+
+    @classmethod
+    def load(cls, index_file):
+        """Load an index previously written with save().
+
+        :raises ValueError: if the file is not an index we understand.
+        """
+        with open(index_file) as fd:
+            data = json.load(fd)
+        if not isinstance(data, dict) or data.get('format') != INDEX_FORMAT:
+            raise ValueError("Unsupported tarball index: %s" % index_file)
+        entries = [_entry_from_json(entry) for entry in data['entries']]
+        return cls(entries, data['tarball_size'], data['tarball_mtime'])
+
+    def save(self, index_file):
+        """Save this index to the given file.
+
+        The index is written to a temporary file first so that a reader
+        never sees a partially written index.
+        """
+        data = {
+            'format': INDEX_FORMAT,
+            'tarball_size': self.tarball_size,
+            'tarball_mtime': self.tarball_mtime,
+            'entries': [_entry_to_json(entry) for entry in self.entries],
+        }
+        tmp_file = '%s.tmp.%d' % (index_file, os.getpid())
+        try:
+            with open(tmp_file, 'w') as fd:
+                json.dump(data, fd)
+            os.rename(tmp_file, index_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+
+    def is_valid_for(self, tarball):
+        """Is this index up to date with the given tarball?"""
+        try:
+            stat = os.stat(tarball)
+        except OSError:
+            return False
+        return (stat.st_size == self.tarball_size and
+                stat.st_mtime == self.tarball_mtime)
+
+    @classmethod
+    def for_tarball(cls, tarball, index_file=None, save=True):
+        """Return an index for the given tarball, reusing a saved one.
+
+        If index_file exists and matches the tarball it is loaded, otherwise
+        the tarball is indexed and, if save is True, the index is written to
+        index_file.  Failing to write the index is not an error, as the
+        tarball may well live in a read-only location.
+
+        :param tarball: the path to the tarball.
+        :param index_file: where the index is stored.  Defaults to the
+            tarball's path plus INDEX_SUFFIX.
+        :param save: whether to save a newly built index.
+        """
+        if index_file is None:
+            index_file = tarball + INDEX_SUFFIX
+        if os.path.exists(index_file):
+            try:
+                index = cls.load(index_file)
+            except (IOError, ValueError, KeyError, TypeError), e:
+                logger.debug("Ignoring unreadable index %s: %s" % (
+                    index_file, e))
+            else:
+                if index.is_valid_for(tarball):
+                    logger.debug("Using tarball index %s" % index_file)
+                    return index
+                logger.debug("Ignoring stale index %s" % index_file)
+        index = cls.from_tarball(tarball)
+        if save:
+            try:
+                index.save(index_file)
+            except (IOError, OSError, ValueError), e:
+                logger.debug("Could not save index %s: %s" % (index_file, e))
+        return index
+
+    def getmember(self, path):
+        """Return the TarIndexEntry for the given path.
+
+        :raises KeyError: if there is no such member.
+        """
+        return self._by_name[normalize_member_name(path)]
+
+    def member_name(self, path):
+        """Return the name of the given path as stored in the tarball.
+
+        Unlike getmember(), this also works for directories that have no
+        member of their own but only members below them.
+
+        :raises KeyError: if there is no such path.
+        """
+        name = normalize_member_name(path)
+        if name in self._by_name:
+            return self._by_name[name].name
+        return self._implied_dirs[name]
+
+    def exists(self, path):
+        """Does the given path exist in the tarball?"""
+        name = normalize_member_name(path)
+        return name in self._by_name or name in self._implied_dirs
+
+    __contains__ = exists
+
+    def isdir(self, path):
+        """Is the given path a directory in the tarball?"""
+        name = normalize_member_name(path)
+        entry = self._by_name.get(name)
+        if entry is None:
+            return name in self._implied_dirs
+        return entry.type == tarfile.DIRTYPE
+
+    def getnames(self):
+        """Return the member names, in archive order."""
+        return [entry.name for entry in self.entries]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,147 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run a set of interdependent tasks, concurrently where possible.
+
+A task is a callable with a name and the names of the tasks it depends on.
+A task only starts once all its dependencies have finished successfully, and
+at most max_workers tasks run at the same time.  Among the tasks that are
+ready to run, the one added first is started first.  With a single worker
+the tasks simply run one after the other in the calling thread, in the order
+they were added (which respects the dependencies, since a task can only
+depend on tasks added before it).
+
+If a task fails, or the caller is interrupted while waiting, no new tasks are
+started, the tasks already running are waited for and the exception is then
+re-raised in the calling thread, with its original traceback.  This way
+callers can rely on their usual cleanup (e.g. atexit handlers) without racing
+against tasks still running.
+"""
+
+import logging
+import sys
+import threading
+
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+
+class TaskGraphError(Exception):
+    """The task graph is not valid."""
+
+
+class TaskGraph(object):
+
+    def __init__(self):
+        self._tasks = []
+        self._deps = {}
+        self._funcs = {}
+        self.results = {}
+
+    def add(self, name, func, depends_on=()):
+        """Add a task to the graph.
+
+        :param name: A unique name for the task.
+        :param func: The callable to run, with no arguments.  Its return
+            value is stored in self.results[name].
+        :param depends_on: The names of the tasks that must finish before
+            this one starts.  They must have been added already.
+        """
+        if name in self._funcs:
+            raise TaskGraphError("Duplicate task: %s" % name)
+        for dep in depends_on:
+            if dep not in self._funcs:
+                raise TaskGraphError(
+                    "Task %s depends on unknown task %s" % (name, dep))
+        self._tasks.append(name)
+        self._deps[name] = set(depends_on)
+        self._funcs[name] = func
+
+    def run(self, max_workers=1):
+        """Run all the tasks, returning the dict of their results.
+
+        :param max_workers: The maximum number of tasks to run at once.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if max_workers == 1:
+            for name in self._tasks:
+                logger.debug("Running task %s" % name)
+                self.results[name] = self._funcs[name]()
+            return self.results
+        condition = threading.Condition()
+        pending = list(self._tasks)
+        running = set()
+        done = set()
+        failures = []
+
+        def worker(name):
+            try:
+                result = self._funcs[name]()
+            except BaseException:
+                exc_info = sys.exc_info()
+                with condition:
+                    failures.append((name, exc_info))
+                    running.discard(name)
+                    condition.notify()
+            else:
+                with condition:
+                    self.results[name] = result
+                    done.add(name)
+                    running.discard(name)
+                    condition.notify()
+
+        with condition:
+            try:
+                while pending or running:
+                    if not failures:
+                        for name in list(pending):
+                            if len(running) >= max_workers:
+                                break
+                            if not self._deps[name].issubset(done):
+                                continue
+                            pending.remove(name)
+                            logger.debug("Starting task %s" % name)
+                            thread = threading.Thread(
+                                target=worker, args=(name,),
+                                name='task-%s' % name)
+                            thread.daemon = True
+                            thread.start()
+                            # The worker can't finish before this since it
+                            # needs the condition's lock.
+                            running.add(name)
+                    if not running:
+                        break
+                    # A timeout makes the wait interruptible by
+                    # KeyboardInterrupt.
+                    condition.wait(1)
+            except BaseException:
+                # Most likely a KeyboardInterrupt.  Don't let the caller's
+                # cleanup start while tasks are still running.
+                exc_info = sys.exc_info()
+                logger.debug("Interrupted, waiting for running tasks %s" %
+                             ", ".join(sorted(running)))
+                while running:
+                    condition.wait(1)
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+        if failures:
+            name, exc_info = failures[0]
+            logger.debug("Task %s failed" % name)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return self.results
@@ -28,6 +28,13 @@ from linaro_image_tools.utils import has_command
 def test_suite():
     module_names = [
         'linaro_image_tools.tests.test_cmd_runner',
+        'linaro_image_tools.tests.test_command_trace',
+        'linaro_image_tools.tests.test_file_hashes',
+        'linaro_image_tools.tests.test_gzip_index',
+        'linaro_image_tools.tests.test_root_helper',
+        'linaro_image_tools.tests.test_tar_index',
+        'linaro_image_tools.tests.test_task_graph',
+        'linaro_image_tools.tests.test_timings',
         'linaro_image_tools.tests.test_utils',
     ]
     # if pyflakes is installed and we're running from a bzr checkout...
@@ -132,6 +132,10 @@ class MockCmdRunnerPopen(object):
     def stdin(self):
         return StringIO()
 
+    @property
+    def stdout(self):
+        return StringIO(self.output_string)
+
 
 class MockCmdRunnerPopenFixture(MockSomethingFixture):
     """A test fixture which mocks cmd_runner.do_run with the given mock.
@@ -150,3 +154,75 @@ class MockCmdRunnerPopenFixture(MockSomethingFixture):
             raise AssertionError(
                 "You should call wait() or communicate() to ensure "
                 "the subprocess is finished before proceeding.")
+
+
+class MockCmdRunnerProcess(object):
+    """A subprocess started by MockCmdRunnerManyPopen."""
+
+    def __init__(self, mock):
+        self.mock = mock
+        self.returncode = 0
+        self.finished = False
+
+    def communicate(self, input=None):
+        self.wait()
+        return self.mock.output_string, ''
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        self.finished = True
+        return self.returncode
+
+    def terminate(self):
+        pass
+
+    @property
+    def stdin(self):
+        return StringIO()
+
+    @property
+    def stdout(self):
+        return StringIO(self.mock.output_string)
+
+
+class MockCmdRunnerManyPopen(MockCmdRunnerPopen):
+    """A mock for cmd_runner.Popen() which allows several children at once.
+
+    Each call returns a MockCmdRunnerProcess of its own, so that tests can
+    make sure every one of them is waited for.
+    """
+
+    def __init__(self, output_string='', assert_child_finished=True):
+        super(MockCmdRunnerManyPopen, self).__init__(
+            output_string, assert_child_finished)
+        self.processes = []
+
+    def __call__(self, cmd, *args, **kwargs):
+        if self.calls is None:
+            self.calls = []
+        if isinstance(cmd, basestring):
+            all_args = [cmd]
+        else:
+            all_args = cmd
+        all_args.extend(args)
+        self.calls.append(all_args)
+        process = MockCmdRunnerProcess(self)
+        self.processes.append(process)
+        return process
+
+    @property
+    def child_finished(self):
+        return all(process.finished for process in self.processes)
+
+
+class MockCmdRunnerManyPopenFixture(MockCmdRunnerPopenFixture):
+    """A test fixture which mocks cmd_runner.Popen with a
+    MockCmdRunnerManyPopen, for code running several commands at once.
+    """
+
+    def __init__(self, output_string='', assert_child_finished=True):
+        MockSomethingFixture.__init__(
+            self, cmd_runner, 'Popen',
+            MockCmdRunnerManyPopen(output_string, assert_child_finished))
@@ -18,10 +18,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import time
 
 from linaro_image_tools import cmd_runner
 from linaro_image_tools.testing import TestCaseWithFixtures
 from linaro_image_tools.tests.fixtures import (
+    CreateTempDirFixture,
+    MockCmdRunnerManyPopenFixture,
     MockCmdRunnerPopenFixture,
     MockSomethingFixture,
 )
@@ -111,3 +114,76 @@ class TestCmdRunner(TestCaseWithFixtures):
         proc = cmd_runner.Popen('true')
         returncode = proc.wait()
         self.assertEqual(0, returncode)
+
+
+class TestRunMany(TestCaseWithFixtures):
+
+    def test_run_many(self):
+        fixture = self.useFixture(MockCmdRunnerManyPopenFixture())
+        self.useFixture(MockSomethingFixture(os, 'getuid', lambda: 1000))
+        returncodes = cmd_runner.run_many(
+            [cmd_runner.Command(['foo', 'bar'], as_root=True), ['baz']])
+        self.assertEqual([0, 0], returncodes)
+        self.assertEqual(
+            ['%s foo bar' % sudo_args, 'baz'],
+            fixture.mock.commands_executed)
+
+    def test_runs_commands_at_the_same_time(self):
+        # Each command waits for the other to have started.
+        tmpdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        a = os.path.join(tmpdir, 'a')
+        b = os.path.join(tmpdir, 'b')
+        script = 'touch %s; while [ ! -e %s ]; do sleep 0.01; done'
+        self.assertEqual(
+            [0, 0],
+            cmd_runner.run_many(
+                [['sh', '-c', script % (a, b)],
+                 ['sh', '-c', script % (b, a)]]))
+
+    def test_max_workers(self):
+        # With a single worker the second command only starts once the
+        # first has finished.
+        tmpdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        a = os.path.join(tmpdir, 'a')
+        cmd_runner.run_many(
+            [['sh', '-c', 'sleep 0.1; touch %s' % a], ['test', '-e', a]],
+            max_workers=1)
+
+    def test_failure_is_raised(self):
+        e = self.assertRaises(
+            cmd_runner.SubcommandNonZeroReturnValue,
+            cmd_runner.run_many, [['true'], ['false']])
+        self.assertEqual(['false'], e.command)
+
+    def test_fail_fast_skips_pending_commands(self):
+        tmpdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        a = os.path.join(tmpdir, 'a')
+        self.assertRaises(
+            cmd_runner.SubcommandNonZeroReturnValue,
+            cmd_runner.run_many, [['false'], ['touch', a]], max_workers=1)
+        self.assertFalse(os.path.exists(a))
+
+    def test_fail_fast_notices_any_failure_first(self):
+        # The failing command is last, but is noticed long before the
+        # first one exits.
+        start = time.time()
+        e = self.assertRaises(
+            cmd_runner.SubcommandNonZeroReturnValue,
+            cmd_runner.run_many, [['sleep', '60'], ['false']])
+        self.assertEqual(['false'], e.command)
+        self.assertTrue(time.time() - start < 30)
+
+    def test_fail_fast_terminates_running_commands(self):
+        self.assertRaises(
+            cmd_runner.SubcommandNonZeroReturnValue,
+            cmd_runner.run_many, [['false'], ['sleep', '60']])
+
+    def test_failures_are_aggregated(self):
+        e = self.assertRaises(
+            cmd_runner.SubcommandsNonZeroReturnValue,
+            cmd_runner.run_many, [['false'], ['true'], ['sh', '-c', 'exit 2']],
+            fail_fast=False)
+        self.assertEqual(
+            [(['false'], 1), (['sh', '-c', 'exit 2'], 2)],
+            [(error.command, error.retval) for error in e.errors])
+        self.assertEqual(1, e.retval)
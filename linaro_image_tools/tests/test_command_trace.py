@@ -0,0 +1,144 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import subprocess
+
+from linaro_image_tools import cmd_runner, command_trace
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import (
+    CreateTempDirFixture,
+    MockSomethingFixture,
+)
+
+
+def make_record(argv, start, end, returncode=0, thread='MainThread',
+                **kwargs):
+    record = dict(
+        argv=argv, sudo=False, chroot=None, thread=thread, start=start,
+        end=end, returncode=returncode, user=None, system=None,
+        stdin_bytes=None, stdout_bytes=None, stderr_bytes=None)
+    record.update(kwargs)
+    return record
+
+
+class TestCommandTrace(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestCommandTrace, self).setUp()
+        command_trace.reset()
+        self.addCleanup(command_trace.reset)
+        self.addCleanup(command_trace.disable)
+
+    def test_nothing_recorded_when_disabled(self):
+        cmd_runner.run(['true']).wait()
+        self.assertEqual([], command_trace.get_records())
+
+    def test_command_is_recorded(self):
+        command_trace.enable()
+        cmd_runner.run(['true']).wait()
+        [record] = command_trace.get_records()
+        self.assertEqual(['true'], record['argv'])
+        self.assertEqual(0, record['returncode'])
+        self.assertFalse(record['sudo'])
+        self.assertEqual(None, record['chroot'])
+        self.assertTrue(record['end'] >= record['start'])
+        self.assertTrue(record['user'] >= 0)
+        self.assertTrue(record['system'] >= 0)
+
+    def test_failed_command_is_recorded(self):
+        command_trace.enable()
+        self.assertRaises(
+            cmd_runner.SubcommandNonZeroReturnValue,
+            cmd_runner.run(['false']).wait)
+        [record] = command_trace.get_records()
+        self.assertEqual(1, record['returncode'])
+
+    def test_pipe_bytes_are_recorded(self):
+        command_trace.enable()
+        proc = cmd_runner.run(
+            ['cat'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        proc.communicate('hello')
+        [record] = command_trace.get_records()
+        self.assertEqual(5, record['stdin_bytes'])
+        self.assertEqual(5, record['stdout_bytes'])
+        self.assertEqual(None, record['stderr_bytes'])
+
+    def test_split_command(self):
+        self.useFixture(MockSomethingFixture(
+            cmd_runner, 'SUDO_ARGS', ['sudo', '-E']))
+        self.assertEqual(
+            (True, '/mnt', ['ls', '-l']),
+            cmd_runner._split_command(
+                ['sudo', '-E', 'chroot', '/mnt', 'ls', '-l']))
+        self.assertEqual(
+            (False, None, ['ls']), cmd_runner._split_command(['ls']))
+
+    def test_to_chrome_trace(self):
+        records = [
+            make_record(['/bin/dd', 'if=x'], 2.0, 2.5, thread='worker'),
+            make_record(['cp', 'a', 'b'], 1.0, 1.25),
+        ]
+        trace = command_trace.to_chrome_trace(records)
+        events = trace['traceEvents']
+        self.assertEqual(
+            [('thread_name', 'M'), ('cp', 'X'), ('thread_name', 'M'),
+             ('dd', 'X')],
+            [(event['name'], event['ph']) for event in events])
+        self.assertEqual(1000000, events[1]['ts'])
+        self.assertEqual(250000, events[1]['dur'])
+        self.assertEqual(['cp', 'a', 'b'], events[1]['args']['argv'])
+        self.assertEqual('worker', events[2]['args']['name'])
+        self.assertNotEqual(events[1]['tid'], events[3]['tid'])
+
+    def test_write_chrome_trace(self):
+        path = os.path.join(
+            self.useFixture(CreateTempDirFixture()).get_temp_dir(),
+            'trace.json')
+        command_trace.write_chrome_trace(
+            path, [make_record(['true'], 1.0, 2.0)])
+        with open(path) as fd:
+            trace = json.load(fd)
+        self.assertEqual(
+            ['thread_name', 'true'],
+            [event['name'] for event in trace['traceEvents']])
+
+    def test_summarize(self):
+        records = [
+            make_record(['cp'], 0.0, 1.0, user=0.5, stdout_bytes=10),
+            make_record(['cp'], 1.0, 2.0, returncode=1, user=0.25),
+            make_record(['mkfs.ext4'], 2.0, 5.0, system=1.0),
+        ]
+        [mkfs, cp] = command_trace.summarize(records)
+        self.assertEqual(
+            dict(name='mkfs.ext4', count=1, failures=0, wall=3.0, user=0.0,
+                 system=1.0, pipe_bytes=0),
+            mkfs)
+        self.assertEqual(
+            dict(name='cp', count=2, failures=1, wall=2.0, user=0.75,
+                 system=0.0, pipe_bytes=10),
+            cp)
+
+    def test_format_summary(self):
+        lines = command_trace.format_summary(
+            [make_record(['cp'], 0.0, 1.0)]).splitlines()
+        self.assertEqual(
+            ['Command', 'Runs', 'Failed', 'Wall', 'User', 'System', 'Piped'],
+            lines[0].split())
+        self.assertEqual(
+            ['cp', '1', '0', '1.0s', '0.0s', '0.0s', '0B'], lines[1].split())
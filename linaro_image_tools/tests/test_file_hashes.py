@@ -0,0 +1,140 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+
+from linaro_image_tools import file_hashes
+from linaro_image_tools.file_hashes import (
+    HashCache,
+    InvalidHashFile,
+    check_hash_files,
+    get_expected_digest,
+    parse_hash_file,
+)
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import (
+    CreateTempDirFixture,
+    MockSomethingFixture,
+)
+
+
+class TestFileHashes(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestFileHashes, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+
+    def make_file(self, name, contents):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as fd:
+            fd.write(contents)
+        return path
+
+    def count_hashed_files(self):
+        hashed = []
+        orig_hash_file = file_hashes.hash_file
+
+        def hash_file(path, algorithm):
+            hashed.append(path)
+            return orig_hash_file(path, algorithm)
+        self.useFixture(MockSomethingFixture(
+            file_hashes, 'hash_file', hash_file))
+        return hashed
+
+    def test_parse_hash_file(self):
+        sha1 = hashlib.sha1('a').hexdigest()
+        sha256 = hashlib.sha256('b').hexdigest()
+        hash_file = self.make_file(
+            'SHA', '%s  a.tar.gz\n\n%s *b.tar.gz\n' % (sha1, sha256))
+        self.assertEqual(
+            [('a.tar.gz', 'sha1', sha1), ('b.tar.gz', 'sha256', sha256)],
+            parse_hash_file(hash_file))
+
+    def test_parse_hash_file_unknown_digest_length(self):
+        hash_file = self.make_file('SHA', 'abcd  a.tar.gz\n')
+        self.assertRaises(InvalidHashFile, parse_hash_file, hash_file)
+
+    def test_check_hash_files(self):
+        self.make_file('good', 'good')
+        self.make_file('bad', 'bad')
+        hash_file = self.make_file(
+            'SHA256SUMS', '%s  good\n%s  bad\n%s  missing\n' % (
+                hashlib.sha256('good').hexdigest(),
+                hashlib.sha256('not bad').hexdigest(),
+                hashlib.sha256('missing').hexdigest()))
+        self.assertEqual(['good'], check_hash_files([hash_file]))
+
+    def test_hash_cache_reuses_digests(self):
+        path = self.make_file('binary.tar.gz', 'contents')
+        cache_file = os.path.join(self.tempdir, 'cache', 'hashes.json')
+        cache = HashCache(cache_file)
+        cache.get_digest(path, 'sha1')
+        cache.save()
+        hashed = self.count_hashed_files()
+        self.assertEqual(
+            hashlib.sha1('contents').hexdigest(),
+            HashCache(cache_file).get_digest(path, 'sha1'))
+        self.assertEqual([], hashed)
+
+    def test_hash_cache_notices_changes(self):
+        path = self.make_file('binary.tar.gz', 'contents')
+        cache = HashCache()
+        cache.get_digest(path, 'sha1')
+        self.make_file('binary.tar.gz', 'other contents')
+        self.assertEqual(
+            hashlib.sha1('other contents').hexdigest(),
+            cache.get_digest(path, 'sha1'))
+
+    def test_hash_cache_save_drops_stale_entries(self):
+        path = self.make_file('binary.tar.gz', 'contents')
+        cache_file = os.path.join(self.tempdir, 'hashes.json')
+        cache = HashCache(cache_file)
+        cache.get_digest(path, 'sha1')
+        os.remove(path)
+        cache.save()
+        self.assertEqual({}, HashCache(cache_file)._entries)
+
+    def test_check_hash_files_ignores_unwritable_cache(self):
+        self.make_file('good', 'good')
+        hash_file = self.make_file(
+            'SHA256SUMS', '%s  good\n' % hashlib.sha256('good').hexdigest())
+        # The cache file can't be created under a regular file.
+        not_a_dir = self.make_file('not-a-dir', '')
+        cache = HashCache(os.path.join(not_a_dir, 'cache', 'hashes.json'))
+        self.assertEqual(['good'], check_hash_files([hash_file], cache))
+        cache = HashCache(os.path.join(not_a_dir, 'hashes.json'))
+        self.assertEqual(['good'], check_hash_files([hash_file], cache))
+
+    def test_check_hash_files_skip(self):
+        self.make_file('binary.tar.gz', 'binary')
+        hash_file = self.make_file('SHA1SUMS', '%s  binary.tar.gz\n' % (
+            hashlib.sha1('binary').hexdigest()))
+        hashed = self.count_hashed_files()
+        self.assertEqual(
+            [], check_hash_files([hash_file], skip=['binary.tar.gz']))
+        self.assertEqual([], hashed)
+
+    def test_get_expected_digest(self):
+        sha1 = hashlib.sha1('a').hexdigest()
+        hash_files = [
+            os.path.join(self.tempdir, 'missing'),
+            self.make_file('SHA1SUMS', '%s  a.tar.gz\n' % sha1)]
+        self.assertEqual(
+            ('sha1', sha1),
+            get_expected_digest(hash_files, '/some/where/a.tar.gz'))
+        self.assertEqual(None, get_expected_digest(hash_files, 'b.tar.gz'))
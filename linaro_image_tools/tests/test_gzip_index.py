@@ -0,0 +1,184 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import hashlib
+import os
+import tarfile
+from StringIO import StringIO
+
+from testtools import skipUnless
+
+from linaro_image_tools import gzip_index
+from linaro_image_tools.gzip_index import (
+    INDEX_SUFFIX,
+    GzipIndex,
+    GzipIndexError,
+    IndexedGzipFile,
+    open_tarfile,
+)
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import (
+    CreateTempDirFixture,
+    MockSomethingFixture,
+)
+
+
+def make_data(seed, size):
+    # Not too compressible, so that the tarball has many deflate blocks.
+    return ''.join(
+        hashlib.md5('%d-%d' % (seed, i)).hexdigest()
+        for i in xrange(size / 32))
+
+
+@skipUnless(gzip_index.available(), "libz can't be loaded")
+class TestGzipIndex(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestGzipIndex, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        self.tarball = os.path.join(self.tempdir, 'hwpack.tar.gz')
+        self.contents = {}
+        tar = tarfile.open(self.tarball, 'w:gz')
+        try:
+            for i in range(20):
+                name = 'pkgs/package%d.deb' % i
+                data = make_data(i, 50000)
+                self.contents[name] = data
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(data)
+                tar.addfile(tarinfo, StringIO(data))
+        finally:
+            tar.close()
+
+    def test_from_tarball(self):
+        index = GzipIndex.from_tarball(self.tarball, span=64 * 1024)
+        self.assertTrue(len(index.checkpoints) > 5)
+        # The first checkpoint is at the start of the deflate stream.
+        self.assertEqual(0, index.checkpoints[0][0])
+        self.assertEqual(
+            sorted(self.contents),
+            sorted(tarinfo.name for tarinfo in index.get_tarinfos()))
+
+    def test_random_access(self):
+        index = GzipIndex.from_tarball(self.tarball, span=64 * 1024)
+        with open(self.tarball, 'rb') as fd:
+            expected = gzip.GzipFile(fileobj=fd).read()
+        fileobj = IndexedGzipFile(self.tarball, index)
+        self.addCleanup(fileobj.close)
+        for offset in (600000, 10, 300000, 300100, len(expected) - 5):
+            fileobj.seek(offset)
+            self.assertEqual(
+                expected[offset:offset + 5000], fileobj.read(5000))
+            self.assertEqual(min(offset + 5000, len(expected)),
+                             fileobj.tell())
+
+    def test_open_tarfile(self):
+        tar = open_tarfile(self.tarball)
+        self.addCleanup(tar.close)
+        self.assertIsInstance(tar.fileobj, IndexedGzipFile)
+        self.assertEqual(sorted(self.contents), sorted(tar.getnames()))
+        for name in reversed(sorted(self.contents)):
+            self.assertEqual(
+                self.contents[name], tar.extractfile(name).read())
+
+    def test_extract(self):
+        tar = open_tarfile(self.tarball)
+        self.addCleanup(tar.close)
+        tar.extract('pkgs/package7.deb', self.tempdir)
+        with open(os.path.join(self.tempdir, 'pkgs/package7.deb')) as fd:
+            self.assertEqual(self.contents['pkgs/package7.deb'], fd.read())
+
+    def test_index_is_saved_and_reused(self):
+        open_tarfile(self.tarball).close()
+        self.assertTrue(os.path.exists(self.tarball + INDEX_SUFFIX))
+
+        def fail(tarball):
+            raise AssertionError("The tarball should not be indexed again")
+        self.useFixture(MockSomethingFixture(
+            GzipIndex, 'from_tarball', classmethod(fail)))
+        tar = open_tarfile(self.tarball)
+        self.addCleanup(tar.close)
+        self.assertEqual(
+            self.contents['pkgs/package3.deb'],
+            tar.extractfile('pkgs/package3.deb').read())
+
+    def test_stale_index_is_rebuilt(self):
+        index_file = self.tarball + INDEX_SUFFIX
+        GzipIndex([], [], 1, 1).save(index_file)
+        index = GzipIndex.for_tarball(self.tarball)
+        self.assertEqual(len(self.contents), len(index.members))
+        self.assertTrue(GzipIndex.load(index_file).is_valid_for(self.tarball))
+
+    def test_load_round_trip(self):
+        index_file = os.path.join(self.tempdir, 'index')
+        index = GzipIndex.from_tarball(self.tarball, span=64 * 1024)
+        index.save(index_file)
+        loaded = GzipIndex.load(index_file)
+        self.assertEqual(index.checkpoints, loaded.checkpoints)
+        self.assertEqual(len(index.members), len(loaded.members))
+
+    def test_non_utf8_names(self):
+        tarball = os.path.join(self.tempdir, 'latin1.tar.gz')
+        tar = tarfile.open(tarball, 'w:gz')
+        try:
+            tarinfo = tarfile.TarInfo('pkgs/caf\xe9.deb')
+            tarinfo.size = 4
+            tar.addfile(tarinfo, StringIO('caf\xe9'))
+        finally:
+            tar.close()
+        open_tarfile(tarball).close()
+        tar = open_tarfile(tarball)
+        self.addCleanup(tar.close)
+        self.assertIsInstance(tar.fileobj, IndexedGzipFile)
+        self.assertEqual(['pkgs/caf\xe9.deb'], tar.getnames())
+        self.assertEqual(
+            'caf\xe9', tar.extractfile('pkgs/caf\xe9.deb').read())
+
+    def test_falls_back_when_index_fails(self):
+        def fail(tarball, index_file=None, save=True):
+            raise ValueError("Broken")
+        self.useFixture(MockSomethingFixture(
+            GzipIndex, 'for_tarball', classmethod(fail)))
+        tar = open_tarfile(self.tarball)
+        self.addCleanup(tar.close)
+        self.assertNotIsInstance(tar.fileobj, IndexedGzipFile)
+        self.assertEqual(sorted(self.contents), sorted(tar.getnames()))
+
+    def test_multi_member_gzip_is_not_indexed(self):
+        # Split the tar stream over two gzip members.
+        with open(self.tarball, 'rb') as fd:
+            data = gzip.GzipFile(fileobj=fd).read()
+        with open(self.tarball, 'wb') as fd:
+            for part in (data[:len(data) / 2], data[len(data) / 2:]):
+                member = gzip.GzipFile(fileobj=fd, mode='wb')
+                member.write(part)
+                member.close()
+        self.assertRaises(
+            GzipIndexError, GzipIndex.from_tarball, self.tarball)
+        tar = open_tarfile(self.tarball)
+        self.addCleanup(tar.close)
+        self.assertNotIsInstance(tar.fileobj, IndexedGzipFile)
+        self.assertEqual(sorted(self.contents), sorted(tar.getnames()))
+
+    def test_falls_back_without_libz(self):
+        self.useFixture(MockSomethingFixture(
+            gzip_index, 'available', lambda: False))
+        tar = open_tarfile(self.tarball)
+        self.addCleanup(tar.close)
+        self.assertNotIsInstance(tar.fileobj, IndexedGzipFile)
+        self.assertFalse(os.path.exists(self.tarball + INDEX_SUFFIX))
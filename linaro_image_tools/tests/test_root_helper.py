@@ -0,0 +1,197 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import errno
+import json
+import os
+import tempfile
+from StringIO import StringIO
+
+from linaro_image_tools import cmd_runner, root_helper
+from linaro_image_tools.root_helper import (
+    RootHelper,
+    RootHelperError,
+    run_operations,
+    serve,
+)
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import (
+    CreateTempDirFixture,
+    MockCmdRunnerPopenFixture,
+    MockSomethingFixture,
+)
+
+
+sudo_args = " ".join(cmd_runner.SUDO_ARGS)
+
+
+class TestRunOperations(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestRunOperations, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+
+    def make_file(self, name, contents):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'w') as fd:
+            fd.write(contents)
+        return path
+
+    def test_copy_into_directory(self):
+        src = self.make_file('uImage', 'kernel')
+        boot_dir = os.path.join(self.tempdir, 'boot')
+        results = run_operations([
+            dict(op='mkdir', path=boot_dir),
+            dict(op='copy', src=src, dst=boot_dir)])
+        self.assertEqual([dict(ok=True), dict(ok=True)], results)
+        self.assertEqual(
+            'kernel', open(os.path.join(boot_dir, 'uImage')).read())
+
+    def test_rename_and_unlink(self):
+        src = self.make_file('fstab', 'data')
+        dst = os.path.join(self.tempdir, 'fstab.orig')
+        run_operations([
+            dict(op='rename', src=src, dst=dst),
+            dict(op='unlink', path=os.path.join(self.tempdir, 'missing'))])
+        self.assertEqual(['fstab.orig'], os.listdir(self.tempdir))
+
+    def test_rename_directory_across_filesystems(self):
+        src = os.path.join(self.tempdir, 'boot')
+        os.mkdir(src)
+        self.make_file('boot/uImage', 'kernel')
+        dst = os.path.join(self.tempdir, 'boot.orig')
+        rename = os.rename
+
+        def cross_device_rename(src, dst):
+            if os.path.basename(src) == 'boot':
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return rename(src, dst)
+        self.useFixture(MockSomethingFixture(
+            os, 'rename', cross_device_rename))
+        results = run_operations([dict(op='rename', src=src, dst=dst)])
+        self.assertEqual([dict(ok=True)], results)
+        self.assertFalse(os.path.exists(src))
+        self.assertEqual(
+            'kernel', open(os.path.join(dst, 'uImage')).read())
+
+    def test_write(self):
+        path = os.path.join(self.tempdir, 'interfaces')
+        run_operations(
+            [dict(op='write', path=path, data=base64.b64encode('auto lo'))])
+        self.assertEqual('auto lo', open(path).read())
+
+    def test_write_replaces_file_like_without_helper(self):
+        # Run the commands as the current user rather than with sudo.
+        self.useFixture(MockSomethingFixture(cmd_runner, 'SUDO_ARGS', []))
+        self.useFixture(MockSomethingFixture(root_helper, '_helper', None))
+        with_helper = self.make_file('with-helper', 'old')
+        without_helper = self.make_file('without-helper', 'old')
+        for path in (with_helper, without_helper):
+            os.chmod(path, 0644)
+        run_operations([dict(
+            op='write', path=with_helper, data=base64.b64encode('new'))])
+        root_helper.write(without_helper, 'new')
+        self.assertEqual('new', open(with_helper).read())
+        self.assertEqual(0600, os.stat(with_helper).st_mode & 0777)
+        self.assertEqual(
+            os.stat(without_helper).st_mode, os.stat(with_helper).st_mode)
+        self.assertEqual([], [name for name in os.listdir(self.tempdir)
+                              if name.startswith('tmp')])
+
+    def test_pwrite(self):
+        image = self.make_file('sd.img', '0123456789')
+        source = self.make_file('u-boot.bin', 'abcdef')
+        run_operations([dict(
+            op='pwrite', path=image, offset=2, source=source,
+            source_offset=1, length=3)])
+        self.assertEqual('01bcd56789', open(image).read())
+
+    def test_stops_at_first_failure(self):
+        missing = os.path.join(self.tempdir, 'missing')
+        results = run_operations([
+            dict(op='copy', src=missing, dst=self.tempdir),
+            dict(op='mkdir', path=os.path.join(self.tempdir, 'new'))])
+        [result] = results
+        self.assertFalse(result['ok'])
+        self.assertEqual(2, result['errno'])
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, 'new')))
+
+    def test_serve(self):
+        path = os.path.join(self.tempdir, 'dir')
+        stdin = StringIO(
+            json.dumps(dict(ops=[dict(op='mkdir', path=path)])) + '\n')
+        stdout = StringIO()
+        serve(stdin, stdout)
+        self.assertEqual(
+            dict(results=[dict(ok=True)]), json.loads(stdout.getvalue()))
+        self.assertTrue(os.path.isdir(path))
+
+
+class TestRootHelper(TestCaseWithFixtures):
+
+    def test_helper_process(self):
+        # Run the helper as the current user rather than with sudo.
+        self.useFixture(MockSomethingFixture(cmd_runner, 'SUDO_ARGS', []))
+        tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        helper = RootHelper()
+        helper.start()
+        self.addCleanup(helper.stop)
+        path = os.path.join(tempdir, 'a', 'b')
+        helper.run(dict(op='mkdir', path=path))
+        self.assertTrue(os.path.isdir(path))
+        self.assertRaises(
+            RootHelperError, helper.run,
+            dict(op='copy', src=os.path.join(tempdir, 'missing'), dst=path))
+
+    def test_functions_use_helper(self):
+        ops = []
+
+        class FakeHelper(object):
+            def run(self, *args):
+                ops.extend(args)
+        self.useFixture(MockSomethingFixture(
+            root_helper, '_helper', FakeHelper()))
+        fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        root_helper.copy('uImage', '/boot', verbose=True)
+        root_helper.unlink('/boot/uImage')
+        self.assertEqual(
+            [dict(op='copy', src='uImage', dst='/boot'),
+             dict(op='unlink', path='/boot/uImage')],
+            ops)
+        self.assertEqual(None, fixture.mock.calls)
+
+    def test_functions_without_helper(self):
+        fixture = self.useFixture(MockCmdRunnerPopenFixture())
+        tmpfile = os.path.join(
+            self.useFixture(CreateTempDirFixture()).get_temp_dir(), 'random')
+        self.useFixture(MockSomethingFixture(
+            tempfile, 'mkstemp', lambda: (None, tmpfile)))
+        root_helper.copy('uImage', '/boot', verbose=True)
+        root_helper.copy('uImage', '/boot')
+        root_helper.mkdir('/boot/dtbs')
+        root_helper.rename('/etc/fstab', '/tmp')
+        root_helper.unlink('/boot/uImage')
+        root_helper.write('/etc/fstab', 'data')
+        self.assertEqual(
+            ['%s cp -v uImage /boot' % sudo_args,
+             '%s cp uImage /boot' % sudo_args,
+             '%s mkdir -p /boot/dtbs' % sudo_args,
+             '%s mv -f /etc/fstab /tmp' % sudo_args,
+             '%s rm -f /boot/uImage' % sudo_args,
+             '%s mv -f %s /etc/fstab' % (sudo_args, tmpfile)],
+            fixture.mock.commands_executed)
@@ -0,0 +1,174 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tarfile
+from StringIO import StringIO
+
+from linaro_image_tools.tar_index import (
+    INDEX_SUFFIX,
+    TarIndex,
+    normalize_member_name,
+)
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import CreateTempDirFixture
+
+
+class TestNormalizeMemberName(TestCaseWithFixtures):
+
+    def test_strips_dot_prefix(self):
+        self.assertEqual('binary/etc', normalize_member_name('./binary/etc'))
+
+    def test_strips_trailing_slash(self):
+        self.assertEqual('binary/etc', normalize_member_name('binary/etc/'))
+
+    def test_root(self):
+        self.assertEqual('', normalize_member_name('./'))
+
+
+class TestTarIndex(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestTarIndex, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        self.tarball = os.path.join(self.tempdir, 'binary.tar.gz')
+        tar = tarfile.open(self.tarball, 'w:gz')
+        try:
+            tarinfo = tarfile.TarInfo('./binary/etc')
+            tarinfo.type = tarfile.DIRTYPE
+            tar.addfile(tarinfo)
+            data = 'squeeze\n'
+            tarinfo = tarfile.TarInfo('./binary/etc/debian_version')
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, StringIO(data))
+        finally:
+            tar.close()
+
+    def test_from_tarball(self):
+        index = TarIndex.from_tarball(self.tarball)
+        self.assertEqual(
+            ['./binary/etc', './binary/etc/debian_version'],
+            index.getnames())
+
+    def test_exists(self):
+        index = TarIndex.from_tarball(self.tarball)
+        self.assertTrue(index.exists('binary/etc/debian_version'))
+        self.assertTrue('binary/etc' in index)
+        self.assertFalse(index.exists('binary/boot/filesystem.dir'))
+
+    def test_getmember(self):
+        index = TarIndex.from_tarball(self.tarball)
+        entry = index.getmember('binary/etc/debian_version')
+        self.assertEqual(8, entry.size)
+        self.assertEqual(tarfile.REGTYPE, entry.type)
+        self.assertRaises(KeyError, index.getmember, 'binary/missing')
+
+    def test_isdir(self):
+        index = TarIndex.from_tarball(self.tarball)
+        self.assertTrue(index.isdir('binary/etc'))
+        self.assertFalse(index.isdir('binary/etc/debian_version'))
+
+    def test_implied_directories(self):
+        # The tarball has no member for 'binary', only for what's below it.
+        index = TarIndex.from_tarball(self.tarball)
+        self.assertTrue(index.exists('binary'))
+        self.assertTrue(index.isdir('binary'))
+        self.assertRaises(KeyError, index.getmember, 'binary')
+
+    def test_member_name(self):
+        index = TarIndex.from_tarball(self.tarball)
+        self.assertEqual('./binary/etc', index.member_name('binary/etc'))
+        self.assertEqual('./binary', index.member_name('binary'))
+        self.assertRaises(KeyError, index.member_name, 'binary/missing')
+
+    def test_member_name_without_directory_members(self):
+        tarball = os.path.join(self.tempdir, 'files-only.tar')
+        tar = tarfile.open(tarball, 'w')
+        try:
+            tarinfo = tarfile.TarInfo('binary/etc/debian_version')
+            tar.addfile(tarinfo, StringIO(''))
+        finally:
+            tar.close()
+        index = TarIndex.from_tarball(tarball)
+        self.assertTrue(index.exists('binary/etc'))
+        self.assertFalse(index.isdir('binary/etc/debian_version'))
+        self.assertEqual('binary', index.member_name('./binary'))
+        self.assertEqual('binary/etc', index.member_name('binary/etc'))
+
+    def test_offsets_point_at_member_data(self):
+        index = TarIndex.from_tarball(self.tarball)
+        entry = index.getmember('binary/etc/debian_version')
+        tar = tarfile.open(self.tarball, 'r:gz')
+        try:
+            tarinfo = tar.getmember('./binary/etc/debian_version')
+        finally:
+            tar.close()
+        self.assertEqual(tarinfo.offset_data, entry.offset_data)
+
+    def test_save_and_load(self):
+        index_file = os.path.join(self.tempdir, 'index')
+        index = TarIndex.from_tarball(self.tarball)
+        index.save(index_file)
+        loaded = TarIndex.load(index_file)
+        self.assertEqual(index.entries, loaded.entries)
+        self.assertTrue(loaded.is_valid_for(self.tarball))
+
+    def test_save_and_load_non_utf8_names(self):
+        tarball = os.path.join(self.tempdir, 'latin1.tar')
+        tar = tarfile.open(tarball, 'w')
+        try:
+            tarinfo = tarfile.TarInfo('binary/etc/caf\xe9')
+            tar.addfile(tarinfo, StringIO(''))
+            tarinfo = tarfile.TarInfo('binary/etc/link')
+            tarinfo.type = tarfile.SYMTYPE
+            tarinfo.linkname = 'caf\xe9'
+            tar.addfile(tarinfo)
+        finally:
+            tar.close()
+        TarIndex.for_tarball(tarball)
+        loaded = TarIndex.load(tarball + INDEX_SUFFIX)
+        self.assertEqual(
+            ['binary/etc/caf\xe9', 'binary/etc/link'], loaded.getnames())
+        self.assertTrue(loaded.exists('binary/etc/caf\xe9'))
+        self.assertEqual(
+            'caf\xe9', loaded.getmember('binary/etc/link').linkname)
+
+    def test_load_rejects_unknown_format(self):
+        index_file = os.path.join(self.tempdir, 'index')
+        with open(index_file, 'w') as fd:
+            fd.write('{"format": 0}')
+        self.assertRaises(ValueError, TarIndex.load, index_file)
+
+    def test_for_tarball_saves_sidecar(self):
+        TarIndex.for_tarball(self.tarball)
+        self.assertTrue(os.path.exists(self.tarball + INDEX_SUFFIX))
+
+    def test_for_tarball_reuses_sidecar(self):
+        TarIndex.for_tarball(self.tarball)
+        # Make sure the tarball is not read again.
+        self.addCleanup(setattr, TarIndex, 'from_tarball',
+                        TarIndex.__dict__['from_tarball'])
+        TarIndex.from_tarball = classmethod(lambda cls, tarball: 1 / 0)
+        index = TarIndex.for_tarball(self.tarball)
+        self.assertTrue(index.exists('binary/etc'))
+
+    def test_for_tarball_ignores_stale_sidecar(self):
+        index_file = self.tarball + INDEX_SUFFIX
+        TarIndex([], 0, 0).save(index_file)
+        index = TarIndex.for_tarball(self.tarball)
+        self.assertTrue(index.exists('binary/etc'))
+        self.assertTrue(TarIndex.load(index_file).is_valid_for(self.tarball))
@@ -0,0 +1,170 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from linaro_image_tools.task_graph import (
+    TaskGraph,
+    TaskGraphError,
+)
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import MockSomethingFixture
+
+
+class TestTaskGraph(TestCaseWithFixtures):
+
+    def test_runs_in_insertion_order_with_one_worker(self):
+        order = []
+        graph = TaskGraph()
+        graph.add('a', lambda: order.append('a'))
+        graph.add('b', lambda: order.append('b'))
+        graph.add('c', lambda: order.append('c'), depends_on=['a'])
+        graph.run()
+        self.assertEqual(['a', 'b', 'c'], order)
+
+    def test_one_worker_runs_in_calling_thread(self):
+        graph = TaskGraph()
+        graph.add('a', threading.current_thread)
+        graph.add('b', threading.current_thread, depends_on=['a'])
+        current = threading.current_thread()
+        self.assertEqual({'a': current, 'b': current}, graph.run())
+
+    def test_results(self):
+        graph = TaskGraph()
+        graph.add('a', lambda: 1)
+        graph.add('b', lambda: 2, depends_on=['a'])
+        self.assertEqual({'a': 1, 'b': 2}, graph.run())
+
+    def test_dependencies_finish_first(self):
+        order = []
+        graph = TaskGraph()
+        graph.add('a', lambda: order.append('a'))
+        graph.add('b', lambda: order.append('b'), depends_on=['a'])
+        graph.add('c', lambda: order.append('c'), depends_on=['b'])
+        graph.run(max_workers=3)
+        self.assertEqual(['a', 'b', 'c'], order)
+
+    def test_independent_tasks_run_concurrently(self):
+        # Each task waits for the other to start, so this would time out if
+        # they were run one after the other.
+        a_started = threading.Event()
+        b_started = threading.Event()
+
+        def a():
+            a_started.set()
+            return b_started.wait(5)
+
+        def b():
+            b_started.set()
+            return a_started.wait(5)
+
+        graph = TaskGraph()
+        graph.add('a', a)
+        graph.add('b', b)
+        self.assertEqual({'a': True, 'b': True}, graph.run(max_workers=2))
+
+    def test_failure_is_reraised(self):
+        def fail():
+            raise RuntimeError('boom')
+
+        graph = TaskGraph()
+        graph.add('a', fail)
+        self.assertRaises(RuntimeError, graph.run)
+
+    def test_failure_stops_dependent_tasks(self):
+        order = []
+
+        def fail():
+            raise RuntimeError('boom')
+
+        graph = TaskGraph()
+        graph.add('a', fail)
+        graph.add('b', lambda: order.append('b'), depends_on=['a'])
+        graph.add('c', lambda: order.append('c'))
+        self.assertRaises(RuntimeError, graph.run)
+        self.assertEqual([], order)
+
+    def test_failure_waits_for_running_tasks(self):
+        order = []
+        a_started = threading.Event()
+
+        def fail():
+            a_started.wait(5)
+            raise RuntimeError('boom')
+
+        def slow():
+            a_started.set()
+            threading.Event().wait(0.2)
+            order.append('slow')
+
+        graph = TaskGraph()
+        graph.add('fail', fail)
+        graph.add('slow', slow)
+        self.assertRaises(RuntimeError, graph.run, max_workers=2)
+        self.assertEqual(['slow'], order)
+
+    def test_interrupt_waits_for_running_tasks(self):
+        order = []
+        started = threading.Event()
+
+        class InterruptedCondition(threading._Condition):
+            interrupted = False
+
+            def wait(self, timeout=None):
+                if not self.interrupted:
+                    self.interrupted = True
+                    started.wait(5)
+                    raise KeyboardInterrupt()
+                return threading._Condition.wait(self, timeout)
+
+        def slow():
+            started.set()
+            threading.Event().wait(0.2)
+            order.append('slow')
+
+        # Only the graph's own condition is interrupted, not the ones
+        # threading uses internally.
+        conditions = [InterruptedCondition()]
+        condition_factory = threading.Condition
+        self.useFixture(MockSomethingFixture(
+            threading, 'Condition',
+            lambda *args: (conditions.pop() if conditions
+                           else condition_factory(*args))))
+        graph = TaskGraph()
+        graph.add('slow', slow)
+        graph.add('later', lambda: order.append('later'),
+                  depends_on=['slow'])
+        self.assertRaises(KeyboardInterrupt, graph.run, max_workers=2)
+        self.assertEqual(['slow'], order)
+
+    def test_system_exit_is_reraised(self):
+        def exit():
+            raise SystemExit(1)
+
+        graph = TaskGraph()
+        graph.add('a', exit)
+        self.assertRaises(SystemExit, graph.run)
+
+    def test_unknown_dependency(self):
+        graph = TaskGraph()
+        self.assertRaises(
+            TaskGraphError, graph.add, 'a', lambda: None, depends_on=['b'])
+
+    def test_duplicate_task(self):
+        graph = TaskGraph()
+        graph.add('a', lambda: None)
+        self.assertRaises(TaskGraphError, graph.add, 'a', lambda: None)
@@ -0,0 +1,88 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+from linaro_image_tools import timings
+from linaro_image_tools.testing import TestCaseWithFixtures
+from linaro_image_tools.tests.fixtures import (
+    CreateTempDirFixture,
+    MockSomethingFixture,
+)
+
+
+class TestTimings(TestCaseWithFixtures):
+
+    def setUp(self):
+        super(TestTimings, self).setUp()
+        timings.reset()
+        self.addCleanup(timings.reset)
+
+    def test_phase_is_recorded(self):
+        with timings.phase('unpack'):
+            pass
+        [record] = timings.get_phases()
+        self.assertEqual('unpack', record['name'])
+        self.assertTrue(record['wall'] >= 0)
+        self.assertTrue(record['maxrss_kb'] > 0)
+
+    def test_phase_is_recorded_on_failure(self):
+        def fail():
+            with timings.phase('fail'):
+                raise RuntimeError('boom')
+        self.assertRaises(RuntimeError, fail)
+        self.assertEqual(
+            ['fail'], [record['name'] for record in timings.get_phases()])
+
+    def test_timed(self):
+        func = timings.timed('add', lambda a, b: a + b)
+        self.assertEqual(3, func(1, 2))
+        self.assertEqual(
+            ['add'], [record['name'] for record in timings.get_phases()])
+
+    def test_missing_proc_io(self):
+        self.useFixture(MockSomethingFixture(
+            timings, 'PROC_IO', '/nonexistent/io'))
+        with timings.phase('noio'):
+            pass
+        [record] = timings.get_phases()
+        self.assertEqual(None, record['read_bytes'])
+        self.assertEqual(None, record['write_bytes'])
+
+    def test_write_report(self):
+        with timings.phase('partition'):
+            pass
+        tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        path = os.path.join(tempdir, 'timings.json')
+        timings.write_report(path)
+        with open(path) as fd:
+            report = json.load(fd)
+        self.assertEqual(
+            ['partition'], [record['name'] for record in report['phases']])
+
+    def test_format_report(self):
+        record = dict(
+            name='rootfs', wall=12.34, user=1.0, system=2.0,
+            maxrss_kb=2048, children_maxrss_kb=1, read_bytes=None,
+            write_bytes=3 * 1024 * 1024)
+        lines = timings.format_report([record]).splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].startswith('Phase'))
+        self.assertEqual(
+            ['rootfs', '12.3s', '1.0s', '2.0s', '2M', '1K', '-', '3M'],
+            lines[1].split())
@@ -17,6 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
 import stat
 import subprocess
@@ -78,32 +79,6 @@ class TestVerifyFileIntegrity(TestCaseWithFixtures):
 
     filenames_in_shafile = ['verified-file1', 'verified-file2']
 
-    class MockCmdRunnerPopen(object):
-        def __call__(self, cmd, *args, **kwargs):
-            self.returncode = 0
-            return self
-
-        def communicate(self, input=None):
-            self.wait()
-            return ': OK\n'.join(
-                TestVerifyFileIntegrity.filenames_in_shafile) + ': OK\n', ''
-
-        def wait(self):
-            return self.returncode
-
-    class MockCmdRunnerPopen_sha1sum_fail(object):
-        def __call__(self, cmd, *args, **kwargs):
-            self.returncode = 0
-            return self
-
-        def communicate(self, input=None):
-            self.wait()
-            return ': ERROR\n'.join(
-                TestVerifyFileIntegrity.filenames_in_shafile) + ': ERROR\n', ''
-
-        def wait(self):
-            return self.returncode
-
     class MockCmdRunnerPopen_wait_fails(object):
         def __call__(self, cmd, *args, **kwargs):
             self.returncode = 0
@@ -111,13 +86,10 @@ class TestVerifyFileIntegrity(TestCaseWithFixtures):
 
         def communicate(self, input=None):
             self.wait()
-            return ': OK\n'.join(
-                TestVerifyFileIntegrity.filenames_in_shafile) + ': OK\n', ''
+            return '', ''
 
         def wait(self):
-            stdout = ': OK\n'.join(
-                TestVerifyFileIntegrity.filenames_in_shafile) + ': OK\n'
-            raise cmd_runner.SubcommandNonZeroReturnValue([], 1, stdout, None)
+            raise cmd_runner.SubcommandNonZeroReturnValue([], 1, '', None)
 
     class FakeTempFile():
         name = "/tmp/1"
@@ -128,56 +100,92 @@ class TestVerifyFileIntegrity(TestCaseWithFixtures):
         def read(self):
             return ""
 
+    def setUp(self):
+        super(TestVerifyFileIntegrity, self).setUp()
+        self.tempdir = self.useFixture(CreateTempDirFixture()).get_temp_dir()
+        for filename in self.filenames_in_shafile:
+            with open(os.path.join(self.tempdir, filename), 'w') as fd:
+                fd.write(filename)
+
+    def write_hash_file(self, algorithm='sha1', digest=None):
+        hash_filename = os.path.join(self.tempdir, "dummy-file.txt")
+        with open(hash_filename, 'w') as fd:
+            for filename in self.filenames_in_shafile:
+                if digest is None:
+                    file_digest = hashlib.new(algorithm, filename).hexdigest()
+                else:
+                    file_digest = digest
+                fd.write('%s  %s\n' % (file_digest, filename))
+        return hash_filename + ".asc"
+
     def test_verify_files(self):
         fixture = self.useFixture(MockCmdRunnerPopenFixture())
         self.useFixture(MockSomethingFixture(tempfile, 'NamedTemporaryFile',
                                              self.FakeTempFile))
-        hash_filename = "dummy-file.txt"
-        signature_filename = hash_filename + ".asc"
+        signature_filename = self.write_hash_file()
         verify_file_integrity([signature_filename])
+        # The hashes are checked in process; only gpg is run.
         self.assertEqual(
             ['gpg --status-file=%s --verify %s' % (self.FakeTempFile.name,
-                                                   signature_filename),
-             'sha1sum -c %s' % hash_filename],
+                                                   signature_filename)],
             fixture.mock.commands_executed)
 
     def test_verify_files_returns_files(self):
-        self.useFixture(MockSomethingFixture(cmd_runner, 'Popen',
-                                             self.MockCmdRunnerPopen()))
-        hash_filename = "dummy-file.txt"
-        signature_filename = hash_filename + ".asc"
+        self.useFixture(MockCmdRunnerPopenFixture())
+        signature_filename = self.write_hash_file()
+        verified_files, _, _ = verify_file_integrity([signature_filename])
+        self.assertEqual(self.filenames_in_shafile, verified_files)
+
+    def test_verify_files_sha256(self):
+        self.useFixture(MockCmdRunnerPopenFixture())
+        signature_filename = self.write_hash_file(algorithm='sha256')
         verified_files, _, _ = verify_file_integrity([signature_filename])
         self.assertEqual(self.filenames_in_shafile, verified_files)
 
+    def test_verify_files_invalid_hash_file(self):
+        logging.getLogger().setLevel(100)  # Disable logging messages to screen
+        self.useFixture(MockCmdRunnerPopenFixture())
+        signature_filename = self.write_hash_file(digest='not-a-digest')
+        verified_files, _, _ = verify_file_integrity([signature_filename])
+        self.assertEqual([], verified_files)
+        logging.getLogger().setLevel(logging.WARNING)
+
     def test_check_file_integrity_and_print_errors(self):
-        self.useFixture(MockSomethingFixture(cmd_runner, 'Popen',
-                                             self.MockCmdRunnerPopen()))
-        hash_filename = "dummy-file.txt"
-        signature_filename = hash_filename + ".asc"
+        self.useFixture(MockCmdRunnerPopenFixture())
+        signature_filename = self.write_hash_file()
         result, verified_files = check_file_integrity_and_log_errors(
             [signature_filename],
             self.filenames_in_shafile[0],
             [self.filenames_in_shafile[1]])
         self.assertEqual(self.filenames_in_shafile, verified_files)
 
-        # The sha1sums are faked as passing and all commands return 0, so
-        # it should look like GPG passed
+        # The hashes match and all commands return 0, so it should look like
+        # GPG passed
         self.assertTrue(result)
 
+    def test_check_file_integrity_unpack_checked(self):
+        self.useFixture(MockCmdRunnerPopenFixture())
+        signature_filename = self.write_hash_file()
+        binary = os.path.join(self.tempdir, self.filenames_in_shafile[0])
+        result, verified_files = check_file_integrity_and_log_errors(
+            [signature_filename], binary, [self.filenames_in_shafile[1]],
+            unpack_checked=[binary])
+        self.assertTrue(result)
+        # The binary is left to be checked while it's unpacked.
+        self.assertEqual(self.filenames_in_shafile[1:], verified_files)
+
     def test_check_file_integrity_and_print_errors_fail_sha1sum(self):
         logging.getLogger().setLevel(100)  # Disable logging messages to screen
-        self.useFixture(MockSomethingFixture(
-            cmd_runner, 'Popen', self.MockCmdRunnerPopen_sha1sum_fail()))
-        hash_filename = "dummy-file.txt"
-        signature_filename = hash_filename + ".asc"
+        self.useFixture(MockCmdRunnerPopenFixture())
+        signature_filename = self.write_hash_file(digest='0' * 40)
         result, verified_files = check_file_integrity_and_log_errors(
             [signature_filename],
             self.filenames_in_shafile[0],
             [self.filenames_in_shafile[1]])
         self.assertEqual([], verified_files)
 
-        # The sha1sums are faked as failing and all commands return 0, so
-        # it should look like GPG passed
+        # The hashes don't match and all commands return 0, so it should
+        # look like GPG passed
         self.assertFalse(result)
         logging.getLogger().setLevel(logging.WARNING)
 
@@ -185,16 +193,15 @@ class TestVerifyFileIntegrity(TestCaseWithFixtures):
         logging.getLogger().setLevel(100)  # Disable logging messages to screen
         self.useFixture(MockSomethingFixture(
             cmd_runner, 'Popen', self.MockCmdRunnerPopen_wait_fails()))
-        hash_filename = "dummy-file.txt"
-        signature_filename = hash_filename + ".asc"
+        signature_filename = self.write_hash_file()
         result, verified_files = check_file_integrity_and_log_errors(
             [signature_filename],
             self.filenames_in_shafile[0],
             [self.filenames_in_shafile[1]])
         self.assertEqual([], verified_files)
 
-        # The sha1sums are faked as passing and all commands return 1, so
-        # it should look like GPG failed
+        # The hashes match and all commands return 1, so it should look like
+        # GPG failed
         self.assertFalse(result)
         logging.getLogger().setLevel(logging.WARNING)
 
@@ -331,6 +338,16 @@ class TestPrepMediaPath(TestCaseWithFixtures):
                                               device="testdevice",
                                               board="testboard")))
 
+    def test_prep_media_path_with_device(self):
+        self.useFixture(MockSomethingFixture(os.path, 'abspath', lambda x: x))
+        self.useFixture(MockSomethingFixture(os, "makedirs", lambda x: x))
+
+        self.assertEqual("/foo/bar/other.img",
+                         prep_media_path(Args(directory="/foo/bar",
+                                              device="testdevice",
+                                              board="testboard"),
+                                         device="other.img"))
+
 
 class TestAdditionalOptionChecks(TestCaseWithFixtures):
 
@@ -350,6 +367,24 @@ class TestAdditionalOptionChecks(TestCaseWithFixtures):
                                board="testboard"))
         sys.argv.remove("--mmc")
 
+    def test_batch_with_dev_or_hwpack(self):
+        class BatchArgs:
+            def __init__(self, dev=None, hwpacks=[]):
+                self.batch = 'targets.txt'
+                self.directory = None
+                self.dev = dev
+                self.hwpacks = hwpacks
+
+        # Nothing to complain about.
+        additional_option_checks(BatchArgs())
+        self.assertRaises(IncompatibleOptions, additional_option_checks,
+                          BatchArgs(dev='panda'))
+        fd, hwpack = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, hwpack)
+        self.assertRaises(IncompatibleOptions, additional_option_checks,
+                          BatchArgs(hwpacks=[hwpack]))
+
 
 class TestAndroidOptionChecks(TestCaseWithFixtures):
 
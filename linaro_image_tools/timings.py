@@ -0,0 +1,186 @@
+# Copyright (C) 2026 Linaro
+#
+# This file is part of Linaro Image Tools.
+#
+# Linaro Image Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linaro Image Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linaro Image Tools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record how long each phase of a run takes and what resources it uses.
+
+Wrap each phase in phase() and call report_at_exit() to have the results
+written as JSON, and logged as a table, when the process exits.  For every
+phase we record the wall clock time, the user and system CPU time of this
+process and of its (waited for) children, the peak RSS of both and the bytes
+read from and written to storage, as counted in /proc/self/io.
+
+CPU time and I/O are accounted per process, so when phases run concurrently
+(e.g. with linaro-media-create --jobs) each of them is also charged for
+whatever the others did in the meantime.
+"""
+
+from contextlib import contextmanager
+import atexit
+import json
+import logging
+import resource
+import threading
+import time
+
+from linaro_image_tools.utils import DEFAULT_LOGGER_NAME
+
+logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+PROC_IO = '/proc/self/io'
+
+_lock = threading.Lock()
+_phases = []
+
+
+def _read_io():
+    """Return the (read_bytes, write_bytes) of this process and its children.
+
+    Return (None, None) if the kernel doesn't provide that information.
+    """
+    counters = {}
+    try:
+        with open(PROC_IO) as fd:
+            for line in fd:
+                key, value = line.split(':', 1)
+                counters[key.strip()] = int(value)
+    except (IOError, ValueError):
+        return None, None
+    return counters.get('read_bytes'), counters.get('write_bytes')
+
+
+def _snapshot():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, write_bytes = _read_io()
+    return dict(
+        wall=time.time(),
+        user=own.ru_utime + children.ru_utime,
+        system=own.ru_stime + children.ru_stime,
+        maxrss=own.ru_maxrss,
+        children_maxrss=children.ru_maxrss,
+        read_bytes=read_bytes,
+        write_bytes=write_bytes)
+
+
+def _delta(end, start, key):
+    if end[key] is None or start[key] is None:
+        return None
+    return end[key] - start[key]
+
+
+@contextmanager
+def phase(name):
+    """A context manager that records the resources used by its body.
+
+    The phase is recorded even if the body raises an exception.
+    """
+    start = _snapshot()
+    try:
+        yield
+    finally:
+        end = _snapshot()
+        record = dict(
+            name=name,
+            wall=end['wall'] - start['wall'],
+            user=end['user'] - start['user'],
+            system=end['system'] - start['system'],
+            # ru_maxrss is in kilobytes and is a high-water mark, so the
+            # value at the end of the phase is the peak up to that point.
+            maxrss_kb=end['maxrss'],
+            children_maxrss_kb=end['children_maxrss'],
+            read_bytes=_delta(end, start, 'read_bytes'),
+            write_bytes=_delta(end, start, 'write_bytes'))
+        with _lock:
+            _phases.append(record)
+
+
+def timed(name, func):
+    """Return a callable that runs func() inside phase(name)."""
+    def wrapper(*args, **kwargs):
+        with phase(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def get_phases():
+    """Return the phases recorded so far, in the order they finished."""
+    with _lock:
+        return list(_phases)
+
+
+def reset():
+    """Forget all the phases recorded so far."""
+    with _lock:
+        del _phases[:]
+
+
+def write_report(path):
+    """Write the phases recorded so far to the given file, as JSON."""
+    with open(path, 'w') as fd:
+        json.dump({'phases': get_phases()}, fd, indent=2)
+
+
+def format_bytes(value):
+    if value is None:
+        return '-'
+    for unit in ('B', 'K', 'M'):
+        if value < 1024:
+            return '%d%s' % (value, unit)
+        value /= 1024.0
+    return '%.1fG' % value
+
+
+def format_report(phases=None):
+    """Return the given (or recorded) phases as a human-readable table."""
+    if phases is None:
+        phases = get_phases()
+    header = ('Phase', 'Wall', 'User', 'System', 'Peak RSS', 'Children RSS',
+              'Read', 'Written')
+    rows = [header]
+    for record in phases:
+        rows.append((
+            record['name'],
+            '%.1fs' % record['wall'],
+            '%.1fs' % record['user'],
+            '%.1fs' % record['system'],
+            format_bytes(record['maxrss_kb'] * 1024),
+            format_bytes(record['children_maxrss_kb'] * 1024),
+            format_bytes(record['read_bytes']),
+            format_bytes(record['write_bytes'])))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells.extend(
+            cell.rjust(width) for cell, width in zip(row[1:], widths[1:]))
+        lines.append('  '.join(cells))
+    return '\n'.join(lines)
+
+
+def report_at_exit(path):
+    """Write the report to path and log it as a table when we exit.
+
+    Should be registered before any other atexit handler whose work is to be
+    included in the report, as atexit handlers run in reverse order.
+    """
+    def report():
+        try:
+            write_report(path)
+        except IOError, e:
+            logger.error("Could not write timings to %s: %s" % (path, e))
+        logger.info("Timings:\n%s" % format_report())
+    atexit.register(report)
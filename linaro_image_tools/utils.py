@@ -27,6 +27,10 @@ import tarfile
 import sys
 
 from linaro_image_tools import cmd_runner
+from linaro_image_tools.file_hashes import (
+    InvalidHashFile,
+    check_hash_files,
+)
 
 DEFAULT_LOGGER_NAME = 'linaro_image_tools'
 
@@ -98,23 +102,31 @@ def path_in_tarfile_exists(path, tar_file):
         return exists
 
 
-def verify_file_integrity(sig_file_list):
+def verify_file_integrity(sig_file_list, hash_cache=None, unpack_checked=()):
     """Verify a list of signature files.
 
     The parameter is a list of filenames of gpg signature files which will be
     verified using gpg. For each of the files it is assumed that there is an
-    sha1 hash file with the same file name minus the '.asc' extension.
-
-    Each of the sha1 files will be checked using sha1sums. All files listed in
-    the sha1 hash file must be found in the same directory as the hash file.
+    sha1 or sha256 hash file with the same file name minus the '.asc'
+    extension.
+
+    The files listed in the hash files are then hashed, in parallel, and
+    checked against them. All files listed in a hash file must be found in
+    the same directory as the hash file.
+
+    :param hash_cache: A file_hashes.HashCache to reuse the digests of files
+        that haven't changed since they were last hashed.
+    :param unpack_checked: The paths of files whose digests are checked
+        while they are unpacked instead; they are not hashed here, nor
+        included in the returned list.
     """
 
     gpg_sig_ok = True
     gpg_out = ""
 
-    verified_files = []
+    hash_files = []
     for sig_file in sig_file_list:
-        hash_file = sig_file[0:-len('.asc')]
+        hash_files.append(sig_file[0:-len('.asc')])
         tmp = tempfile.NamedTemporaryFile()
 
         try:
@@ -126,35 +138,30 @@ def verify_file_integrity(sig_file_list):
 
         tmp.close()
 
-        if os.path.dirname(hash_file) == '':
-            sha_cwd = None
-        else:
-            sha_cwd = os.path.dirname(hash_file)
-
-        try:
-            sha1sums_out, _ = cmd_runner.Popen(
-                ['sha1sum', '-c', hash_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                cwd=sha_cwd
-            ).communicate()
-        except cmd_runner.SubcommandNonZeroReturnValue as inst:
-            sha1sums_out = inst.stdout
-
-        for line in sha1sums_out.splitlines():
-            sha1_check = re.search(r'^(.*):\s+OK', line)
-            if sha1_check:
-                verified_files.append(sha1_check.group(1))
+    try:
+        verified_files = check_hash_files(
+            hash_files, hash_cache,
+            skip=[os.path.basename(path) for path in unpack_checked])
+    except (IOError, InvalidHashFile) as inst:
+        logging.getLogger(__name__).error(
+            "Could not read hash file: {0}".format(inst))
+        verified_files = []
 
     return verified_files, gpg_sig_ok, gpg_out
 
 
-def check_file_integrity_and_log_errors(sig_file_list, binary, hwpacks):
+def check_file_integrity_and_log_errors(sig_file_list, binary, hwpacks,
+                                        hash_cache=None, unpack_checked=()):
     """
     Wrapper around verify_file_integrity that prints error messages to stderr
     if verify_file_integrity finds any problems.
+
+    The files in unpack_checked are taken as verified here, as their digests
+    are checked while they are unpacked.
     """
-    verified_files, gpg_sig_pass, _ = verify_file_integrity(sig_file_list)
+    verified_files, gpg_sig_pass, _ = verify_file_integrity(
+        sig_file_list, hash_cache, unpack_checked)
+    unpack_checked = [os.path.basename(path) for path in unpack_checked]
 
     # Check the outputs from verify_file_integrity
     # Abort if anything fails.
@@ -164,12 +171,14 @@ def check_file_integrity_and_log_errors(sig_file_list, binary, hwpacks):
             logger.error("GPG signature verification failed.")
             return False, []
 
-        if not os.path.basename(binary) in verified_files:
+        if not (os.path.basename(binary) in verified_files or
+                os.path.basename(binary) in unpack_checked):
             logger.error("OS Binary verification failed")
             return False, []
 
         for hwpack in hwpacks:
-            if not os.path.basename(hwpack) in verified_files:
+            if not (os.path.basename(hwpack) in verified_files or
+                    os.path.basename(hwpack) in unpack_checked):
                 logger.error("Hwpack {0} verification failed".format(hwpack))
                 return False, []
 
@@ -291,7 +300,13 @@ def preferred_tools_dir():
     return prefer_dir
 
 
-def prep_media_path(args):
+def prep_media_path(args, device=None):
+    """Return the path of the media to write to.
+
+    :param device: The device or image file; defaults to args.device.
+    """
+    if device is None:
+        device = args.device
     if args.directory is not None:
         loc = os.path.abspath(args.directory)
         try:
@@ -300,9 +315,9 @@ def prep_media_path(args):
             # Directory exists.
             pass
 
-        path = os.path.join(loc, args.device)
+        path = os.path.join(loc, device)
     else:
-        path = args.device
+        path = device
 
     return path
 
@@ -354,6 +369,12 @@ def additional_option_checks(args):
             raise InvalidHwpackFile(
                 "--hwpack argument (%s) is not a regular file" % hwpack)
 
+    # The boards and hwpacks come from the batch file, so these would be
+    # ignored.
+    if args.batch is not None and (args.dev is not None or args.hwpacks):
+        raise IncompatibleOptions("--batch option incompatible with options "
+                                  "--dev and --hwpack")
+
 
 def additional_android_option_checks(args):
     """Checks that some of the args passed to l-a-m-c are valid."""
@@ -378,8 +399,12 @@ def andorid_hwpack_in_boot_tarball(boot_dir):
 
 def check_required_args(args):
     """Check that the required args are passed."""
-    if args.dev is None:
-        raise MissingRequiredOption("--dev option is required")
+    # In batch mode the boards and hwpacks come from the batch file.
+    if args.batch is None:
+        if args.dev is None:
+            raise MissingRequiredOption("--dev option is required")
+        if not args.hwpacks:
+            raise MissingRequiredOption("--hwpack option is required")
     if args.binary is None:
         raise MissingRequiredOption("--binary option is required")
 